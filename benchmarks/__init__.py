@@ -0,0 +1 @@
+# Офлайн-бенчмарки. Запуск из корня репозитория: python -m benchmarks.<модуль>
@@ -0,0 +1,141 @@
+# Расход памяти на одно закэшированное сообщение: старый формат записи
+# (dict с полным объектом Message) против CachedMessage. С --accounts N -
+# ещё N аккаунтов в одной супергруппе: отдельные копии записей против
+# общего хранилища (content_store.py).
+#
+#   python -m benchmarks.cache_memory [--messages 20000] [--media-ratio 0.3] [--accounts 5]
+
+import gc
+import sys
+import time
+import argparse
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.fake_tl import make_message, random_media_kind, seeded_random
+from message_cache import MessageCache, CachedMessage, media_ref_from_media
+from content_store import ContentStore
+
+GROUP_ID = -1001500000000
+
+
+def generate(count, media_ratio, seed):
+    rnd = seeded_random(seed)
+    chats = [rnd.randint(100_000, 9_000_000) for _ in range(max(1, count // 50))]
+    for msg_id in range(1, count + 1):
+        chat_id = rnd.choice(chats)
+        yield make_message(msg_id, chat_id, rnd, random_media_kind(rnd, media_ratio))
+
+
+def fill_legacy(messages):
+    # Формат записи до перехода на CachedMessage
+    cache = {}
+    for message in messages:
+        chat = message._chat
+        cache[message.id] = {
+            'text': message.message or '',
+            'media': message.media,
+            'message': message,
+            'chat_id': chat.id,
+            'chat_name': getattr(chat, 'title', None) or getattr(chat, 'first_name', 'Unknown'),
+            'date': datetime.now()
+        }
+    return cache
+
+
+def fill_compact(messages):
+    cache = MessageCache(max_entries=sys.maxsize, max_bytes=sys.maxsize)
+    for message in messages:
+        chat = message._chat
+        chat_name = getattr(chat, 'title', None) or getattr(chat, 'first_name', 'Unknown')
+        cache.put(message.id, CachedMessage(
+            message.message or '',
+            chat.id,
+            cache.chat_name_idx(chat_name),
+            int(time.time()),
+            media_ref_from_media(message.media) if message.media else None
+        ))
+    return cache
+
+
+def fill_accounts(messages, accounts, store):
+    # Все аккаунты получают каждое сообщение группы; store=None - копия на аккаунт
+    caches = [MessageCache(max_entries=sys.maxsize, max_bytes=sys.maxsize, store=store)
+              for _ in range(accounts)]
+    for message in messages:
+        chat = message._chat
+        chat_name = getattr(chat, 'title', None) or getattr(chat, 'first_name', 'Unknown')
+        key = (GROUP_ID, message.id)
+        for cache in caches:
+            record = store.message(key) if store is not None else None
+            if record is None:
+                media = message.media
+                if media and store is not None:
+                    media = store.media_ref(media)
+                elif media:
+                    media = media_ref_from_media(media)
+                # Каждый аккаунт получает свою копию текста из своего обновления
+                text = (message.message or '').encode('utf-8').decode('utf-8')
+                record = CachedMessage(
+                    text, chat.id, cache.chat_name_idx(chat_name), int(time.time()), media
+                )
+            cache.put(key, record)
+    return caches
+
+
+def measure(fill, count, media_ratio, seed):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    cache = fill(generate(count, media_ratio, seed))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return cache, used, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память на одно закэшированное сообщение')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--media-ratio', type=float, default=0.3)
+    parser.add_argument('--accounts', type=int, default=1, help='аккаунтов в одной группе')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    legacy, legacy_bytes, legacy_time = measure(fill_legacy, args.messages, args.media_ratio, args.seed)
+    del legacy
+    compact, compact_bytes, compact_time = measure(fill_compact, args.messages, args.media_ratio, args.seed)
+
+    print(f"Сообщений: {args.messages}, доля медиа: {args.media_ratio:.0%}")
+    print(f"{'формат':<16}{'байт/сообщение':>16}{'всего, МБ':>12}{'время, с':>10}")
+    print(f"{'dict + Message':<16}{legacy_bytes / args.messages:>16.0f}"
+          f"{legacy_bytes / 1024 / 1024:>12.1f}{legacy_time:>10.2f}")
+    print(f"{'CachedMessage':<16}{compact_bytes / args.messages:>16.0f}"
+          f"{compact_bytes / 1024 / 1024:>12.1f}{compact_time:>10.2f}")
+    print(f"Оценка MessageCache.bytes: {compact.bytes / args.messages:.0f} байт/сообщение")
+    print(f"Экономия: {legacy_bytes / max(compact_bytes, 1):.1f}x")
+
+    if args.accounts > 1:
+        del compact
+        copies, copies_bytes, copies_time = measure(
+            lambda messages: fill_accounts(messages, args.accounts, None),
+            args.messages, args.media_ratio, args.seed
+        )
+        del copies
+        shared, shared_bytes, shared_time = measure(
+            lambda messages: fill_accounts(messages, args.accounts, ContentStore()),
+            args.messages, args.media_ratio, args.seed
+        )
+        print(f"\nАккаунтов в одной группе: {args.accounts}")
+        print(f"{'копии':<16}{copies_bytes / args.messages:>16.0f}"
+              f"{copies_bytes / 1024 / 1024:>12.1f}{copies_time:>10.2f}")
+        print(f"{'общие записи':<16}{shared_bytes / args.messages:>16.0f}"
+              f"{shared_bytes / 1024 / 1024:>12.1f}{shared_time:>10.2f}")
+        print(f"Экономия: {copies_bytes / max(shared_bytes, 1):.1f}x, "
+              f"оценка ContentStore.saved_bytes: {shared[0].store.saved_bytes / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == '__main__':
+    main()
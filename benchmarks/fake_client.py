@@ -0,0 +1,179 @@
+# Заглушки TelegramClient для офлайн-бенчмарков: без сети, с настраиваемой задержкой.
+#
+# FakeBot записывает все вызовы и может отвечать FloodWait с заданной
+# вероятностью, FakeUserClient хранит обработчики событий и вызывает их
+# из emit() - так через обработчики main.py прогоняются синтетические события.
+
+import os
+import random
+import asyncio
+
+# Размер части при скачивании/загрузке, как у Telethon по умолчанию
+PART_SIZE = 128 * 1024
+_PART = os.urandom(PART_SIZE)
+
+
+class FloodWaitError(Exception):
+    # Код проверяет type(e).__name__ и e.seconds, как у telethon.errors.FloodWaitError
+    def __init__(self, seconds):
+        super().__init__(f'A wait of {seconds} seconds is required')
+        self.seconds = seconds
+
+
+class FakeClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.downloaded_bytes = 0
+
+    async def download_file(self, input_location, file=None, *, file_size=None, dc_id=None, **kwargs):
+        size = file_size or PART_SIZE
+        close = False
+        if isinstance(file, str):
+            file = open(file, 'wb')
+            close = True
+        try:
+            remaining = size
+            while remaining > 0:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                chunk = _PART if remaining >= PART_SIZE else _PART[:remaining]
+                file.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            if close:
+                file.close()
+        self.downloaded_bytes += size
+        return file
+
+
+class FakeBot:
+    def __init__(self, latency=0.0, flood_rate=0.0, flood_seconds=1, seed=42):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.sent_messages = []
+        self.calls = []  # (метод, entity, время вызова)
+        self.flood_waits = 0
+        self.uploaded_bytes = 0
+        self._random = random.Random(seed)
+
+    async def _call(self, method, entity):
+        self.calls.append((method, entity, asyncio.get_running_loop().time()))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self._random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(self.flood_seconds)
+
+    async def send_message(self, entity, message=None, **kwargs):
+        await self._call('send_message', entity)
+        self.sent_messages.append((entity, message, kwargs))
+
+    async def send_file(self, entity, file, **kwargs):
+        await self._call('send_file', entity)
+        # Читаем файлы частями, как при загрузке на сервер; альбом - список файлов
+        for item in file if isinstance(file, (list, tuple)) else (file,):
+            close = False
+            if isinstance(item, str):
+                item = open(item, 'rb')
+                close = True
+            try:
+                while True:
+                    chunk = item.read(512 * 1024)
+                    if not chunk:
+                        break
+                    self.uploaded_bytes += len(chunk)
+            finally:
+                if close:
+                    item.close()
+
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        await self._call('delete_messages', entity)
+
+
+class FakeUserClient(FakeClient):
+    # Клиент аккаунта: обработчики регистрируются через on(), события - через emit().
+    # Фильтры событий (incoming, chats + blacklist_chats, func) проверяются, как в Telethon
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.handlers = {}  # имя события (NewMessage, MessageDeleted...) -> [(обработчик, фильтр)]
+        self.connected = True
+        self.filtered = 0
+
+    def on(self, event):
+        def decorator(handler):
+            self.add_event_handler(handler, event)
+            return handler
+        return decorator
+
+    def add_event_handler(self, handler, event):
+        if isinstance(event, type):
+            # Класс события без параметров - без фильтров
+            self.handlers.setdefault(event.__name__, []).append((handler, None))
+            return
+        chats = getattr(event, 'chats', None)
+        event_filter = (
+            getattr(event, 'incoming', None),
+            frozenset(chats) if chats is not None else None,
+            getattr(event, 'blacklist_chats', False),
+            getattr(event, 'func', None),
+        )
+        self.handlers.setdefault(type(event).__name__, []).append((handler, event_filter))
+
+    def remove_event_handler(self, handler, event=None):
+        for name, handlers in self.handlers.items():
+            self.handlers[name] = [entry for entry in handlers if entry[0] is not handler]
+
+    def _accepts(self, event_filter, event):
+        incoming, chats, blacklist_chats, func = event_filter
+        if incoming and event.message.out:
+            return False
+        if chats is not None and (event.chat_id in chats) == blacklist_chats:
+            return False
+        return func is None or func(event)
+
+    async def emit(self, name, event):
+        for handler, event_filter in self.handlers.get(name, ()):
+            if event_filter is not None and not self._accepts(event_filter, event):
+                self.filtered += 1
+                continue
+            await handler(event)
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def catch_up(self):
+        pass
+
+    async def get_messages(self, entity, limit=1, offset_id=0, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return []
+
+    async def iter_dialogs(self, *args, **kwargs):
+        return
+        yield
+
+
+class NewMessageEvent:
+    # Поля events.NewMessage.Event, которые читают обработчики и фильтры
+    def __init__(self, message, chat_id, chat, is_channel=False):
+        self.message = message
+        self.chat_id = chat_id
+        self.chat = chat
+        self.is_channel = is_channel
+        self.is_private = not is_channel
+        self.is_group = is_channel and bool(getattr(chat, 'megagroup', False))
+
+    async def get_chat(self):
+        return self.chat
+
+
+class MessageDeletedEvent:
+    # chat_id известен только для каналов и супергрупп, как в Telethon
+    def __init__(self, deleted_ids, chat_id=None):
+        self.deleted_ids = deleted_ids
+        self.chat_id = chat_id
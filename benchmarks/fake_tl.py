@@ -0,0 +1,206 @@
+# Заглушки TL-объектов Telethon для офлайн-бенчмарков.
+#
+# Имена классов и набор полей повторяют telethon.tl.types, поэтому код,
+# который смотрит на type(obj).__name__ и атрибуты (message_cache.py),
+# работает с ними так же, как с настоящими объектами. Как и в Telethon,
+# это обычные классы с __dict__, так что расход памяти сопоставим.
+
+import os
+import random
+from datetime import datetime, timezone
+
+
+class TLObject:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class PeerUser(TLObject): pass
+class PeerChat(TLObject): pass
+class PeerChannel(TLObject): pass
+class User(TLObject): pass
+class Channel(TLObject): pass
+class Chat(TLObject): pass
+class MessageEntityBold(TLObject): pass
+class MessageEntityUrl(TLObject): pass
+class MessageReplyHeader(TLObject): pass
+class MessageFwdHeader(TLObject): pass
+class MessageMediaPhoto(TLObject): pass
+class MessageMediaDocument(TLObject): pass
+class MessageMediaGeo(TLObject): pass
+class GeoPoint(TLObject): pass
+class Photo(TLObject): pass
+class PhotoSize(TLObject): pass
+class PhotoStrippedSize(TLObject): pass
+class PhotoSizeProgressive(TLObject): pass
+class Document(TLObject): pass
+class DocumentAttributeFilename(TLObject): pass
+class DocumentAttributeAudio(TLObject): pass
+class DocumentAttributeVideo(TLObject): pass
+class DocumentAttributeImageSize(TLObject): pass
+class Message(TLObject):
+    @property
+    def text(self):
+        # В telethon.tl.custom.Message text - это message с разметкой
+        return self.message
+
+
+MEDIA_KINDS = ('photo', 'video', 'voice', 'round', 'document', 'geo')
+
+
+def make_user(user_id, rnd):
+    return User(
+        id=user_id, is_self=False, contact=rnd.random() < 0.3, mutual_contact=False,
+        deleted=False, bot=False, bot_chat_history=False, bot_nochats=False,
+        verified=False, restricted=False, min=False, bot_inline_geo=False,
+        support=False, scam=False, apply_min_photo=True, fake=False,
+        bot_attach_menu=False, premium=rnd.random() < 0.1, attach_menu_enabled=False,
+        bot_can_edit=False, close_friend=False, stories_hidden=False,
+        stories_unavailable=True, contact_require_premium=False,
+        bot_business=False, bot_has_main_app=False,
+        access_hash=rnd.getrandbits(63), first_name=f'User {user_id}',
+        last_name=None, username=f'user{user_id}', phone=None, photo=None,
+        status=None, bot_info_version=None, restriction_reason=[],
+        bot_inline_placeholder=None, lang_code='ru', emoji_status=None,
+        usernames=[], stories_max_id=None, color=None, profile_color=None,
+        bot_active_users=None,
+    )
+
+
+def make_channel(channel_id, rnd):
+    return Channel(
+        id=channel_id, title=f'Group {channel_id}', photo=None,
+        date=datetime.now(timezone.utc), creator=False, left=False,
+        broadcast=False, verified=False, megagroup=True, restricted=False,
+        signatures=False, min=False, scam=False, has_link=False, has_geo=False,
+        slowmode_enabled=False, call_active=False, call_not_empty=False,
+        fake=False, gigagroup=False, noforwards=False, join_to_send=False,
+        join_request=False, forum=False, stories_hidden=False,
+        stories_hidden_min=False, stories_unavailable=True,
+        access_hash=rnd.getrandbits(63), username=None, restriction_reason=[],
+        admin_rights=None, banned_rights=None, default_banned_rights=None,
+        participants_count=None, usernames=[], stories_max_id=None,
+        color=None, profile_color=None, emoji_status=None, level=None,
+    )
+
+
+def make_media(kind, rnd):
+    if kind == 'photo':
+        return MessageMediaPhoto(
+            spoiler=False, ttl_seconds=None,
+            photo=Photo(
+                id=rnd.getrandbits(63), access_hash=rnd.getrandbits(63),
+                file_reference=os.urandom(29), date=datetime.now(timezone.utc),
+                dc_id=2, has_stickers=False, video_sizes=[],
+                sizes=[
+                    PhotoStrippedSize(type='i', bytes=os.urandom(120)),
+                    PhotoSize(type='m', w=320, h=240, size=15000),
+                    PhotoSizeProgressive(type='y', w=1280, h=960,
+                                         sizes=[10000, 40000, 90000, 150000]),
+                ],
+            ),
+        )
+    if kind == 'geo':
+        return MessageMediaGeo(geo=GeoPoint(long=37.6, lat=55.7,
+                                            access_hash=rnd.getrandbits(63),
+                                            accuracy_radius=None))
+
+    attributes = []
+    mime = 'application/pdf'
+    size = rnd.randint(10_000, 5_000_000)
+    if kind == 'video':
+        mime = 'video/mp4'
+        attributes.append(DocumentAttributeVideo(
+            duration=12.5, w=720, h=1280, round_message=False,
+            supports_streaming=True, nosound=False, preload_prefix_size=None))
+        attributes.append(DocumentAttributeFilename(file_name='video.mp4'))
+    elif kind == 'voice':
+        mime = 'audio/ogg'
+        size = rnd.randint(5_000, 300_000)
+        attributes.append(DocumentAttributeAudio(
+            duration=7, voice=True, title=None, performer=None,
+            waveform=os.urandom(63)))
+    elif kind == 'round':
+        mime = 'video/mp4'
+        attributes.append(DocumentAttributeVideo(
+            duration=9.0, w=384, h=384, round_message=True,
+            supports_streaming=True, nosound=False, preload_prefix_size=None))
+    else:
+        attributes.append(DocumentAttributeFilename(file_name='report.pdf'))
+
+    return MessageMediaDocument(
+        nopremium=False, spoiler=False, video=kind in ('video', 'round'),
+        round=kind == 'round', voice=kind == 'voice', ttl_seconds=None,
+        alt_documents=None,
+        document=Document(
+            id=rnd.getrandbits(63), access_hash=rnd.getrandbits(63),
+            file_reference=os.urandom(29), date=datetime.now(timezone.utc),
+            mime_type=mime, size=size, dc_id=2, attributes=attributes,
+            thumbs=[PhotoStrippedSize(type='i', bytes=os.urandom(100))]
+            if kind in ('video', 'round') else None,
+            video_thumbs=None,
+        ),
+    )
+
+
+def make_message(msg_id, chat_id, rnd, media_kind=None, is_channel=False, text=None):
+    if text is None:
+        text = ' '.join(rnd.choice(('привет', 'как дела', 'ок', 'созвонимся',
+                                    'hello', 'файл', 'завтра', 'спасибо'))
+                        for _ in range(rnd.randint(1, 25)))
+    sender = make_user(rnd.randint(10_000, 10_000_000), rnd)
+    chat = make_channel(chat_id, rnd) if is_channel else sender
+    peer = PeerChannel(channel_id=chat_id) if is_channel else PeerUser(user_id=chat_id)
+    entities = []
+    if rnd.random() < 0.2:
+        entities.append(MessageEntityBold(offset=0, length=min(5, len(text))))
+    if rnd.random() < 0.1:
+        entities.append(MessageEntityUrl(offset=0, length=min(10, len(text))))
+
+    return Message(
+        id=msg_id, peer_id=peer, date=datetime.now(timezone.utc), message=text,
+        out=False, mentioned=False, media_unread=False, silent=False, post=False,
+        from_scheduled=False, legacy=False, edit_hide=False, pinned=False,
+        noforwards=False, invert_media=False, offline=False,
+        video_processing_pending=False,
+        from_id=PeerUser(user_id=sender.id), from_boosts_applied=None,
+        saved_peer_id=None,
+        fwd_from=MessageFwdHeader(imported=False, saved_out=False,
+                                  date=datetime.now(timezone.utc),
+                                  from_id=PeerUser(user_id=sender.id),
+                                  from_name=None, channel_post=None,
+                                  post_author=None, saved_from_peer=None,
+                                  saved_from_msg_id=None, psa_type=None)
+        if rnd.random() < 0.05 else None,
+        via_bot_id=None, via_business_bot_id=None,
+        reply_to=MessageReplyHeader(reply_to_scheduled=False, forum_topic=False,
+                                    quote=False, reply_to_msg_id=max(1, msg_id - 1),
+                                    reply_to_peer_id=None, reply_from=None,
+                                    reply_media=None, reply_to_top_id=None,
+                                    quote_text=None, quote_entities=None,
+                                    quote_offset=None)
+        if rnd.random() < 0.3 else None,
+        media=make_media(media_kind, rnd) if media_kind else None,
+        reply_markup=None, entities=entities, views=None, forwards=None,
+        replies=None, edit_date=None, post_author=None, grouped_id=None,
+        reactions=None, restriction_reason=[], ttl_period=None,
+        quick_reply_shortcut_id=None, effect=None, factcheck=None,
+        report_delivery_until_date=None, paid_message_stars=None,
+        # Поля telethon.tl.custom.Message
+        _client=None, _text=None, _file=None, _reply_message=None,
+        _buttons=None, _buttons_flat=None, _buttons_count=None,
+        _via_bot=None, _via_input_bot=None, _action_entities=None,
+        _linked_chat=None, _chat_peer=peer, _input_chat=None, _chat=chat,
+        _broadcast=False, _sender_id=sender.id, _sender=sender,
+        _input_sender=None, _forward=None,
+    )
+
+
+def random_media_kind(rnd, media_ratio=0.3):
+    if rnd.random() >= media_ratio:
+        return None
+    return rnd.choices(MEDIA_KINDS, weights=(45, 15, 20, 5, 10, 5))[0]
+
+
+def seeded_random(seed=42):
+    return random.Random(seed)
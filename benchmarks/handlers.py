@@ -0,0 +1,313 @@
+# Обработчики аккаунтов под нагрузкой, без сети и без настоящих аккаунтов.
+#
+# Синтетический поток NewMessage/MessageDeleted (benchmarks/traces.py) для
+# многих аккаунтов прогоняется через обработчики main.py, зарегистрированные
+# на FakeUserClient; бот управления - FakeBot (запись вызовов, задержка,
+# FloodWait с заданной вероятностью). Фоновые части работают как в боте:
+# запись данных, сводки удалений, очереди уведомлений и исходящих, отчёты.
+#
+# Выводит пропускную способность, p50/p99 обработчиков, время досылки
+# уведомлений и отчётов, пиковый RSS и объём записи на диск
+# (по /proc/self/io, иначе - по размеру рабочего каталога).
+# Нужен установленный telethon (его импортирует main.py), сеть не используется.
+# Лимиты бота по умолчанию сняты, реальные задаются как обычно:
+#   OUTBOUND_RATE=30 OUTBOUND_GROUP_RATE=20 python -m benchmarks.handlers
+#
+#   python -m benchmarks.handlers [--accounts 20] [--messages 100000] [--speed max|1|10]
+#       [--storage json|sqlite] [--disk-cache] [--bot-latency 0.05] [--flood-rate 0.01]
+# Записанная трасса воспроизводится тем же способом: benchmarks/replay.py.
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import contextlib
+import importlib
+
+from benchmarks.fake_client import FakeBot, FakeUserClient, NewMessageEvent, MessageDeletedEvent
+from benchmarks.fake_tl import MEDIA_KINDS, make_message, make_user, make_channel, seeded_random
+from benchmarks.traces import generate_trace, trace_summary
+
+# Помеченный ID канала (как event.chat_id): -100xxxxxxxxxx
+CHANNEL_MARK = -1_000_000_000_000
+
+EVENT_NAMES = {'message': 'NewMessage', 'deleted': 'MessageDeleted'}
+
+
+class _Discard:
+    # Логи обработчиков не должны попадать в замер записи на диск
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def load_app(args, workdir):
+    # main.py читает настройки при импорте: окружение и рабочий каталог - до него
+    os.environ.setdefault('API_ID', '1')
+    os.environ.setdefault('API_HASH', 'bench')
+    os.environ.setdefault('BOT_TOKEN', 'bench')
+    os.environ.setdefault('MAIN_ADMIN_ID', '1')
+    os.environ.setdefault('OUTBOUND_RATE', '1000000')
+    os.environ.setdefault('OUTBOUND_GROUP_RATE', '1000000000')
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ['MESSAGE_DISK_CACHE'] = '1' if args.disk_cache else '0'
+    os.environ['MEDIA_PREFETCH'] = '1' if args.prefetch else '0'
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return importlib.import_module('main')
+
+
+def read_io():
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        return None
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def percentiles(values):
+    values = sorted(values)
+    count = len(values)
+    if not count:
+        return 0.0, 0.0, 0.0
+    return values[count // 2], values[min(count - 1, int(count * 0.99))], values[-1]
+
+
+def build_event(record, chats, rnd):
+    # Чат приходит вместе с обновлением; объекты чатов переиспользуются между событиями
+    if record['type'] == 'deleted':
+        peer = record['peer']
+        return MessageDeletedEvent(record['ids'], CHANNEL_MARK - peer if peer is not None else None)
+
+    peer, channel = record['peer'], record['channel']
+    chat = chats.get((peer, channel))
+    if chat is None:
+        chat = chats[(peer, channel)] = make_channel(peer, rnd) if channel else make_user(peer, rnd)
+    media = record['media']
+    if media and media not in MEDIA_KINDS:
+        # Типы из записанных трасс: audio/sticker - документы, other - нескачиваемое медиа
+        media = 'geo' if media == 'other' else 'document'
+    message = make_message(record['msg_id'], peer, rnd, media, channel)
+    message.out = record['out']
+    if message.media is not None and getattr(message.media, 'document', None) is not None:
+        message.media.document.size = record['size']
+    return NewMessageEvent(message, CHANNEL_MARK - peer if channel else peer, chat, channel)
+
+
+async def run_trace(clients, records, speed=None, seed=42):
+    # speed - во сколько раз быстрее реального времени трассы, None - без пауз.
+    # lag - насколько обработка отставала от времени трассы: если он растёт,
+    # процесс не успевает за таким потоком событий
+    rnd = seeded_random(seed)
+    chats = {}
+    latencies = {kind: [] for kind in EVENT_NAMES}
+    lag = 0.0
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for record in records:
+        if speed:
+            delay = started + record['t'] / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+        event = build_event(record, chats, rnd)
+        client = clients[record['session']]
+        begin = time.perf_counter()
+        await client.emit(EVENT_NAMES[record['type']], event)
+        latencies[record['type']].append(time.perf_counter() - begin)
+        if not speed:
+            # Даём отработать фоновым задачам, как между обновлениями от сервера
+            await asyncio.sleep(0)
+    return latencies, lag, loop.time() - started
+
+
+def setup_accounts(app, records, known_ratio, client_latency, rnd, rules=None):
+    # Часть чатов уже известна (загружена ранее), остальные дадут «новые диалоги»
+    peers = {}
+    for record in records:
+        if record['type'] == 'message':
+            peers.setdefault(record['session'], set()).add(record['peer'])
+    clients = {}
+    for i, (name, session_peers) in enumerate(sorted(peers.items())):
+        dialogs = app.CompactIdSet(peer for peer in sorted(session_peers) if rnd.random() < known_ratio)
+        app.bot_data['accounts'][name] = {
+            'phone': f'+7900{i:07d}',
+            # По пять аккаунтов на группу, часть из них - в общий топик
+            'group_id': CHANNEL_MARK - (1_500_000_000 + i // 5),
+            'thread_id': i + 1 if i % 2 else None,
+            'initialized': True,
+            'dialogs': dialogs,
+        }
+        if rules:
+            # Те же слова, что после имени аккаунта в /rules
+            app.bot_data['accounts'][name]['rules'] = app.update_rules(None, rules.split())
+        client = FakeUserClient(client_latency)
+        app.register_client_handlers(name, client)
+        app.user_clients[name] = client
+        clients[name] = client
+    return clients
+
+
+async def run(app, args, records):
+    rnd = seeded_random(args.seed)
+    clients = setup_accounts(app, records, args.known_ratio, args.client_latency, rnd, args.rules)
+    bot = FakeBot(latency=args.bot_latency, flood_rate=args.flood_rate, seed=args.seed)
+    app.bot = bot
+
+    flushes = []
+    app.persistence.on_flush = flushes.append
+    app.persistence.mark_all_dirty()
+    app.persistence.start()
+    if app.disk_cache:
+        app.disk_cache.start()
+    if app.media_store:
+        app.media_store.start()
+    app.deletion_dispatcher.start()
+    app.outbound.start(bot)
+
+    io_before = read_io()
+    speed = None if args.speed == 'max' else float(args.speed)
+    latencies, lag, elapsed = await run_trace(clients, records, speed, args.seed)
+
+    # Досылка: открытые сводки, очереди уведомлений, затем отчёты по всем аккаунтам
+    started = time.perf_counter()
+    app.deletion_coalescer.flush_all()
+    await app.deletion_dispatcher.close()
+    drain_time = time.perf_counter() - started
+    started = time.perf_counter()
+    await app.send_reports(list(app.bot_data['accounts']))
+    await app.outbound.close()
+    report_time = time.perf_counter() - started
+
+    await app.persistence.close()
+    if app.disk_cache:
+        await app.disk_cache.close()
+    if app.media_store:
+        await app.media_store.close()
+    io_after = read_io()
+
+    return {
+        'records': records,
+        'latencies': latencies,
+        'elapsed': elapsed,
+        'lag': lag,
+        'drain_time': drain_time,
+        'report_time': report_time,
+        'bot': bot,
+        'outbound': app.outbound.stats(),
+        'dispatcher': app.deletion_dispatcher.stats(),
+        'flushes': flushes,
+        'filtered': sum(client.filtered for client in clients.values()),
+        'io': {key: io_after[key] - io_before[key] for key in io_before} if io_before else None,
+    }
+
+
+def add_run_arguments(parser):
+    # Общие параметры прогона для синтетических и записанных трасс
+    parser.add_argument('--speed', default='max', help='max или множитель реального времени трассы')
+    parser.add_argument('--known-ratio', type=float, default=0.8)
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--disk-cache', action='store_true')
+    parser.add_argument('--prefetch', action='store_true')
+    parser.add_argument('--client-latency', type=float, default=0.0)
+    parser.add_argument('--bot-latency', type=float, default=0.0)
+    parser.add_argument('--flood-rate', type=float, default=0.0)
+    parser.add_argument('--rules', default='', help='правила приёма для всех аккаунтов, как в /rules: "private_only"')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help='не скрывать логи бота')
+
+
+def execute(args, records):
+    # Прогон в отдельном рабочем каталоге, логи бота скрыты
+    with tempfile.TemporaryDirectory(prefix='bench-handlers-') as workdir:
+        cwd = os.getcwd()
+        try:
+            app = load_app(args, workdir)
+            with contextlib.ExitStack() as stack:
+                if not args.verbose:
+                    stack.enter_context(contextlib.redirect_stdout(_Discard()))
+                    stack.enter_context(contextlib.redirect_stderr(_Discard()))
+                result = asyncio.run(run(app, args, records))
+            result['written'] = dir_size(workdir)
+        finally:
+            os.chdir(cwd)
+    return result
+
+
+def print_results(result, args):
+    summary = trace_summary(result['records'])
+    events = len(result['records'])
+    written = result['written']
+    print(f"Аккаунтов: {summary['sessions']}, сообщений: {summary['messages']} "
+          f"(с медиа {summary['media']}), удалений: {summary['deleted_ids']} "
+          f"в {summary['deleted_events']} событиях, хранилище: {args.storage}"
+          f"{', дисковый кэш' if args.disk_cache else ''}")
+    print(f"Прогон: {result['elapsed']:.2f} с, {events / result['elapsed']:.0f} событий/с "
+          f"(скорость трассы: {args.speed})")
+    if args.speed != 'max':
+        print(f"Отставание от трассы: максимум {result['lag'] * 1000:.0f} мс")
+    print(f"{'обработчик':<12}{'событий':>10}{'p50, мкс':>11}{'p99, мкс':>11}{'max, мс':>10}")
+    for kind, values in result['latencies'].items():
+        p50, p99, worst = percentiles(values)
+        print(f"{kind:<12}{len(values):>10}{p50 * 1e6:>11.0f}{p99 * 1e6:>11.0f}{worst * 1000:>10.1f}")
+    if args.rules:
+        print(f"Отброшено фильтрами событий ({args.rules}): {result['filtered']}")
+
+    dispatcher = result['dispatcher']
+    outbound = result['outbound']
+    bot = result['bot']
+    print(f"Досылка уведомлений: {result['drain_time']:.2f} с "
+          f"(текст {dispatcher['text']['completed']}, медиа {dispatcher['media']['completed']}, "
+          f"ошибок {dispatcher['text']['failed'] + dispatcher['media']['failed']})")
+    print(f"Отчёты: {result['report_time'] * 1000:.0f} мс на {summary['sessions']} аккаунтов")
+    print(f"Бот: вызовов {len(bot.calls)}, FloodWait {bot.flood_waits}, "
+          f"потеряно {outbound['dropped']}, выгружено {bot.uploaded_bytes / 1024 / 1024:.1f} МБ")
+    flushes = result['flushes']
+    if flushes:
+        print(f"Запись данных: {len(flushes)} раз, в среднем {sum(flushes) / len(flushes) * 1000:.1f} мс, "
+              f"максимум {max(flushes) * 1000:.1f} мс")
+    print(f"Пиковый RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+    io = result['io']
+    if io:
+        print(f"Записано: {io['wchar'] / 1024 / 1024:.1f} МБ (write), "
+              f"{io['write_bytes'] / 1024 / 1024:.1f} МБ на устройство; "
+              f"в каталоге к концу {written / 1024:.0f} КБ")
+    else:
+        print(f"Записано: {written / 1024:.0f} КБ в рабочем каталоге")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Обработчики аккаунтов на синтетическом потоке событий')
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=500.0, help='событий в секунду в трассе')
+    parser.add_argument('--media-ratio', type=float, default=0.3)
+    parser.add_argument('--delete-ratio', type=float, default=0.05)
+    parser.add_argument('--clear-ratio', type=float, default=0.002)
+    add_run_arguments(parser)
+    args = parser.parse_args()
+
+    records = generate_trace(
+        seeded_random(args.seed), accounts=args.accounts, messages=args.messages, rate=args.rate,
+        media_ratio=args.media_ratio, delete_ratio=args.delete_ratio, clear_ratio=args.clear_ratio
+    )
+    print_results(execute(args, records), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Множество ID диалогов: set из int против CompactIdSet.
+# Память, вставка, проверка вхождения и размер при сохранении.
+#
+#   python -m benchmarks.idset [--dialogs 100000] [--lookups 200000]
+
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+from benchmarks.fake_tl import seeded_random
+from idset import CompactIdSet, load_id_set
+
+
+def generate_ids(count, rnd):
+    # Личные чаты - положительные ID, группы и каналы - помеченные отрицательные
+    ids = set()
+    while len(ids) < count:
+        if rnd.random() < 0.8:
+            ids.add(rnd.randint(10_000, 7_000_000_000))
+        else:
+            ids.add(-1_000_000_000_000 - rnd.randint(1, 2_000_000_000))
+    return list(ids)
+
+
+def fill(factory, ids):
+    result = factory()
+    for chat_id in ids:
+        result.add(chat_id)
+    # Вставки закончены, остаток буфера вливается в массив (как при сохранении)
+    iter(result)
+    return result
+
+
+def measure_fill(factory, ids):
+    # Время - отдельным проходом: tracemalloc сильно замедляет выделения памяти
+    started = time.perf_counter()
+    fill(factory, ids)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = fill(factory, ids)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return result, used, elapsed
+
+
+def measure_lookups(container, probes):
+    started = time.perf_counter()
+    found = 0
+    for chat_id in probes:
+        if chat_id in container:
+            found += 1
+    return time.perf_counter() - started, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память и скорость множества ID диалогов')
+    parser.add_argument('--dialogs', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = seeded_random(args.seed)
+    ids = generate_ids(args.dialogs, rnd)
+    # Половина проверок - известные чаты, половина - новые
+    probes = [rnd.choice(ids) if i % 2 else rnd.randint(10_000, 7_000_000_000)
+              for i in range(args.lookups)]
+
+    rows = []
+    for title, factory in (('set', set), ('CompactIdSet', CompactIdSet)):
+        container, used, insert_time = measure_fill(factory, ids)
+        lookup_time, found = measure_lookups(container, probes)
+        if isinstance(container, CompactIdSet):
+            started = time.perf_counter()
+            payload = json.dumps(container.to_json())
+            dump_time = time.perf_counter() - started
+            started = time.perf_counter()
+            loaded = load_id_set(json.loads(payload))
+            load_time = time.perf_counter() - started
+        else:
+            started = time.perf_counter()
+            payload = json.dumps(list(container))
+            dump_time = time.perf_counter() - started
+            started = time.perf_counter()
+            loaded = set(json.loads(payload))
+            load_time = time.perf_counter() - started
+        assert len(loaded) == args.dialogs
+        rows.append((title, used, insert_time, lookup_time, found, len(payload), dump_time, load_time))
+        del container, loaded
+
+    print(f"Диалогов: {args.dialogs}, проверок: {args.lookups}")
+    print(f"{'формат':<14}{'байт/ID':>9}{'вставка, нс':>13}{'поиск, нс':>11}"
+          f"{'на диске, КБ':>14}{'запись, мс':>12}{'чтение, мс':>12}")
+    for title, used, insert_time, lookup_time, found, size, dump_time, load_time in rows:
+        print(f"{title:<14}{used / args.dialogs:>9.1f}"
+              f"{insert_time / args.dialogs * 1e9:>13.0f}{lookup_time / args.lookups * 1e9:>11.0f}"
+              f"{size / 1024:>14.0f}{dump_time * 1000:>12.1f}{load_time * 1000:>12.1f}")
+    if rows[0][4] != rows[1][4]:
+        print("⚠️ Результаты проверок различаются!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Пропускная способность и пиковая память при пересылке медиа:
+# старый путь (NamedTemporaryFile + unlink), MediaRelay через память и через диск.
+# Каждый режим запускается в отдельном процессе, чтобы пиковый RSS не смешивался.
+#
+#   python -m benchmarks.media_relay [--files 200] [--size-kb 2048]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from benchmarks.fake_client import FakeClient, FakeBot
+from message_cache import MediaRef
+from media_relay import MediaRelay
+
+MODES = ('legacy', 'inline', 'disk')
+
+
+class BenchMediaRef(MediaRef):
+    __slots__ = ()
+
+    def input_location(self):
+        return None
+
+
+async def run_legacy(client, bot, media):
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=media.file_ext)
+    temp_path = temp_file.name
+    temp_file.close()
+    await client.download_file(media.input_location(), file=temp_path,
+                               file_size=media.size, dc_id=media.dc_id)
+    await bot.send_file(0, temp_path)
+    os.unlink(temp_path)
+
+
+async def run_mode(mode, files, size):
+    client = FakeClient()
+    bot = FakeBot()
+    relay = MediaRelay(inline_limit=size if mode == 'inline' else 0)
+    started = time.perf_counter()
+    for i in range(files):
+        media = BenchMediaRef('document', i, 0, b'', 2, mime_type='video/mp4',
+                              size=size, file_ext='.mp4')
+        if mode == 'legacy':
+            await run_legacy(client, bot, media)
+        else:
+            async with relay.open(client, media) as media_file:
+                await bot.send_file(0, media_file)
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, bot.uploaded_bytes, peak_kb
+
+
+def child(mode, files, size):
+    elapsed, uploaded, peak_kb = asyncio.run(run_mode(mode, files, size))
+    print(f"{elapsed} {uploaded} {peak_kb}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересылка медиа: память против диска')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size-kb', type=int, default=2048)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = args.size_kb * 1024
+
+    if args.mode:
+        child(args.mode, args.files, size)
+        return
+
+    print(f"Файлов: {args.files}, размер: {args.size_kb} КБ")
+    print(f"{'режим':<8}{'МБ/с':>10}{'пиковый RSS, МБ':>18}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.media_relay', '--mode', mode,
+             '--files', str(args.files), '--size-kb', str(args.size_kb)],
+            check=True, capture_output=True, text=True
+        ).stdout.split()
+        elapsed, uploaded, peak_kb = float(output[0]), int(output[1]), int(output[2])
+        print(f"{mode:<8}{uploaded / 1024 / 1024 / elapsed:>10.0f}{peak_kb / 1024:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Воспроизведение записанной трассы обновлений (TRACE_FILE) через обработчики main.py.
+#
+# Та же обвязка, что и у benchmarks/handlers.py: FakeUserClient вместо
+# аккаунтов, FakeBot вместо бота, без сети. Время трассы сжимается в --speed
+# раз (1 - как было, 10 - в десять раз быстрее, max - без пауз).
+# --copies N запускает каждую записанную сессию N раз как отдельные аккаунты:
+# так проверяется, сколько аккаунтов с таким трафиком выдержит один процесс
+# (при --speed 1 смотреть на отставание от трассы).
+#
+#   python -m benchmarks.replay trace.ndjson.gz [--speed 1|10|max] [--copies 5]
+
+import argparse
+
+from benchmarks.handlers import add_run_arguments, execute, print_results
+from trace_recorder import read_trace
+
+
+def load_records(paths, copies=1, limit=None):
+    records = []
+    for path in paths:
+        for record in read_trace(path):
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+    if copies > 1:
+        records = [dict(record, session=f"{record['session']}-{copy}")
+                   for record in records for copy in range(copies)]
+    # Трассы воркеров (.shardN) пишутся каждая от своего начала
+    records.sort(key=lambda record: record['t'])
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанной трассы обновлений')
+    parser.add_argument('trace', nargs='+', help='файлы трассы (NDJSON, можно .gz)')
+    parser.add_argument('--copies', type=int, default=1, help='сколько раз размножить каждую сессию')
+    parser.add_argument('--limit', type=int, help='воспроизвести только первые N событий')
+    add_run_arguments(parser)
+    args = parser.parse_args()
+
+    records = load_records(args.trace, args.copies, args.limit)
+    if not records:
+        print("Трасса пуста")
+        return
+    print_results(execute(args, records), args)
+
+
+if __name__ == '__main__':
+    main()
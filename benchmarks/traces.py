@@ -0,0 +1,112 @@
+# Синтетические потоки событий аккаунтов для офлайн-бенчмарков.
+#
+# Запись трассы - словарь:
+#   {'t': сек от начала, 'session': имя, 'type': 'message', 'peer': id чата,
+#    'channel': bool, 'msg_id': int, 'out': bool, 'media': тип или None, 'size': байт}
+#   {'t': ..., 'session': ..., 'type': 'deleted', 'peer': id канала или None, 'ids': [msg_id, ...]}
+# peer - id без пометки -100; для удалений в личных чатах и группах он неизвестен,
+# как и в настоящем MessageDeleted.
+#
+# Сообщения приходят пуассоновским потоком, чаты выбираются неравномерно
+# (несколько активных чатов на аккаунт), удаления - одиночные недавних
+# сообщений и очистки чата целиком пачками до 100 ID.
+
+from collections import deque
+
+from benchmarks.fake_tl import random_media_kind
+
+MEDIA_SIZES = {
+    'photo': (50_000, 400_000),
+    'video': (500_000, 20_000_000),
+    'voice': (5_000, 300_000),
+    'round': (200_000, 3_000_000),
+    'document': (10_000, 5_000_000),
+    'geo': (0, 0),
+}
+HISTORY_PER_CHAT = 500
+DELETE_BATCH = 100
+
+
+class _Account:
+    def __init__(self, name, chats, channel_ratio, rnd):
+        self.name = name
+        self.chats = []
+        for _ in range(chats):
+            if rnd.random() < channel_ratio:
+                self.chats.append((rnd.randint(1_000_000_000, 2_000_000_000), True))
+            else:
+                self.chats.append((rnd.randint(10_000, 7_000_000_000), False))
+        # Вес чата ~ 1/ранг: большая часть сообщений идёт в немногие чаты
+        self.weights = [1 / (rank + 1) for rank in range(chats)]
+        self.next_id = rnd.randint(1000, 100_000)  # общий счётчик личных чатов и групп
+        self.channel_ids = {}
+        self.history = {}  # (peer, channel) -> deque последних msg_id
+        self.recent = deque(maxlen=HISTORY_PER_CHAT)  # (peer, channel, msg_id)
+
+    def new_id(self, peer, channel):
+        if channel:
+            msg_id = self.channel_ids.get(peer, 0) + 1
+            self.channel_ids[peer] = msg_id
+            return msg_id
+        self.next_id += 1
+        return self.next_id
+
+
+def generate_trace(rnd, accounts=20, messages=100_000, rate=500.0, chats=300,
+                   channel_ratio=0.2, media_ratio=0.3, out_ratio=0.2,
+                   delete_ratio=0.05, clear_ratio=0.002):
+    # rate - событий в секунду на все аккаунты; delete_ratio и clear_ratio -
+    # доля одиночных удалений и очисток чата среди событий
+    sessions = [_Account(f'bench{i:03d}', chats, channel_ratio, rnd) for i in range(accounts)]
+    records = []
+    t = 0.0
+    produced = 0
+    while produced < messages:
+        t += rnd.expovariate(rate)
+        acc = rnd.choice(sessions)
+        roll = rnd.random()
+
+        if roll < clear_ratio and acc.history:
+            # Очистка чата: всё, что видели, удаляется пачками почти одновременно
+            key = rnd.choice(list(acc.history))
+            ids = list(acc.history.pop(key))
+            peer, channel = key
+            for i in range(0, len(ids), DELETE_BATCH):
+                t += rnd.uniform(0.001, 0.02)
+                records.append({'t': round(t, 4), 'session': acc.name, 'type': 'deleted',
+                                'peer': peer if channel else None, 'ids': ids[i:i + DELETE_BATCH]})
+            continue
+
+        if roll < clear_ratio + delete_ratio and acc.recent:
+            peer, channel, msg_id = acc.recent[rnd.randrange(len(acc.recent))]
+            records.append({'t': round(t, 4), 'session': acc.name, 'type': 'deleted',
+                            'peer': peer if channel else None, 'ids': [msg_id]})
+            continue
+
+        peer, channel = rnd.choices(acc.chats, weights=acc.weights)[0]
+        msg_id = acc.new_id(peer, channel)
+        media = random_media_kind(rnd, media_ratio)
+        size = rnd.randint(*MEDIA_SIZES[media]) if media else 0
+        records.append({'t': round(t, 4), 'session': acc.name, 'type': 'message',
+                        'peer': peer, 'channel': channel, 'msg_id': msg_id,
+                        'out': rnd.random() < out_ratio, 'media': media, 'size': size})
+        history = acc.history.get((peer, channel))
+        if history is None:
+            history = acc.history[(peer, channel)] = deque(maxlen=HISTORY_PER_CHAT)
+        history.append(msg_id)
+        acc.recent.append((peer, channel, msg_id))
+        produced += 1
+    return records
+
+
+def trace_summary(records):
+    messages = sum(1 for r in records if r['type'] == 'message')
+    deleted = [r for r in records if r['type'] == 'deleted']
+    return {
+        'sessions': len({r['session'] for r in records}),
+        'messages': messages,
+        'media': sum(1 for r in records if r['type'] == 'message' and r['media']),
+        'deleted_events': len(deleted),
+        'deleted_ids': sum(len(r['ids']) for r in deleted),
+        'duration': records[-1]['t'] if records else 0.0,
+    }
@@ -0,0 +1,110 @@
+# Правила приёма сообщений аккаунта: какие чаты кэшировать и учитывать.
+#
+# Правила хранятся в аккаунте (acc['rules']) в виде JSON и компилируются в
+# ChatRules: флаги типов чатов и frozenset'ы ID. Из ChatRules строится фильтр
+# events.NewMessage (incoming, chats + blacklist_chats, func), так что лишние
+# сообщения отбрасываются Telethon до вызова обработчика - без записи в кэш,
+# запроса чата и прочих выделений памяти.
+#
+#   private / groups / channels - принимать личные чаты, группы (включая
+#       супергруппы), каналы-рассылки
+#   outgoing - кэшировать и свои исходящие сообщения (иначе incoming=True)
+#   allow - чаты, которые принимаются независимо от типа
+#   deny - чаты, которые не принимаются никогда (сильнее allow)
+#   muted - чаты, которые учитываются как диалоги, но не кэшируются:
+#       их удаления не пересылаются
+# ID чатов - помеченные, как event.chat_id (-100... у каналов и супергрупп).
+# Правила по умолчанию принимают всё, как и без правил.
+
+DEFAULT_RULES = {
+    'private': True,
+    'groups': True,
+    'channels': True,
+    'outgoing': True,
+    'allow': [],
+    'deny': [],
+    'muted': [],
+}
+KIND_OPTIONS = ('private', 'groups', 'channels', 'outgoing')
+LIST_OPTIONS = ('allow', 'deny', 'muted')
+ON_VALUES = {'on': True, 'yes': True, '1': True, 'off': False, 'no': False, '0': False}
+
+
+class ChatRules:
+    __slots__ = ('private', 'groups', 'channels', 'outgoing', 'allow', 'deny', 'muted')
+
+    def __init__(self, rules=None):
+        rules = rules or {}
+        for option in KIND_OPTIONS:
+            setattr(self, option, bool(rules.get(option, DEFAULT_RULES[option])))
+        for option in LIST_OPTIONS:
+            setattr(self, option, frozenset(int(chat_id) for chat_id in rules.get(option, ())))
+
+    @property
+    def all_kinds(self):
+        return self.private and self.groups and self.channels
+
+    @property
+    def accepts_all(self):
+        return self.all_kinds and self.outgoing and not self.deny
+
+    def admits(self, chat_id, is_private, is_group):
+        # is_group = None (канал без сущности) считается каналом-рассылкой
+        if chat_id in self.deny:
+            return False
+        if chat_id in self.allow:
+            return True
+        if is_private:
+            return self.private
+        if is_group:
+            return self.groups
+        return self.channels
+
+    def event_filter(self, event):
+        # func для events.NewMessage: только поля, которые уже есть в событии
+        return self.admits(event.chat_id, event.is_private, event.is_group)
+
+    def to_json(self):
+        rules = {option: getattr(self, option) for option in KIND_OPTIONS}
+        for option in LIST_OPTIONS:
+            rules[option] = sorted(getattr(self, option))
+        return rules
+
+
+def update_rules(rules, args):
+    # Изменение правил командой /rules: args - слова после имени аккаунта.
+    # Возвращает новый словарь правил, при ошибке - ValueError с текстом для админа
+    rules = ChatRules(rules).to_json()
+    if not args:
+        raise ValueError("не указано, что менять")
+    option = args[0].lower()
+
+    if option == 'reset':
+        return ChatRules().to_json()
+    if option == 'private_only':
+        rules.update(private=True, groups=False, channels=False)
+        return rules
+    if option in KIND_OPTIONS:
+        if len(args) < 2 or args[1].lower() not in ON_VALUES:
+            raise ValueError(f"{option}: ожидается on или off")
+        rules[option] = ON_VALUES[args[1].lower()]
+        return rules
+    if option in LIST_OPTIONS:
+        action = args[1].lower() if len(args) > 1 else ''
+        if action == 'clear':
+            rules[option] = []
+            return rules
+        if action not in ('add', 'del') or len(args) < 3:
+            raise ValueError(f"{option}: ожидается add|del <chat_id> ... или clear")
+        try:
+            chat_ids = {int(chat_id) for chat_id in args[2:]}
+        except ValueError:
+            raise ValueError("ID чатов должны быть числами")
+        current = set(rules[option])
+        if action == 'add':
+            current |= chat_ids
+        else:
+            current -= chat_ids
+        rules[option] = sorted(current)
+        return rules
+    raise ValueError(f"неизвестный параметр: {option}")
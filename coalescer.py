@@ -0,0 +1,63 @@
+# Объединение массовых удалений в сводки.
+#
+# Когда пользователь очищает чат, приходят сотни удалений подряд. Удаления
+# собираются по ключу (сессия, чат) в течение короткого окна и уходят одной
+# пачкой. Одиночное удаление без открытого окна отправляется сразу,
+# без задержки, и открывает окно: если следом удалят ещё, они попадут в пачку.
+
+import asyncio
+
+
+class DeletionCoalescer:
+    def __init__(self, window, on_flush):
+        # on_flush(key, context, items) - синхронная функция, ставит отправку в очередь
+        self.window = window
+        self.on_flush = on_flush
+        self._buckets = {}  # key -> [context, items, timer]
+        self.immediate = 0
+        self.batches = 0
+        self.coalesced = 0
+
+    def add(self, key, context, items):
+        if self.window <= 0:
+            self.immediate += 1
+            self.on_flush(key, context, items)
+            return
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+            if len(items) == 1:
+                # Одиночное удаление - сразу, окно открыто для последующих
+                self._buckets[key] = [context, [], timer]
+                self.immediate += 1
+                self.on_flush(key, context, items)
+                return
+            bucket = self._buckets[key] = [context, [], timer]
+
+        bucket[0] = context
+        bucket[1].extend(items)
+
+    def _flush(self, key):
+        context, items, _ = self._buckets.pop(key)
+        if not items:
+            return
+        self.batches += 1
+        self.coalesced += len(items)
+        try:
+            self.on_flush(key, context, items)
+        except Exception as e:
+            print(f"Ошибка отправки сводки удалений: {e}")
+
+    def flush_all(self):
+        for key in list(self._buckets):
+            self._buckets[key][2].cancel()
+            self._flush(key)
+
+    def stats(self):
+        return {
+            'open_windows': len(self._buckets),
+            'immediate': self.immediate,
+            'batches': self.batches,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,162 @@
+# Общее для всех сессий хранилище содержимого кэша сообщений.
+#
+# Несколько аккаунтов в одной группе получают одни и те же сообщения. В
+# каналах и супергруппах ID сообщения общий для всех участников, поэтому
+# запись (channel_id, msg_id) создаётся один раз, а кэши сессий (MessageCache)
+# держат на неё только ссылку. Медиа (MediaRef) общее по (тип, id) фото или
+# документа - в том числе в разных сообщениях личных чатов (пересылки).
+# Счётчики ссылок уменьшает MessageCache при вытеснении и удалении записи;
+# запись и медиа уходят из таблиц вместе с последней ссылкой.
+# Названия чатов интернируются здесь же: общая запись хранит индекс
+# в общей таблице, а не в таблице одной сессии. У названий тоже счётчики
+# ссылок: название уходит вместе с последней записью, освободившийся индекс
+# достаётся следующему новому названию. Индекс нового названия надо сразу
+# отдать в запись кэша - название, которое так и не попало в кэш (запись с
+# диска только для уведомления), освобождается при следующем новом названии.
+
+import sys
+
+from message_cache import ENTRY_OVERHEAD, media_ref_from_media
+
+
+def media_source(media):
+    # (тип, объект Photo/Document) - как их выбирает media_ref_from_media;
+    # для нескачиваемого медиа - (имя типа, None)
+    type_name = type(media).__name__
+    if type_name == 'MessageMediaPhoto':
+        photo = getattr(media, 'photo', None)
+        if photo is not None and type(photo).__name__ == 'Photo':
+            return 'photo', photo
+    elif type_name == 'MessageMediaDocument':
+        doc = getattr(media, 'document', None)
+        if doc is not None and type(doc).__name__ == 'Document':
+            return 'document', doc
+    return type_name, None
+
+
+class ContentStore:
+    def __init__(self):
+        self._messages = {}  # (channel_id, msg_id) -> [CachedMessage, ссылок]
+        self._media = {}  # (тип, id) -> [MediaRef, ссылок, байт]
+        self._plain_media = {}  # имя типа -> MediaRef гео, опросов и т.п. (у них нет id)
+        self._chat_names = []
+        self._chat_name_index = {}
+        self._chat_name_refs = []  # индекс -> записей с этим названием
+        self._free_names = []  # освободившиеся индексы
+        self._unretained_names = []  # новые названия, ещё не попавшие в кэш
+        self.shared_messages = 0  # записей взято у другой сессии
+        self.shared_media = 0  # медиа взято у другой записи
+        self.saved_bytes = 0  # сколько заняли бы копии общих записей и медиа
+
+    def chat_name_idx(self, name):
+        idx = self._chat_name_index.get(name)
+        if idx is None:
+            for unused in self._unretained_names:
+                if not self._chat_name_refs[unused] and self._chat_names[unused] is not None:
+                    self._free_name(unused)
+            if self._free_names:
+                idx = self._free_names.pop()
+                self._chat_names[idx] = sys.intern(name)
+            else:
+                idx = len(self._chat_names)
+                self._chat_names.append(sys.intern(name))
+                self._chat_name_refs.append(0)
+            self._chat_name_index[name] = idx
+            self._unretained_names = [idx]
+        return idx
+
+    def _free_name(self, idx):
+        del self._chat_name_index[self._chat_names[idx]]
+        self._chat_names[idx] = None
+        self._free_names.append(idx)
+
+    def chat_name(self, record):
+        return self._chat_names[record.chat_name_idx]
+
+    def message(self, key):
+        # Запись канала/супергруппы, которую уже держит другая сессия
+        entry = self._messages.get(key)
+        if entry is None:
+            return None
+        self.shared_messages += 1
+        return entry[0]
+
+    def media_ref(self, media):
+        # MediaRef для медиа Telethon; уже известное медиа не разбирается заново
+        kind, source = media_source(media)
+        if source is None:
+            ref = self._plain_media.get(kind)
+            if ref is None:
+                ref = self._plain_media[kind] = media_ref_from_media(media)
+            return ref
+        entry = self._media.get((kind, source.id))
+        if entry is None:
+            return media_ref_from_media(media)
+        ref = entry[0]
+        # У нового сообщения file_reference свежее - пригодится при скачивании
+        ref.file_reference = source.file_reference
+        self.shared_media += 1
+        return ref
+
+    def retain(self, key, record):
+        # Вызывается MessageCache при добавлении записи в кэш сессии
+        if type(key) is tuple:
+            entry = self._messages.get(key)
+            if entry is None:
+                self._messages[key] = [record, 1]
+            elif entry[0] is record:
+                entry[1] += 1
+                # Узел в кэше сессии остаётся и у общей записи
+                self.saved_bytes += record.size - ENTRY_OVERHEAD
+                return
+        self._chat_name_refs[record.chat_name_idx] += 1
+        self._retain_media(record.media)
+
+    def release(self, key, record):
+        if type(key) is tuple:
+            entry = self._messages.get(key)
+            if entry is not None and entry[0] is record:
+                entry[1] -= 1
+                if entry[1]:
+                    self.saved_bytes -= record.size - ENTRY_OVERHEAD
+                    return
+                del self._messages[key]
+        idx = record.chat_name_idx
+        self._chat_name_refs[idx] -= 1
+        if not self._chat_name_refs[idx]:
+            self._free_name(idx)
+        self._release_media(record.media)
+
+    def _retain_media(self, ref):
+        if ref is None or not ref.downloadable:
+            return
+        key = (ref.kind, ref.id)
+        entry = self._media.get(key)
+        if entry is None:
+            self._media[key] = [ref, 1, ref.nbytes()]
+        else:
+            entry[1] += 1
+            self.saved_bytes += entry[2]
+
+    def _release_media(self, ref):
+        if ref is None or not ref.downloadable:
+            return
+        key = (ref.kind, ref.id)
+        entry = self._media.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1]:
+            self.saved_bytes -= entry[2]
+        else:
+            del self._media[key]
+
+    def stats(self):
+        return {
+            'messages': len(self._messages),
+            'media': len(self._media),
+            'chat_names': len(self._chat_name_index),
+            'shared_messages': self.shared_messages,
+            'shared_media': self.shared_media,
+            'saved_bytes': self.saved_bytes,
+        }
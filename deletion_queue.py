@@ -0,0 +1,91 @@
+# Параллельная отправка уведомлений об удалённых сообщениях.
+#
+# Задачи группируются по получателю (group_id, thread_id) и полосе:
+# 'text' - текст уведомления, 'media' - скачивание и отправка медиа.
+# Внутри одной полосы одного получателя задачи выполняются строго по порядку,
+# разные получатели и полосы работают параллельно. Общее число одновременно
+# выполняемых задач ограничено отдельно для текста и для медиа, поэтому
+# большое видео не задерживает текстовые уведомления.
+
+import time
+import asyncio
+from collections import deque
+
+LANES = ('text', 'media')
+
+
+class DeletionDispatcher:
+    def __init__(self, text_concurrency=8, media_concurrency=3, latency_window=1000):
+        self.text_concurrency = text_concurrency
+        self.media_concurrency = media_concurrency
+        self._semaphores = None
+        self._lanes = {}  # (destination, lane) -> deque[(job, enqueued_at)]
+        self._tasks = set()
+        self._latencies = {lane: deque(maxlen=latency_window) for lane in LANES}
+        self.pending = {lane: 0 for lane in LANES}
+        self.completed = {lane: 0 for lane in LANES}
+        self.failed = {lane: 0 for lane in LANES}
+
+    def start(self):
+        self._semaphores = {
+            'text': asyncio.Semaphore(self.text_concurrency),
+            'media': asyncio.Semaphore(self.media_concurrency),
+        }
+
+    def submit(self, destination, lane, job):
+        # job - корутинная функция без аргументов; вызывается из обработчика без ожидания
+        key = (destination, lane)
+        queue = self._lanes.get(key)
+        self.pending[lane] += 1
+        if queue is not None:
+            queue.append((job, time.monotonic()))
+            return
+        queue = deque([(job, time.monotonic())])
+        self._lanes[key] = queue
+        task = asyncio.create_task(self._drain(key, queue))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key, queue):
+        lane = key[1]
+        semaphore = self._semaphores[lane]
+        try:
+            while queue:
+                job, enqueued_at = queue[0]
+                async with semaphore:
+                    try:
+                        await job()
+                        self.completed[lane] += 1
+                    except Exception as e:
+                        self.failed[lane] += 1
+                        print(f"Ошибка отправки уведомления об удалении ({lane}): {e}")
+                queue.popleft()
+                self.pending[lane] -= 1
+                self._latencies[lane].append(time.monotonic() - enqueued_at)
+        finally:
+            # Полоса пуста - задача завершается, следующая задача создаст новую
+            if self._lanes.get(key) is queue:
+                del self._lanes[key]
+
+    def stats(self):
+        result = {}
+        for lane in LANES:
+            latencies = sorted(self._latencies[lane])
+            count = len(latencies)
+            result[lane] = {
+                'pending': self.pending[lane],
+                'completed': self.completed[lane],
+                'failed': self.failed[lane],
+                'p50': latencies[count // 2] if count else 0.0,
+                'p99': latencies[min(count - 1, int(count * 0.99))] if count else 0.0,
+                'max': latencies[-1] if count else 0.0,
+            }
+        result['destinations'] = len({destination for destination, _ in self._lanes})
+        return result
+
+    async def close(self, timeout=30):
+        # Даём досылать уже поставленные уведомления
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in list(self._tasks):
+            task.cancel()
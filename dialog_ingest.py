@@ -0,0 +1,97 @@
+# Первичная загрузка существующих диалогов аккаунта в фоне.
+#
+# Диалоги читаются страницами через iter_dialogs, после каждой страницы
+# позиция (offset_date, offset_id, offset_peer) сохраняется в
+# acc['ingest_checkpoint']. После перезапуска или падения загрузка
+# продолжается с последней сохранённой страницы, а не с начала.
+# На FloodWait ждём сколько просит Telegram и продолжаем с той же позиции.
+# Обработчики сообщений при этом уже работают: чат, которого ещё нет в
+# acc['dialogs'], проверяется через is_existing_dialog().
+# recent_dialogs() - последние диалоги уже загруженного аккаунта для кэша
+# чатов при запуске, тоже страницами и с ожиданием на FloodWait.
+
+import asyncio
+
+async def ingest_dialogs(client, acc, on_dialog, on_page, page_size=100):
+    # on_dialog(dialog) - для каждого диалога с сообщениями,
+    # on_page() - после сохранения позиции (пометить аккаунт для записи)
+    while True:
+        checkpoint = acc.get('ingest_checkpoint') or {}
+        kwargs = {}
+        if checkpoint:
+            kwargs = {
+                'offset_date': checkpoint['offset_date'],
+                'offset_id': checkpoint['offset_id'],
+                'offset_peer': checkpoint['offset_peer'],
+            }
+        count = checkpoint.get('count', 0)
+        try:
+            in_page = 0
+            async for dialog in client.iter_dialogs(limit=None, **kwargs):
+                # Добавляем только диалоги с сообщениями (исключаем пустые)
+                if dialog.message:
+                    on_dialog(dialog)
+                count += 1
+                in_page += 1
+                # Закреплённые диалоги идут вне порядка дат - позицию по ним не запоминаем
+                if in_page >= page_size and dialog.message and dialog.date and not dialog.pinned:
+                    acc['ingest_checkpoint'] = {
+                        'offset_date': int(dialog.date.timestamp()),
+                        'offset_id': dialog.message.id,
+                        'offset_peer': dialog.id,
+                        'count': count,
+                    }
+                    on_page()
+                    in_page = 0
+        except Exception as e:
+            if type(e).__name__ != 'FloodWaitError':
+                raise
+            print(f"⏳ FloodWait {e.seconds} с при загрузке диалогов, продолжим с сохранённой позиции")
+            await asyncio.sleep(e.seconds)
+            continue
+
+        acc.pop('ingest_checkpoint', None)
+        acc['initialized'] = True
+        on_page()
+        return count
+
+
+async def recent_dialogs(client, on_dialog, limit, page_size=100):
+    # Последние limit диалогов (для кэша чатов уже загруженного аккаунта):
+    # страницами по page_size, на FloodWait ждём и продолжаем с последней позиции
+    offset = {}
+    seen = 0
+    while seen < limit:
+        want = min(page_size, limit - seen)
+        previous = offset
+        in_page = 0
+        try:
+            async for dialog in client.iter_dialogs(limit=want, **offset):
+                on_dialog(dialog)
+                in_page += 1
+                # Закреплённые диалоги идут вне порядка дат - позицию по ним не берём
+                if dialog.message and dialog.date and not dialog.pinned:
+                    offset = {
+                        'offset_date': dialog.date,
+                        'offset_id': dialog.message.id,
+                        'offset_peer': dialog.input_entity,
+                    }
+        except Exception as e:
+            if type(e).__name__ != 'FloodWaitError':
+                raise
+            print(f"⏳ FloodWait {e.seconds} с при заполнении кэша чатов, продолжим с той же позиции")
+            seen += in_page
+            await asyncio.sleep(e.seconds)
+            continue
+        seen += in_page
+        if in_page < want or offset is previous:
+            # Диалоги кончились
+            break
+    return seen
+
+
+async def is_existing_dialog(client, chat_id, msg_id):
+    # Чат ещё не просмотрен загрузкой: диалог новый, только если
+    # до этого сообщения в нём ничего не было
+    history = await client.get_messages(chat_id, limit=1, offset_id=msg_id)
+    return bool(history)
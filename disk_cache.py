@@ -0,0 +1,237 @@
+# Дисковый уровень кэша сообщений (MESSAGE_DISK_CACHE=1).
+#
+# Сообщения переживают перезапуск: удаление сообщения, полученного до рестарта,
+# находится здесь. Новые записи копятся в памяти и пишутся пачкой в одной
+# транзакции из пула потоков. Чтение - точечный запрос по первичному ключу
+# (session, channel_id, msg_id). Записи старше TTL удаляются целыми сегментами
+# (по часу на сегмент), поэтому объём памяти не зависит от окна хранения:
+# в памяти остаётся только небольшой MessageCache перед этим хранилищем.
+
+import json
+import time
+import asyncio
+import sqlite3
+
+from message_cache import CachedMessage, MediaRef
+
+SEGMENT_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    msg_id INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    chat_id INTEGER,
+    chat_name TEXT,
+    date INTEGER NOT NULL,
+    media TEXT,
+    PRIMARY KEY (session, channel_id, msg_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_segment ON messages (segment);
+"""
+
+
+def _split_key(key):
+    # cache_key(): msg_id для личных чатов, (channel_id, msg_id) для каналов
+    if isinstance(key, tuple):
+        return key
+    return 0, key
+
+
+def _pack_media(media):
+    if media is None:
+        return None
+    return json.dumps([
+        media.kind, media.id, media.access_hash,
+        media.file_reference.hex() if media.file_reference else '',
+        media.dc_id, media.thumb_size, media.mime_type, media.size,
+        media.file_ext, media.is_voice, media.is_video_note
+    ])
+
+
+def _unpack_media(raw):
+    if raw is None:
+        return None
+    (kind, media_id, access_hash, file_reference, dc_id, thumb_size,
+     mime_type, size, file_ext, is_voice, is_video_note) = json.loads(raw)
+    return MediaRef(
+        kind, media_id, access_hash, bytes.fromhex(file_reference), dc_id,
+        thumb_size=thumb_size, mime_type=mime_type, size=size, file_ext=file_ext,
+        is_voice=is_voice, is_video_note=is_video_note
+    )
+
+
+class DiskMessageStore:
+    def __init__(self, path, ttl=7 * 24 * 3600, flush_interval=2.0, batch_size=500):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}  # (session, channel_id, msg_id) -> (record, chat_name) | None (удаление)
+        self._inflight = {}  # пачка, которая сейчас пишется в БД
+        self._read_conn = None
+        self._write_conn = None
+        self._task = None
+        self._wakeup = None
+        self._lock = None
+        self._pruned_segment = None
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def open(self):
+        if self._write_conn is not None:
+            return
+        self._write_conn = self._connect()
+        self._write_conn.executescript(SCHEMA)
+        self._read_conn = self._connect()
+
+    def start(self):
+        self.open()
+        if self._task is None:
+            self._lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def put(self, session_name, key, record, chat_name):
+        channel_id, msg_id = _split_key(key)
+        self._pending[(session_name, channel_id, msg_id)] = (record, chat_name)
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def discard(self, session_name, key):
+        channel_id, msg_id = _split_key(key)
+        self._pending[(session_name, channel_id, msg_id)] = None
+
+    def get(self, session_name, key, cache):
+        # cache - MessageCache сессии, в нём интернируется название чата
+        channel_id, msg_id = _split_key(key)
+        full_key = (session_name, channel_id, msg_id)
+        pending = self._pending if full_key in self._pending else self._inflight
+        if full_key in pending:
+            item = pending[full_key]
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+        row = self._read_conn.execute(
+            'SELECT text, chat_id, chat_name, date, media FROM messages '
+            'WHERE session = ? AND channel_id = ? AND msg_id = ?',
+            full_key
+        ).fetchone()
+        if row is None or row[3] < time.time() - self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        text, chat_id, chat_name, date, media = row
+        return CachedMessage(text, chat_id, cache.chat_name_idx(chat_name), date,
+                             _unpack_media(media))
+
+    async def _run(self):
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка записи кэша сообщений на диск: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, {}
+            prune_before = self._prune_segment()
+            if not batch and prune_before is None:
+                return
+            loop = asyncio.get_running_loop()
+            self._inflight = batch
+            try:
+                await loop.run_in_executor(None, self._write, batch, prune_before)
+            except BaseException:
+                # Возвращаем несохранённое, не затирая более новые изменения
+                for key, item in batch.items():
+                    self._pending.setdefault(key, item)
+                raise
+            finally:
+                self._inflight = {}
+
+    def _prune_segment(self):
+        # Старые сегменты удаляем не чаще раза в сегмент
+        current = int(time.time()) // SEGMENT_SECONDS
+        if self._pruned_segment == current:
+            return None
+        self._pruned_segment = current
+        return (int(time.time()) - int(self.ttl)) // SEGMENT_SECONDS
+
+    def _write(self, batch, prune_before):
+        rows = []
+        deletes = []
+        for (session_name, channel_id, msg_id), item in batch.items():
+            if item is None:
+                deletes.append((session_name, channel_id, msg_id))
+                continue
+            record, chat_name = item
+            rows.append((
+                session_name, channel_id, msg_id, record.date // SEGMENT_SECONDS,
+                record.text, record.chat_id, chat_name, record.date,
+                _pack_media(record.media)
+            ))
+
+        conn = self._write_conn
+        with conn:
+            if rows:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO messages (session, channel_id, msg_id, segment, '
+                    'text, chat_id, chat_name, date, media) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+            if deletes:
+                conn.executemany(
+                    'DELETE FROM messages WHERE session = ? AND channel_id = ? AND msg_id = ?',
+                    deletes
+                )
+            if prune_before is not None:
+                conn.execute('DELETE FROM messages WHERE segment < ?', (prune_before,))
+        self.writes += len(rows)
+
+    async def drop_session(self, session_name):
+        # Удаление аккаунта: записи сессии больше не нужны
+        async with self._lock:
+            for key in [key for key in self._pending if key[0] == session_name]:
+                del self._pending[key]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._delete_session, session_name)
+
+    def _delete_session(self, session_name):
+        with self._write_conn:
+            self._write_conn.execute('DELETE FROM messages WHERE session = ?', (session_name,))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+        for conn in (self._read_conn, self._write_conn):
+            if conn is not None:
+                conn.close()
+        self._read_conn = None
+        self._write_conn = None
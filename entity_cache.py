@@ -0,0 +1,81 @@
+# Кэш чатов одной сессии: peer id -> (id, название, тип).
+#
+# Обработчику новых сообщений от чата нужны только его id и название. Полный
+# объект Telethon не храним - только компактный кортеж с интернированным
+# названием. Кэш заполняется из iter_dialogs при загрузке диалогов (при
+# каждом запуске - последними ENTITY_PREFILL_DIALOGS диалогами) и из
+# сущностей, пришедших вместе с обновлением (event.chat), поэтому в обычном
+# случае обработчик не ходит в сеть. Размер ограничен, вытесняются давно не
+# использованные чаты. При смене названия запись сбрасывается.
+# Ключ - "помеченный" peer id (как event.chat_id и dialog.id).
+
+import sys
+from collections import OrderedDict
+
+
+def entity_info(entity):
+    # (id, название, тип) для User/Chat/Channel; id - как у chat.id
+    type_name = type(entity).__name__
+    if type_name.startswith('User'):
+        kind = 'user'
+        name = getattr(entity, 'first_name', None)
+    elif type_name.startswith('Channel'):
+        kind = 'channel'
+        name = getattr(entity, 'title', None)
+    else:
+        kind = 'chat'
+        name = getattr(entity, 'title', None)
+    return (entity.id, sys.intern(name or 'Unknown'), kind)
+
+
+class EntityCache:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # peer_id -> (id, название, тип)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, peer_id):
+        info = self._entries.get(peer_id)
+        if info is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(peer_id)
+        self.hits += 1
+        return info
+
+    def put(self, peer_id, entity):
+        info = entity_info(entity)
+        self._entries[peer_id] = info
+        self._entries.move_to_end(peer_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return info
+
+    def prefill(self, peer_id, entity):
+        # Из iter_dialogs (сначала недавние): то, что уже пришло с событиями,
+        # не трогаем и не вытесняем, новые записи встают старее имеющихся
+        if peer_id in self._entries or len(self._entries) >= self.max_entries:
+            return False
+        self._entries[peer_id] = entity_info(entity)
+        self._entries.move_to_end(peer_id, last=False)
+        return True
+
+    def invalidate(self, peer_id):
+        if self._entries.pop(peer_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -1,12 +1,37 @@
 import os
 import asyncio
-import json
-from datetime import datetime, timedelta
+import random
+import signal
+import time
+import functools
+import contextlib
+import io
+from datetime import datetime
 from collections import defaultdict
+from zoneinfo import ZoneInfo
 from telethon import TelegramClient, events
 from telethon.tl.functions.channels import CreateChannelRequest
-from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
+from persistence import JsonBackend, WriteBehindPersistence
+from sqlite_store import SQLiteBackend
+from message_cache import MessageCache, CachedMessage, cache_key
+from content_store import ContentStore
+from disk_cache import DiskMessageStore
+from media_store import MediaStore, media_class
+from media_relay import MediaRelay
+from deletion_queue import DeletionDispatcher
+from coalescer import DeletionCoalescer
+from entity_cache import EntityCache
+from idset import CompactIdSet
+from dialog_ingest import ingest_dialogs, recent_dialogs, is_existing_dialog
+from outbound import OutboundSender, PRIORITY_ADMIN, PRIORITY_REPORT
+from metrics import MetricsRegistry
+from profiling import Profiler, SlowCallLog
+from shards import ShardSupervisor, WorkerLink, decode_file
+from trace_recorder import TraceRecorder
+from stats_store import StatsStore, day_label, parse_stats_range
+from scheduler import Scheduler, DailyAt, Every, parse_times, format_times
+from chat_rules import ChatRules, update_rules
 
 load_dotenv()
 
@@ -17,119 +42,469 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 MAIN_GROUP_ID = int(os.getenv('MAIN_GROUP_ID', 0))
 MAIN_ADMIN_ID = int(os.getenv('MAIN_ADMIN_ID'))
 DATA_FILE = 'bot_data.json'
+SAVE_INTERVAL = float(os.getenv('SAVE_INTERVAL', 2))  # секунды между фоновыми записями
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()  # json | sqlite
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'bot_data.db')
+
+# Лимиты кэша сообщений (на каждую сессию)
+MESSAGE_CACHE_MAX_ENTRIES = int(os.getenv('MESSAGE_CACHE_MAX_ENTRIES', 50000))
+MESSAGE_CACHE_MAX_MB = float(os.getenv('MESSAGE_CACHE_MAX_MB', 64))
+MESSAGE_CACHE_TTL_DAYS = float(os.getenv('MESSAGE_CACHE_TTL_DAYS', 7))
+# Сколько чатов держать в кэше названий (на каждую сессию)
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv('ENTITY_CACHE_MAX_ENTRIES', 10000))
+# Сколько последних диалогов загрузить в кэш названий при запуске (0 - не загружать)
+ENTITY_PREFILL_DIALOGS = int(os.getenv('ENTITY_PREFILL_DIALOGS', 1000))
+# Дисковый уровень кэша: сообщения переживают перезапуск бота
+MESSAGE_DISK_CACHE = os.getenv('MESSAGE_DISK_CACHE', '0') == '1'
+MESSAGE_DISK_CACHE_FILE = os.getenv('MESSAGE_DISK_CACHE_FILE', 'message_cache.db')
+
+# Предзагрузка медиа из входящих сообщений
+MEDIA_PREFETCH = os.getenv('MEDIA_PREFETCH', '0') == '1'
+MEDIA_DIR = os.getenv('MEDIA_DIR', 'media_cache')
+MEDIA_PREFETCH_TYPES = os.getenv('MEDIA_PREFETCH_TYPES', 'photo,video,voice,round')
+MEDIA_PREFETCH_MAX_MB = float(os.getenv('MEDIA_PREFETCH_MAX_MB', 20))
+MEDIA_QUOTA_MB = float(os.getenv('MEDIA_QUOTA_MB', 2048))
+MEDIA_ACCOUNT_QUOTA_MB = float(os.getenv('MEDIA_ACCOUNT_QUOTA_MB', 512))
+MEDIA_PREFETCH_WORKERS = int(os.getenv('MEDIA_PREFETCH_WORKERS', 3))
+
+# Медиа до этого размера пересылается через память, без временных файлов
+MEDIA_INLINE_MAX_MB = float(os.getenv('MEDIA_INLINE_MAX_MB', 20))
+MEDIA_BUFFER_POOL = int(os.getenv('MEDIA_BUFFER_POOL', 4))
+
+# Сколько уведомлений об удалении отправляется одновременно
+DELETION_TEXT_WORKERS = int(os.getenv('DELETION_TEXT_WORKERS', 8))
+DELETION_MEDIA_WORKERS = int(os.getenv('DELETION_MEDIA_WORKERS', 3))
+# Окно объединения массовых удалений в сводку, сек (0 - без объединения)
+DELETION_COALESCE_WINDOW = float(os.getenv('DELETION_COALESCE_WINDOW', 3))
+
+# Лимиты исходящих сообщений бота (ограничения Telegram для ботов)
+OUTBOUND_RATE = float(os.getenv('OUTBOUND_RATE', 30))  # сообщений в секунду всего
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20))  # сообщений в минуту в одну группу
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 4))
+# Сколько получателей отчётов обслуживается одновременно
+REPORT_CONCURRENCY = int(os.getenv('REPORT_CONCURRENCY', 4))
+# Расписание отчётов по умолчанию (аккаунту можно задать своё через /schedule)
+REPORT_TIMES = os.getenv('REPORT_TIMES', '16:00,20:00,00:00,04:00')
+REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'Europe/Moscow')
+# Как часто чистить кэши сообщений от записей старше MESSAGE_CACHE_TTL_DAYS, сек
+CACHE_EXPIRE_INTERVAL = float(os.getenv('CACHE_EXPIRE_INTERVAL', 600))
+
+# Запуск клиентов: сколько аккаунтов подключается одновременно
+# и случайная пауза перед подключением каждого, сек (против всплеска логинов)
+STARTUP_CONCURRENCY = int(os.getenv('STARTUP_CONCURRENCY', 4))
+STARTUP_JITTER = float(os.getenv('STARTUP_JITTER', 2))
+# Через сколько диалогов сохранять позицию первичной загрузки
+DIALOG_INGEST_PAGE_SIZE = int(os.getenv('DIALOG_INGEST_PAGE_SIZE', 100))
+# Число процессов-воркеров для аккаунтов (0 - все аккаунты в главном процессе)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', 0))
+# Метрики Prometheus на localhost (0 - выключено)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Профилирование: окно /profile start по умолчанию и порог медленного обработчика, сек
+PROFILE_DEFAULT_SECONDS = float(os.getenv('PROFILE_DEFAULT_SECONDS', 60))
+SLOW_HANDLER_SECONDS = float(os.getenv('SLOW_HANDLER_SECONDS', 1))
+# Запись обезличенной трассы обновлений для benchmarks/replay.py (пусто - выключено)
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_SALT = os.getenv('TRACE_SALT', '')  # пусто - случайная соль для каждой записи
+TRACE_MAX_MB = float(os.getenv('TRACE_MAX_MB', 512))
+# Статистика новых диалогов: сколько дней хранить по часам (старше - по дням)
+# и час МСК, с которого начинается день отчётов
+STATS_RETENTION_DAYS = int(os.getenv('STATS_RETENTION_DAYS', 90))
+STATS_DAY_START_HOUR = int(os.getenv('STATS_DAY_START_HOUR', 4))
+MSK_UTC_OFFSET = 3
+
+# Общие для всех сессий записи и медиа кэша сообщений (content_store.py)
+content_store = ContentStore()
+
+# Почасовые счётчики новых диалогов (stats_store.py)
+stats_store = StatsStore(STATS_RETENTION_DAYS, day_offset=MSK_UTC_OFFSET - STATS_DAY_START_HOUR)
 
 # Глобальное хранилище
 bot_data = {
     'accounts': {},
     'admins': set([MAIN_ADMIN_ID]),
-    'daily_stats': {},
+    'stats': stats_store,  # {session_name: почасовой ряд новых диалогов}
     'pending_verifications': {},  # {session_name: phone_code_hash}
-    'message_cache': {}  # {session_name: {msg_id: message_data}}
+    'message_cache': {},  # {session_name: MessageCache(cache_key -> CachedMessage)}
+    'entity_cache': {}  # {session_name: EntityCache(peer_id -> (id, название, тип))}
 }
 
 # Клиенты
 user_clients = {}
+dialog_ingest_tasks = {}  # {session_name: фоновая загрузка диалогов}
+account_rules = {}  # {session_name: ChatRules} - скомпилированные правила приёма сообщений
+client_handlers = {}  # {session_name: (клиент, обработчик сообщений, обработчик удалений)}
+shard_supervisor = None  # главный процесс при SHARD_WORKERS > 0
+shard_link = None  # процесс-воркер: связь с супервизором
 bot = None
 
+# Фоновое сохранение данных
+def create_storage_backend():
+    if STORAGE_BACKEND == 'sqlite':
+        # При первом запуске данные переносятся из DATA_FILE
+        return SQLiteBackend(SQLITE_FILE, json_path=DATA_FILE)
+    return JsonBackend(DATA_FILE)
+
+persistence = WriteBehindPersistence(bot_data, create_storage_backend(), interval=SAVE_INTERVAL)
+
+# Дисковый кэш сообщений (за MessageCache в памяти)
+def create_disk_cache(path):
+    return DiskMessageStore(
+        path,
+        ttl=MESSAGE_CACHE_TTL_DAYS * 24 * 3600,
+        flush_interval=SAVE_INTERVAL
+    ) if MESSAGE_DISK_CACHE else None
+
+disk_cache = create_disk_cache(MESSAGE_DISK_CACHE_FILE)
+
+# Локальное хранилище предзагруженных медиа
+def create_media_store(root):
+    return MediaStore(
+        root,
+        classes=[t.strip() for t in MEDIA_PREFETCH_TYPES.split(',') if t.strip()],
+        max_file_size=int(MEDIA_PREFETCH_MAX_MB * 1024 * 1024),
+        quota=int(MEDIA_QUOTA_MB * 1024 * 1024),
+        account_quota=int(MEDIA_ACCOUNT_QUOTA_MB * 1024 * 1024),
+        workers=MEDIA_PREFETCH_WORKERS
+    ) if MEDIA_PREFETCH else None
+
+media_store = create_media_store(MEDIA_DIR)
+
+# Трасса обновлений аккаунтов
+def create_trace_recorder(path):
+    return TraceRecorder(
+        path,
+        salt=TRACE_SALT or None,
+        flush_interval=SAVE_INTERVAL,
+        max_bytes=int(TRACE_MAX_MB * 1024 * 1024)
+    ) if path else None
+
+trace_recorder = create_trace_recorder(TRACE_FILE)
+
+# Пересылка медиа удалённых сообщений
+media_relay = MediaRelay(
+    inline_limit=int(MEDIA_INLINE_MAX_MB * 1024 * 1024),
+    pool_size=MEDIA_BUFFER_POOL
+)
+
+# Очереди отправки уведомлений об удалённых сообщениях
+deletion_dispatcher = DeletionDispatcher(
+    text_concurrency=DELETION_TEXT_WORKERS,
+    media_concurrency=DELETION_MEDIA_WORKERS
+)
+
+# Все исходящие сообщения бота: приоритеты, лимиты и FloodWait
+outbound = OutboundSender(
+    global_rate=OUTBOUND_RATE,
+    group_rate=OUTBOUND_GROUP_RATE / 60,
+    workers=OUTBOUND_WORKERS
+)
+
+async def respond(event, text):
+    # Ответ админу в чат команды - вне очереди уведомлений и отчётов
+    return await outbound.send_message(event.chat_id, text, priority=PRIORITY_ADMIN)
+
+# Сводки массовых удалений по (сессия, чат); dispatch_deletions определена ниже
+deletion_coalescer = DeletionCoalescer(
+    DELETION_COALESCE_WINDOW,
+    lambda key, context, items: dispatch_deletions(key, context, items)
+)
+
+# Периодические задачи: отчёты по расписаниям, очистка кэшей (scheduler.py)
+scheduler = Scheduler()
+
+# Метрики: счётчики горячего пути, остальное собирается в collect_metrics()
+metrics = MetricsRegistry()
+metric_handler_seconds = metrics.histogram(
+    'monitor_handler_seconds', 'Время обработки событий клиентов', ('handler', 'session')
+)
+metric_messages_cached = metrics.counter(
+    'monitor_messages_cached_total', 'Сообщений сохранено в кэш', ('session',)
+)
+metric_deletions = metrics.counter(
+    'monitor_deletions_total', 'Обработано удалений (found - было в кэше)', ('session', 'result')
+)
+metric_save_seconds = metrics.histogram(
+    'monitor_save_seconds', 'Длительность фоновой записи данных на диск'
+)
+persistence.on_flush = metric_save_seconds.observe
+metric_cache_entries = metrics.gauge('monitor_cache_entries', 'Сообщений в кэше', ('session',))
+metric_cache_bytes = metrics.gauge('monitor_cache_bytes', 'Объём кэша сообщений', ('session',))
+metric_cache_evictions = metrics.counter(
+    'monitor_cache_evictions_total', 'Вытеснено из кэша по лимитам и TTL', ('session',)
+)
+metric_alerts_sent = metrics.counter('monitor_alerts_sent_total', 'Отправлено уведомлений об удалениях', ('lane',))
+metric_alerts_failed = metrics.counter('monitor_alerts_failed_total', 'Ошибок отправки уведомлений', ('lane',))
+metric_media_downloaded = metrics.counter(
+    'monitor_media_downloaded_bytes_total', 'Скачано медиа', ('source',)
+)
+metric_media_uploaded = metrics.counter('monitor_media_uploaded_bytes_total', 'Отправлено медиа ботом')
+metric_media_deduplicated = metrics.counter(
+    'monitor_media_prefetch_deduplicated_total', 'Предзагрузок медиа без скачивания (уже есть у другого аккаунта)'
+)
+metric_shared_entries = metrics.gauge('monitor_shared_entries', 'Общих записей кэша сообщений', ('kind',))
+metric_shared_saved_bytes = metrics.gauge(
+    'monitor_shared_saved_bytes', 'Сэкономлено памяти общими записями и медиа'
+)
+metric_outbound_queue = metrics.gauge('monitor_outbound_queue', 'Исходящих сообщений бота в очереди', ('priority',))
+metric_outbound_dropped = metrics.counter('monitor_outbound_dropped_total', 'Потеряно исходящих сообщений')
+metric_flood_wait = metrics.counter('monitor_flood_wait_seconds_total', 'Суммарное ожидание FloodWait бота')
+metric_client_connected = metrics.gauge('monitor_client_connected', 'Клиент аккаунта подключён', ('session',))
+# Метрики, которые воркеры пересылают супервизору (остальные считает он сам)
+SHARD_METRICS = (
+    metric_handler_seconds, metric_messages_cached, metric_deletions,
+    metric_cache_entries, metric_cache_bytes, metric_cache_evictions,
+    metric_alerts_sent, metric_alerts_failed,
+    metric_media_downloaded, metric_media_uploaded, metric_media_deduplicated,
+    metric_shared_entries, metric_shared_saved_bytes,
+)
+
+def collect_metrics():
+    for metric in (metric_cache_entries, metric_cache_bytes, metric_cache_evictions, metric_client_connected):
+        metric.clear()
+    for name, cache in bot_data['message_cache'].items():
+        cache_stats = cache.stats()
+        metric_cache_entries.set(cache_stats['entries'], session=name)
+        metric_cache_bytes.set(cache_stats['bytes'], session=name)
+        metric_cache_evictions.set(cache_stats['evictions'] + cache_stats['expirations'], session=name)
+    
+    for lane in ('text', 'media'):
+        metric_alerts_sent.set(deletion_dispatcher.completed[lane], lane=lane)
+        metric_alerts_failed.set(deletion_dispatcher.failed[lane], lane=lane)
+    
+    relay_stats = media_relay.stats()
+    metric_media_downloaded.set(relay_stats['inline_bytes'] + relay_stats['disk_bytes'], source='relay')
+    if media_store:
+        metric_media_downloaded.set(media_store.downloaded_bytes, source='prefetch')
+        metric_media_deduplicated.set(media_store.deduplicated)
+    
+    shared = content_store.stats()
+    metric_shared_entries.set(shared['messages'], kind='message')
+    metric_shared_entries.set(shared['media'], kind='media')
+    metric_shared_saved_bytes.set(shared['saved_bytes'])
+    metric_media_uploaded.set(relay_stats['sent_bytes'])
+    
+    if shard_link:
+        # В воркере очередь исходящих и состояние клиентов - у супервизора
+        return
+    outbound_stats = outbound.stats()
+    for priority, count in outbound_stats['pending'].items():
+        metric_outbound_queue.set(count, priority=priority)
+    metric_outbound_dropped.set(outbound_stats['dropped'])
+    metric_flood_wait.set(outbound_stats['flood_wait_seconds'])
+    
+    for name in bot_data['accounts']:
+        metric_client_connected.set(1 if client_state(name) else 0, session=name)
+
+metrics.add_collector(collect_metrics)
+
+profiler = Profiler(default_seconds=PROFILE_DEFAULT_SECONDS)
+slow_calls = SlowCallLog(threshold=SLOW_HANDLER_SECONDS)
+
+def measured(handler_name, session_name=''):
+    # Время обработчика в гистограмму monitor_handler_seconds, медленные вызовы - в лог
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(event):
+            started = time.perf_counter()
+            try:
+                return await func(event)
+            finally:
+                elapsed = time.perf_counter() - started
+                metric_handler_seconds.observe(elapsed, handler=handler_name, session=session_name)
+                slow_calls.record(handler_name, session_name, elapsed)
+        return wrapper
+    return decorator
+
 # Загрузка/сохранение данных
 def load_data():
     global bot_data
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            bot_data['accounts'] = data.get('accounts', {})
-            bot_data['admins'] = set(data.get('admins', [MAIN_ADMIN_ID]))
-            bot_data['daily_stats'] = data.get('daily_stats', {})
-            for acc in bot_data['accounts'].values():
-                if 'dialogs' in acc:
-                    acc['dialogs'] = set(acc['dialogs'])
-    except FileNotFoundError:
-        save_data()
-
-def save_data():
-    data_to_save = {
-        'accounts': {},
-        'admins': list(bot_data['admins']),
-        'daily_stats': bot_data['daily_stats']
-    }
-    for name, acc in bot_data['accounts'].items():
-        acc_copy = acc.copy()
-        if 'dialogs' in acc_copy:
-            acc_copy['dialogs'] = list(acc_copy['dialogs'])
-        data_to_save['accounts'][name] = acc_copy
-    
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data_to_save, f, ensure_ascii=False, indent=2)
+    data = persistence.backend.load()
+    if data is None:
+        persistence.mark_all_dirty()
+        persistence.flush_sync()
+        return
+    bot_data['accounts'] = data.get('accounts', {})
+    bot_data['admins'] = set(data.get('admins', [MAIN_ADMIN_ID]))
+    # daily_stats - прежний формат (счётчик на календарный день), переносится в дневные итоги
+    stats_store.load(data.get('stats', {}), data.get('daily_stats', {}), time.time())
+
+def save_data(session_name=None):
+    # Только помечаем изменения: запись на диск делает фоновая задача (persistence.py).
+    # session_name=None - изменились общие данные (админы, статистика, список аккаунтов)
+    if shard_link is not None:
+        # В процессе-воркере данные хранит супервизор - отправляем изменения ему
+        shard_link.mark_dirty(session_name)
+        return
+    persistence.mark_dirty(session_name)
+
+def count_new_dialog(session_name):
+    hour = stats_store.hour_of(time.time())
+    if shard_link is not None:
+        shard_link.count_new_dialog(session_name, hour)
+        return
+    stats_store.add(session_name, hour)
+
+def stats_today():
+    # Текущий день статистики: с STATS_DAY_START_HOUR МСК
+    return stats_store.day_of(time.time())
+
+def new_message_cache():
+    return MessageCache(
+        max_entries=MESSAGE_CACHE_MAX_ENTRIES,
+        max_bytes=int(MESSAGE_CACHE_MAX_MB * 1024 * 1024),
+        ttl=MESSAGE_CACHE_TTL_DAYS * 24 * 3600,
+        store=content_store
+    )
 
 def is_admin(user_id):
     return user_id in bot_data['admins']
 
-def get_next_report_time():
-    now = datetime.now()
-    moscow_offset = timedelta(hours=3)
-    moscow_now = now + moscow_offset
-    
-    report_hours = [16, 20, 0, 4]
-    
-    for hour in report_hours:
-        report_time = moscow_now.replace(hour=hour, minute=0, second=0, microsecond=0)
-        if report_time > moscow_now:
-            return report_time - moscow_offset
+def report_schedule(acc):
+    # (времена, пояс) расписания отчётов аккаунта; пустые времена - отчёты выключены
+    schedule = acc.get('report_schedule')
+    if schedule is None:
+        return parse_times(REPORT_TIMES), REPORT_TIMEZONE
+    return parse_times(schedule.get('times', '')), schedule.get('tz') or REPORT_TIMEZONE
+
+def report_clock(tz, at):
+    # Время отчёта в его поясе и подпись пояса
+    tz = ZoneInfo(tz)
+    label = 'МСК' if tz.key == 'Europe/Moscow' else tz.key
+    return datetime.fromtimestamp(at, tz), label
+
+def format_report(session_name, count, clock):
+    local_time, tz_label = clock
+    report_text = f"📊 Отчёт по проекту {session_name}\n"
+    report_text += f"📅 Дата: {local_time.strftime('%d.%m.%Y')}\n"
+    report_text += f"⏰ Время: {local_time.strftime('%H:%M')} {tz_label}\n"
+    report_text += f"💬 Новых диалогов: {count}\n"
+    report_text += f"🕐 Период: с {STATS_DAY_START_HOUR:02d}:00 МСК"
+    return report_text
+
+def format_combined_report(items, clock):
+    # Несколько проектов в одном чате/топике - одно сообщение (или несколько по 4096)
+    local_time, tz_label = clock
+    header = f"📊 Отчёт по проектам ({len(items)})\n"
+    header += f"📅 Дата: {local_time.strftime('%d.%m.%Y')}\n"
+    header += f"⏰ Время: {local_time.strftime('%H:%M')} {tz_label}\n"
+    header += f"🕐 Период: с {STATS_DAY_START_HOUR:02d}:00 МСК\n"
+    entries = [f"\n📁 {session_name}: 💬 новых диалогов: {count}" for session_name, count in items]
+    continuation = f"📊 Отчёт по проектам (продолжение)\n"
+    return pack_chunks(header, entries, continuation=continuation)
+
+def build_reports(session_names, tz=REPORT_TIMEZONE, at=None):
+    # Один проход по аккаунтам: тексты отчётов, сгруппированные по получателю.
+    # at - время слота расписания: отчёт за день, который длился до этого момента,
+    # так что отчёт в час смены дня (04:00) - за закончившийся день, а не за новый
+    if at is None:
+        at = time.time()
+    clock = report_clock(tz, at)
+    today = stats_store.day_of(at - 1)
+    by_destination = {}  # (group_id, thread_id) -> [(session_name, count)]
+    for session_name in session_names:
+        acc = bot_data['accounts'].get(session_name)
+        if acc is None:
+            continue
+        if not acc.get('group_id'):
+            print(f"⚠️ Для {session_name} не назначен чат. Используйте /assign_chat")
+            continue
+        destination = (int(acc['group_id']), int(acc['thread_id']) if acc.get('thread_id') else None)
+        by_destination.setdefault(destination, []).append(
+            (session_name, stats_store.day_total(session_name, today))
+        )
     
-    next_report = moscow_now.replace(hour=report_hours[0], minute=0, second=0, microsecond=0) + timedelta(days=1)
-    return next_report - moscow_offset
+    reports = {}
+    for destination, items in by_destination.items():
+        if len(items) == 1:
+            reports[destination] = [format_report(items[0][0], items[0][1], clock)]
+        else:
+            reports[destination] = format_combined_report(items, clock)
+    return reports
 
-async def send_report(session_name):
-    if session_name not in bot_data['accounts']:
+async def send_reports(session_names, tz=REPORT_TIMEZONE, at=None):
+    if not bot:
         return
+    started = time.monotonic()
+    reports = build_reports(session_names, tz, at)
+    built = time.monotonic() - started
+    semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+    failed = 0
     
-    acc = bot_data['accounts'][session_name]
-    today = datetime.now().strftime('%Y-%m-%d')
-    count = bot_data['daily_stats'].get(session_name, {}).get(today, 0)
+    async def deliver(destination, chunks):
+        nonlocal failed
+        group_id, thread_id = destination
+        async with semaphore:
+            # Части одного получателя - по порядку, разные получатели - параллельно
+            for chunk in chunks:
+                try:
+                    await outbound.send_message(group_id, chunk, reply_to=thread_id, priority=PRIORITY_REPORT)
+                except Exception as e:
+                    failed += 1
+                    print(f"Ошибка отправки отчёта в {group_id}: {e}")
+                    return
     
-    if 'group_id' in acc and acc['group_id'] and bot:
-        try:
-            moscow_time = datetime.now() + timedelta(hours=3)
-            report_text = f"📊 Отчёт по проекту {session_name}\n"
-            report_text += f"📅 Дата: {moscow_time.strftime('%d.%m.%Y')}\n"
-            report_text += f"⏰ Время: {moscow_time.strftime('%H:%M')} МСК\n"
-            report_text += f"💬 Новых диалогов: {count}\n"
-            report_text += f"🕐 Период: с 04:00 МСК"
-            
-            # Отправляем в топик если указан thread_id
-            send_kwargs = {'message': report_text}
-            if acc.get('thread_id'):
-                send_kwargs['reply_to'] = int(acc['thread_id'])
-            
-            await bot.send_message(int(acc['group_id']), **send_kwargs)
-        except Exception as e:
-            print(f"Ошибка отправки отчёта для {session_name}: {e}")
-    else:
-        print(f"⚠️ Для {session_name} не назначен чат. Используйте /assign_chat")
+    await asyncio.gather(*(deliver(destination, chunks) for destination, chunks in reports.items()))
+    messages = sum(len(chunks) for chunks in reports.values())
+    print(f"📊 Отчёты: аккаунтов {len(session_names)}, получателей {len(reports)}, "
+          f"сообщений {messages}, ошибок {failed}; "
+          f"подготовка {built * 1000:.0f} мс, всего {time.monotonic() - started:.1f} с")
 
-async def report_scheduler():
-    while True:
-        try:
-            next_report = get_next_report_time()
-            wait_seconds = (next_report - datetime.now()).total_seconds()
-            
-            if wait_seconds > 0:
-                await asyncio.sleep(wait_seconds)
-            
-            for session_name in list(bot_data['accounts'].keys()):
-                await send_report(session_name)
-            
-            moscow_now = datetime.now() + timedelta(hours=3)
-            if moscow_now.hour == 16:
-                today = datetime.now().strftime('%Y-%m-%d')
-                for session_name in bot_data['accounts']:
-                    if session_name not in bot_data['daily_stats']:
-                        bot_data['daily_stats'][session_name] = {}
-                    bot_data['daily_stats'][session_name] = {today: bot_data['daily_stats'][session_name].get(today, 0)}
-                save_data()
-        except Exception as e:
-            print(f"Ошибка в планировщике отчётов: {e}")
-            await asyncio.sleep(60)
+def report_job_name(times, tz):
+    return f"report:{format_times(times)}@{tz}"
+
+def report_group(times, tz):
+    # Аккаунты с этим расписанием - на момент запуска, так что добавление
+    # аккаунта или смена расписания не требуют пересоздавать задачу
+    return [
+        name for name, acc in bot_data['accounts'].items()
+        if report_schedule(acc) == (times, tz)
+    ]
+
+async def run_scheduled_reports(times, tz, slot):
+    session_names = report_group(times, tz)
+    if session_names:
+        await send_reports(session_names, tz, slot)
+
+def mark_reported(times, tz, slot):
+    # Время слота сохраняется, чтобы после простоя догнать пропущенный отчёт
+    for name in report_group(times, tz):
+        bot_data['accounts'][name]['last_report'] = slot
+        save_data(name)
+
+def schedule_reports():
+    # Одна задача на каждое различное расписание: отчёты аккаунтов с общим
+    # расписанием собираются вместе и группируются по получателю
+    groups = {}
+    for acc in bot_data['accounts'].values():
+        times, tz = report_schedule(acc)
+        if times:
+            last_report = acc.get('last_report')
+            previous = groups.get((times, tz))
+            if previous is None or (last_report or 0) > previous:
+                groups[(times, tz)] = last_report
+    
+    wanted = {report_job_name(times, tz): (times, tz) for times, tz in groups}
+    for name in scheduler.names('report:'):
+        if name not in wanted:
+            scheduler.remove(name)
+    for name, (times, tz) in wanted.items():
+        if scheduler.get(name) is None:
+            scheduler.add(
+                name, DailyAt(times, tz),
+                functools.partial(run_scheduled_reports, times, tz),
+                on_run=functools.partial(mark_reported, times, tz),
+                last_run=groups[(times, tz)]
+            )
+
+async def expire_message_caches(slot):
+    for cache in list(bot_data['message_cache'].values()):
+        cache.expire()
+
+def start_scheduler():
+    schedule_reports()
+    scheduler.add('cache_expire', Every(CACHE_EXPIRE_INTERVAL), expire_message_caches)
+    scheduler.start()
 
 async def create_project_subgroup(session_name):
     # Боты не могут создавать группы через API
@@ -137,266 +512,502 @@ async def create_project_subgroup(session_name):
     print(f"⚠️ Для {session_name} нужно вручную создать топик и назначить через /assign_chat")
     return None
 
-async def start_user_client(session_name, api_id, api_hash, phone):
+def format_deleted_alert(msg_id, chat_id, chat_name, text):
+    msg_text = f"🗑️ **Удалённое сообщение**\n\n"
+    msg_text += f"👤 **Из диалога:** {chat_name}\n"
+    msg_text += f"🆔 **ID чата:** `{chat_id}`\n"
+    msg_text += f"📝 **ID сообщения:** `{msg_id}`\n"
+    msg_text += f"⏰ **Время удаления:** {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n"
+    
+    msg_text += f"\n📄 **Содержимое:**\n"
+    if text:
+        # Ограничиваем длину текста
+        text_content = text
+        if len(text_content) > 3000:
+            text_content = text_content[:3000] + "... (текст обрезан)"
+        msg_text += f"{text_content}\n"
+    else:
+        msg_text += "_Текст отсутствует_\n"
+    return msg_text
+
+async def send_deleted_media(client, group_id, thread_id, msg_id, chat_name, media):
     try:
-        client = TelegramClient(f'sessions/{session_name}', api_id, api_hash)
-        await client.connect()
+        if not media.downloadable:
+            raise ValueError("медиа этого типа нельзя скачать")
         
-        if not await client.is_user_authorized():
-            result = await client.send_code_request(phone)
-            # Сохраняем phone_code_hash для последующей верификации
-            bot_data['pending_verifications'][session_name] = {
-                'phone_code_hash': result.phone_code_hash,
-                'client': client
+        media_caption = f"🗑️ Медиа из удалённого сообщения\n👤 Из: {chat_name}\n📝 ID: `{msg_id}`"
+        
+        # Файл уже скачан заранее - отправляем сразу с диска,
+        # иначе качаем в буфер в памяти (или во временный файл, если он большой)
+        async with media_relay.open(client, media, media_store) as media_file:
+            # Отправляем
+            send_kwargs = {
+                'caption': media_caption,
+                'reply_to': thread_id
             }
-            return None, "CODE_REQUIRED"
+            
+            if media.is_voice:
+                # Голосовое сообщение
+                await outbound.send_file(group_id, media_file, voice_note=True, **send_kwargs)
+            elif media.is_video_note:
+                # Видео-кружок
+                await outbound.send_file(group_id, media_file, video_note=True, **send_kwargs)
+            else:
+                # Все остальные типы (фото, видео, документы)
+                # force_document=False позволит Telegram автоматически определить тип
+                await outbound.send_file(group_id, media_file, force_document=False, **send_kwargs)
         
-        # Инициализация кэша сообщений для этой сессии
-        if session_name not in bot_data['message_cache']:
-            bot_data['message_cache'][session_name] = {}
+    except Exception as e:
+        print(f"Ошибка отправки медиа: {e}")
+        import traceback
+        traceback.print_exc()
+        # Отправляем уведомление о проблеме с медиа
+        error_msg = f"⚠️ Не удалось отправить медиа из сообщения `{msg_id}`\n"
+        error_msg += f"Тип медиа: {media.kind}\n"
+        error_msg += f"Ошибка: `{str(e)[:200]}`"
+        await outbound.send_message(group_id, error_msg, reply_to=thread_id)
+
+def pack_chunks(header, entries, limit=4096, continuation=''):
+    # Складывает записи в как можно меньшее число сообщений не длиннее limit
+    chunks = []
+    current = header
+    has_entries = False
+    for entry in entries:
+        if has_entries and len(current) + len(entry) > limit:
+            chunks.append(current)
+            current = continuation
+            has_entries = False
+        if len(current) + len(entry) > limit:
+            entry = entry[:limit - len(current)]
+        current += entry
+        has_entries = True
+    if has_entries or not chunks:
+        chunks.append(current)
+    return chunks
+
+def format_deleted_digest(chat_id, items):
+    chat_name = items[0][2]
+    header = f"🗑️ **Удалено сообщений: {len(items)}**\n\n"
+    header += f"👤 **Из диалога:** {chat_name}\n"
+    header += f"🆔 **ID чата:** `{chat_id}`\n"
+    header += f"⏰ **Время удаления:** {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n"
+    
+    entries = []
+    for msg_id, record, _ in sorted(items, key=lambda item: item[0]):
+        text_content = record.text or "_Текст отсутствует_"
+        if len(text_content) > 3000:
+            text_content = text_content[:3000] + "... (текст обрезан)"
+        entry = f"\n📝 `{msg_id}`: {text_content}\n"
+        if record.media:
+            entry += f"📎 Медиа: {media_class(record.media) if record.media.downloadable else record.media.kind}\n"
+        entries.append(entry)
+    
+    continuation = f"🗑️ **Удалённые сообщения из {chat_name} (продолжение)**\n"
+    return pack_chunks(header, entries, continuation=continuation)
+
+async def send_deleted_album(client, group_id, thread_id, chat_name, items):
+    # items: [(msg_id, media)] - до 10 фото/видео, одним альбомом
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            files = []
+            captions = []
+            for msg_id, media in items:
+                files.append(await stack.enter_async_context(
+                    media_relay.open(client, media, media_store)
+                ))
+                captions.append(f"🗑️ Медиа из удалённого сообщения\n👤 Из: {chat_name}\n📝 ID: `{msg_id}`")
+            await outbound.send_file(group_id, files, caption=captions, reply_to=thread_id, force_document=False)
+    except Exception as e:
+        # Альбом не отправился - пробуем по одному
+        print(f"Ошибка отправки альбома: {e}")
+        for msg_id, media in items:
+            await send_deleted_media(client, group_id, thread_id, msg_id, chat_name, media)
+
+def dispatch_deletions(key, context, items):
+    # Вызывается DeletionCoalescer: ставит уведомления в очереди отправки
+    session_name, chat_id = key
+    client, group_id, thread_id = context
+    destination = (group_id, thread_id)
+    
+    if len(items) == 1:
+        msg_id, record, chat_name = items[0]
+        msg_text = format_deleted_alert(msg_id, chat_id, chat_name, record.text)
+        deletion_dispatcher.submit(destination, 'text', functools.partial(
+            outbound.send_message, group_id, msg_text, reply_to=thread_id
+        ))
+        if record.media:
+            deletion_dispatcher.submit(destination, 'media', functools.partial(
+                send_deleted_media, client, group_id, thread_id, msg_id, chat_name, record.media
+            ))
+        return
+    
+    # Сводка: текст всех сообщений в минимуме сообщений по 4096 символов
+    for chunk in format_deleted_digest(chat_id, items):
+        deletion_dispatcher.submit(destination, 'text', functools.partial(
+            outbound.send_message, group_id, chunk, reply_to=thread_id
+        ))
+    
+    # Фото и видео - альбомами до 10 штук, остальное медиа - по одному
+    chat_name = items[0][2]
+    album = []
+    for msg_id, record, _ in sorted(items, key=lambda item: item[0]):
+        media = record.media
+        if not media:
+            continue
+        if media.downloadable and media_class(media) in ('photo', 'video'):
+            album.append((msg_id, media))
+        else:
+            deletion_dispatcher.submit(destination, 'media', functools.partial(
+                send_deleted_media, client, group_id, thread_id, msg_id, chat_name, media
+            ))
+    for i in range(0, len(album), 10):
+        part = album[i:i + 10]
+        if len(part) == 1:
+            msg_id, media = part[0]
+            job = functools.partial(send_deleted_media, client, group_id, thread_id, msg_id, chat_name, media)
+        else:
+            job = functools.partial(send_deleted_album, client, group_id, thread_id, chat_name, part)
+        deletion_dispatcher.submit(destination, 'media', job)
+
+def start_dialog_ingest(session_name, client, acc, entities):
+    async def run():
+        print(f"📥 Загружаем существующие диалоги для {session_name}...")
+        started = time.monotonic()
         
-        # Загружаем существующие диалоги при первом запуске
-        acc = bot_data['accounts'].get(session_name, {})
-        if 'dialogs' not in acc or not acc.get('initialized'):
-            print(f"📥 Загружаем существующие диалоги для {session_name}...")
-            acc['dialogs'] = set()
+        def on_dialog(dialog):
+            acc['dialogs'].add(dialog.id)
+            entities.put(dialog.id, dialog.entity)
+        
+        try:
+            await ingest_dialogs(
+                client, acc, on_dialog, lambda: save_data(session_name), DIALOG_INGEST_PAGE_SIZE
+            )
+        except Exception as e:
+            print(f"❌ Ошибка загрузки диалогов {session_name}: {e} (продолжится при следующем запуске)")
+            return
+        finally:
+            if dialog_ingest_tasks.get(session_name) is asyncio.current_task():
+                del dialog_ingest_tasks[session_name]
+        print(f"✅ Загружено {len(acc['dialogs'])} существующих диалогов для {session_name} "
+              f"за {time.monotonic() - started:.1f} с")
+    
+    dialog_ingest_tasks[session_name] = asyncio.create_task(run())
+
+def start_entity_prefill(session_name, semaphore=None):
+    # Диалоги аккаунта уже загружены раньше - заполняем кэш чатов последними
+    # диалогами, чтобы первые сообщения после запуска не ходили в сеть за
+    # названием чата. Кэш уже набран (клиент перезапущен в том же процессе) -
+    # не запрашиваем. При общем запуске идёт через тот же semaphore, что и
+    # запуск клиентов, - после них и не больше STARTUP_CONCURRENCY сразу
+    client = user_clients.get(session_name)
+    entities = bot_data['entity_cache'].get(session_name)
+    limit = min(ENTITY_PREFILL_DIALOGS, ENTITY_CACHE_MAX_ENTRIES)
+    if client is None or entities is None or limit <= 0 or len(entities) >= limit:
+        return
+    if session_name in dialog_ingest_tasks:
+        return
+    
+    async def fill():
+        started = time.monotonic()
+        added = 0
+        
+        def on_dialog(dialog):
+            nonlocal added
+            if entities.prefill(dialog.id, dialog.entity):
+                added += 1
+        
+        await recent_dialogs(client, on_dialog, limit, DIALOG_INGEST_PAGE_SIZE)
+        print(f"🗂 Кэш чатов {session_name}: {added} за {time.monotonic() - started:.1f} с")
+    
+    async def run():
+        try:
+            if semaphore is None:
+                await fill()
+            else:
+                async with semaphore:
+                    await asyncio.sleep(random.uniform(0, STARTUP_JITTER))
+                    await fill()
+        except Exception as e:
+            print(f"⚠️ Не удалось заполнить кэш чатов {session_name}: {e}")
+        finally:
+            if dialog_ingest_tasks.get(session_name) is asyncio.current_task():
+                del dialog_ingest_tasks[session_name]
+    
+    # Та же таблица задач, что у загрузки диалогов: stop_account отменит и эту
+    dialog_ingest_tasks[session_name] = asyncio.create_task(run())
+
+async def stop_account(name):
+    # Останавливает клиент аккаунта и удаляет его кэши
+    task = dialog_ingest_tasks.pop(name, None)
+    if task:
+        task.cancel()
+    if name in user_clients:
+        await user_clients[name].disconnect()
+        del user_clients[name]
+    cache = bot_data['message_cache'].pop(name, None)
+    if cache is not None:
+        cache.clear()
+    bot_data['entity_cache'].pop(name, None)
+    account_rules.pop(name, None)
+    client_handlers.pop(name, None)
+    if disk_cache:
+        await disk_cache.drop_session(name)
+    if media_store:
+        media_store.drop_session(name)
+
+def trace_media_kind(media):
+    # Тип медиа в трассе: класс скачиваемого медиа или other (гео, опросы, превью ссылок)
+    if media is None:
+        return None
+    return media_class(media) if media.downloadable else 'other'
+
+def message_event_filter(rules):
+    # Фильтр новых сообщений по правилам аккаунта: отбрасывает Telethon, до обработчика
+    if rules.accepts_all:
+        return events.NewMessage()
+    kwargs = {}
+    if not rules.outgoing:
+        kwargs['incoming'] = True
+    if rules.deny:
+        kwargs['chats'] = list(rules.deny)
+        kwargs['blacklist_chats'] = True
+    if not rules.all_kinds or rules.allow:
+        kwargs['func'] = rules.event_filter
+    return events.NewMessage(**kwargs)
+
+def deleted_event_filter(rules):
+    # Из запрещённых и заглушённых каналов в кэше ничего нет - удаления не нужны.
+    # В личных чатах и группах chat_id удаления неизвестен, такие события проходят
+    skipped = rules.deny | rules.muted
+    if not skipped:
+        return events.MessageDeleted()
+    return events.MessageDeleted(chats=list(skipped), blacklist_chats=True)
+
+def apply_chat_rules(session_name):
+    # Правила аккаунта изменились: перерегистрируем обработчики с новыми фильтрами
+    acc = bot_data['accounts'].get(session_name)
+    if acc is None:
+        return
+    rules = account_rules[session_name] = ChatRules(acc.get('rules'))
+    handlers = client_handlers.get(session_name)
+    if handlers is None:
+        return
+    client, message_handler, deleted_handler = handlers
+    client.remove_event_handler(message_handler)
+    client.remove_event_handler(deleted_handler)
+    client.add_event_handler(message_handler, message_event_filter(rules))
+    client.add_event_handler(deleted_handler, deleted_event_filter(rules))
+
+def register_client_handlers(session_name, client):
+    # Обработчики событий аккаунта; вызывается и из бенчмарков с клиентом-заглушкой
+    if session_name not in bot_data['message_cache']:
+        bot_data['message_cache'][session_name] = new_message_cache()
+    if session_name not in bot_data['entity_cache']:
+        bot_data['entity_cache'][session_name] = EntityCache(ENTITY_CACHE_MAX_ENTRIES)
+    entities = bot_data['entity_cache'][session_name]
+    rules = account_rules[session_name] = ChatRules(bot_data['accounts'].get(session_name, {}).get('rules'))
+    
+    @client.on(message_event_filter(rules))
+    @measured('message', session_name)
+    async def message_cache_handler(event):
+        try:
+            if session_name not in bot_data['accounts']:
+                return
             
-            # Получаем все диалоги
-            async for dialog in client.iter_dialogs(limit=None):
-                # Добавляем только диалоги с сообщениями (исключаем пустые)
-                if dialog.message:
-                    acc['dialogs'].add(dialog.id)
+            # Заглушённый чат: только учёт новых диалогов, без кэша
+            current_rules = account_rules.get(session_name)
+            muted = current_rules is not None and event.chat_id in current_rules.muted
+            if muted and event.message.out:
+                return
             
-            acc['initialized'] = True
-            bot_data['accounts'][session_name] = acc
-            save_data()
-            print(f"✅ Загружено {len(acc['dialogs'])} существующих диалогов для {session_name}")
-        
-        # Регистрация обработчиков
-        @client.on(events.NewMessage)
-        async def message_cache_handler(event):
+            # Сохраняем сообщение в кэш (для отслеживания удалений)
             try:
-                if session_name not in bot_data['accounts']:
-                    return
-                
-                # Сохраняем сообщение в кэш (для отслеживания удалений)
-                try:
-                    chat = await event.get_chat()
+                # Название чата - из кэша или из сущностей, пришедших с обновлением;
+                # в сеть идём, только если Telethon не прислал чат вместе с сообщением
+                info = entities.get(event.chat_id)
+                if info is None:
+                    chat = event.chat or await event.get_chat()
                     if not chat:
                         return
-                    
-                    chat_id = chat.id
-                    msg_id = event.message.id
-                    
+                    info = entities.put(event.chat_id, chat)
+                
+                chat_id, chat_name, _ = info
+                msg_id = event.message.id
+                
+                if not muted:
                     # Сохраняем данные сообщения
                     if session_name not in bot_data['message_cache']:
-                        bot_data['message_cache'][session_name] = {}
-                    
-                    # Используем msg_id как ключ (без chat_id, так как он может быть недоступен при удалении)
-                    bot_data['message_cache'][session_name][msg_id] = {
-                        'text': event.message.text or '',
-                        'media': event.message.media,
-                        'message': event.message,
-                        'chat_id': chat_id,
-                        'chat_name': getattr(chat, 'title', None) or getattr(chat, 'first_name', 'Unknown'),
-                        'date': datetime.now()
-                    }
-                    
-                    # Проверяем новый диалог (только входящие)
-                    if event.message.out:
-                        return
-                    
-                    acc = bot_data['accounts'][session_name]
-                    if 'dialogs' not in acc:
-                        acc['dialogs'] = set()
+                        bot_data['message_cache'][session_name] = new_message_cache()
                     
-                    # НОВЫЙ ДИАЛОГ только если его НЕТ в существующих
-                    if chat_id not in acc['dialogs']:
-                        acc['dialogs'].add(chat_id)
-                        
-                        today = datetime.now().strftime('%Y-%m-%d')
-                        if session_name not in bot_data['daily_stats']:
-                            bot_data['daily_stats'][session_name] = {}
-                        if today not in bot_data['daily_stats'][session_name]:
-                            bot_data['daily_stats'][session_name][today] = 0
-                        
-                        bot_data['daily_stats'][session_name][today] += 1
-                        save_data()
-                        
-                        print(f"📬 Новый диалог для {session_name}: {getattr(chat, 'title', None) or getattr(chat, 'first_name', 'Unknown')}")
-                except Exception as e:
-                    print(f"Ошибка сохранения сообщения в кэш: {e}")
-            except Exception as e:
-                print(f"Ошибка кэширования сообщения: {e}")
-        
-        @client.on(events.MessageDeleted)
-        async def deleted_handler(event):
-            try:
-                if session_name not in bot_data['accounts']:
+                    # Личные чаты и группы - ключ msg_id (chat_id при удалении недоступен),
+                    # каналы и супергруппы - (chat_id, msg_id): там ID сообщений свои у каждого канала
+                    # Старые записи вытесняются кэшем при вставке (лимиты по количеству, объёму и TTL)
+                    # Сам объект Message не храним - только компактную запись и описание медиа
+                    cache = bot_data['message_cache'][session_name]
+                    media = event.message.media
+                    channel_id = event.chat_id if event.is_channel else None
+                    key = cache_key(channel_id, msg_id)
+                    # Сообщение группы, уже полученное другим аккаунтом, - общая запись
+                    record = content_store.message(key) if channel_id is not None else None
+                    if record is None:
+                        record = CachedMessage(
+                            event.message.text or '',
+                            chat_id,
+                            cache.chat_name_idx(chat_name),
+                            int(time.time()),
+                            content_store.media_ref(media) if media else None
+                        )
+                    cache.put(key, record)
+                    metric_messages_cached.inc(session=session_name)
+                    if trace_recorder:
+                        trace_recorder.message(
+                            session_name, event.chat_id, event.is_channel, msg_id, event.message.out,
+                            trace_media_kind(record.media), record.media.size if record.media else 0
+                        )
+                    if disk_cache:
+                        # Запишется на диск пачкой в фоне
+                        disk_cache.put(session_name, key, record, chat_name)
+                    if media_store and record.media:
+                        # Скачается в фоне, пока file_reference ещё действителен
+                        media_store.enqueue(session_name, client, record.media)
+                
+                # Проверяем новый диалог (только входящие)
+                if event.message.out:
                     return
                 
                 acc = bot_data['accounts'][session_name]
-                if 'group_id' not in acc or not acc['group_id'] or not bot:
-                    return
+                if 'dialogs' not in acc:
+                    acc['dialogs'] = CompactIdSet()
                 
-                # Обрабатываем каждое удалённое сообщение
-                for msg_id in event.deleted_ids:
-                    # Ищем сообщение в кэше по msg_id
-                    cached_msg = bot_data['message_cache'].get(session_name, {}).get(msg_id)
-                    
-                    if not cached_msg:
-                        # Сообщение не найдено в кэше, пропускаем
-                        print(f"⚠️ Сообщение {msg_id} не найдено в кэше (было до запуска бота)")
-                        continue
-                    
-                    chat_id = cached_msg.get('chat_id', 'Unknown')
-                    chat_name = cached_msg.get('chat_name', f'Chat {chat_id}')
-                    
-                    msg_text = f"🗑️ **Удалённое сообщение**\n\n"
-                    msg_text += f"👤 **Из диалога:** {chat_name}\n"
-                    msg_text += f"🆔 **ID чата:** `{chat_id}`\n"
-                    msg_text += f"📝 **ID сообщения:** `{msg_id}`\n"
-                    msg_text += f"⏰ **Время удаления:** {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n"
-                    
-                    msg_text += f"\n📄 **Содержимое:**\n"
-                    if cached_msg['text']:
-                        # Ограничиваем длину текста
-                        text_content = cached_msg['text']
-                        if len(text_content) > 3000:
-                            text_content = text_content[:3000] + "... (текст обрезан)"
-                        msg_text += f"{text_content}\n"
-                    else:
-                        msg_text += "_Текст отсутствует_\n"
-                    
-                    # Отправляем текст
-                    send_kwargs = {}
-                    if acc.get('thread_id'):
-                        send_kwargs['reply_to'] = int(acc['thread_id'])
-                    
-                    await bot.send_message(int(acc['group_id']), msg_text, **send_kwargs)
-                    
-                    # Отправляем медиа если есть
-                    if cached_msg['media']:
-                        try:
-                            original_msg = cached_msg['message']
-                            media_caption = f"🗑️ Медиа из удалённого сообщения\n👤 Из: {chat_name}\n📝 ID: `{msg_id}`"
-                            
-                            from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
-                            import tempfile
-                            import os
-                            
-                            # Определяем тип медиа и расширение файла
-                            is_photo = isinstance(original_msg.media, MessageMediaPhoto)
-                            file_ext = '.jpg'
-                            is_voice = False
-                            is_video_note = False
-                            
-                            if hasattr(original_msg.media, 'document'):
-                                doc = original_msg.media.document
-                                mime = doc.mime_type
-                                
-                                # Получаем расширение из mime_type
-                                if '/' in mime:
-                                    file_ext = '.' + mime.split('/')[-1]
-                                    if file_ext == '.jpeg':
-                                        file_ext = '.jpg'
-                                
-                                # Проверяем атрибуты
-                                for attr in doc.attributes:
-                                    attr_type = type(attr).__name__
-                                    if attr_type == 'DocumentAttributeFilename':
-                                        # Используем оригинальное расширение файла
-                                        original_name = attr.file_name
-                                        if '.' in original_name:
-                                            file_ext = '.' + original_name.split('.')[-1]
-                                    elif attr_type == 'DocumentAttributeAudio' and hasattr(attr, 'voice') and attr.voice:
-                                        is_voice = True
-                                        file_ext = '.ogg'
-                                    elif attr_type == 'DocumentAttributeVideo':
-                                        if hasattr(attr, 'round_message') and attr.round_message:
-                                            is_video_note = True
-                                            file_ext = '.mp4'
-                            
-                            # Создаём временный файл с правильным расширением
-                            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_ext)
-                            temp_path = temp_file.name
-                            temp_file.close()
-                            
-                            # Скачиваем файл
-                            await client.download_media(original_msg, file=temp_path)
-                            
-                            # Отправляем
-                            send_kwargs = {
-                                'caption': media_caption,
-                                'reply_to': int(acc['thread_id']) if acc.get('thread_id') else None
-                            }
-                            
-                            if is_voice:
-                                # Голосовое сообщение
-                                await bot.send_file(
-                                    int(acc['group_id']),
-                                    temp_path,
-                                    voice_note=True,
-                                    **send_kwargs
-                                )
-                            elif is_video_note:
-                                # Видео-кружок
-                                await bot.send_file(
-                                    int(acc['group_id']),
-                                    temp_path,
-                                    video_note=True,
-                                    **send_kwargs
-                                )
-                            else:
-                                # Все остальные типы (фото, видео, документы)
-                                # force_document=False позволит Telegram автоматически определить тип
-                                await bot.send_file(
-                                    int(acc['group_id']),
-                                    temp_path,
-                                    force_document=False,
-                                    **send_kwargs
-                                )
-                            
-                            # Удаляем временный файл
-                            try:
-                                os.unlink(temp_path)
-                            except:
-                                pass
-                            
-                        except Exception as e:
-                            print(f"Ошибка отправки медиа: {e}")
-                            import traceback
-                            traceback.print_exc()
-                            # Отправляем уведомление о проблеме с медиа
-                            error_msg = f"⚠️ Не удалось отправить медиа из сообщения `{msg_id}`\n"
-                            error_msg += f"Тип медиа: {type(cached_msg['media']).__name__}\n"
-                            error_msg += f"Ошибка: `{str(e)[:200]}`"
-                            await bot.send_message(
-                                int(acc['group_id']), 
-                                error_msg,
-                                reply_to=int(acc['thread_id']) if acc.get('thread_id') else None
-                            )
+                # НОВЫЙ ДИАЛОГ только если его НЕТ в существующих
+                if chat_id not in acc['dialogs']:
+                    if not acc.get('initialized') and await is_existing_dialog(client, event.chat_id, msg_id):
+                        # Загрузка диалогов ещё не дошла до этого чата - он не новый
+                        acc['dialogs'].add(chat_id)
+                        save_data(session_name)
+                        return
                     
-                    # Удаляем сообщение из кэша после обработки
-                    del bot_data['message_cache'][session_name][msg_id]
-                
-                # Очищаем старые сообщения из кэша (старше 7 дней)
-                if session_name in bot_data['message_cache']:
-                    to_delete = []
-                    for msg_id, cached in bot_data['message_cache'][session_name].items():
-                        if (datetime.now() - cached['date']).days > 7:
-                            to_delete.append(msg_id)
+                    acc['dialogs'].add(chat_id)
+                    count_new_dialog(session_name)
+                    save_data(session_name)
                     
-                    for msg_id in to_delete:
-                        del bot_data['message_cache'][session_name][msg_id]
-                
+                    print(f"📬 Новый диалог для {session_name}: {chat_name}")
             except Exception as e:
-                print(f"Ошибка обработки удалённого сообщения: {e}")
-                import traceback
-                traceback.print_exc()
+                print(f"Ошибка сохранения сообщения в кэш: {e}")
+        except Exception as e:
+            print(f"Ошибка кэширования сообщения: {e}")
+    
+    @client.on(events.ChatAction)
+    async def chat_action_handler(event):
+        # Название чата изменилось - следующее сообщение возьмёт новое
+        if event.new_title:
+            entities.invalidate(event.chat_id)
+    
+    @client.on(deleted_event_filter(rules))
+    @measured('deleted', session_name)
+    async def deleted_handler(event):
+        try:
+            if session_name not in bot_data['accounts']:
+                return
+            if trace_recorder:
+                trace_recorder.deleted(session_name, event.chat_id, event.deleted_ids)
+            
+            acc = bot_data['accounts'][session_name]
+            if 'group_id' not in acc or not acc['group_id'] or not bot:
+                return
+            
+            group_id = int(acc['group_id'])
+            thread_id = int(acc['thread_id']) if acc.get('thread_id') else None
+            found = {}  # chat_id -> [(msg_id, запись кэша, название чата)]
+            
+            # Обрабатываем каждое удалённое сообщение
+            # chat_id известен только для удалений в каналах и супергруппах
+            channel_id = event.chat_id
+            cache = bot_data['message_cache'].get(session_name)
+            
+            for msg_id in event.deleted_ids:
+                # Ищем сообщение в кэше по (канал, msg_id) или по msg_id для личных чатов
+                key = cache_key(channel_id, msg_id)
+                cached_msg = cache.get(key) if cache is not None else None
+                if not cached_msg and disk_cache and cache is not None:
+                    # Нет в памяти - ищем на диске (например, получено до перезапуска)
+                    cached_msg = disk_cache.get(session_name, key, cache)
+                
+                if not cached_msg:
+                    # Сообщение не найдено в кэше, пропускаем
+                    metric_deletions.inc(session=session_name, result='missing')
+                    print(f"⚠️ Сообщение {msg_id} не найдено в кэше (было до запуска бота)")
+                    continue
+                
+                metric_deletions.inc(session=session_name, result='found')
+                found.setdefault(cached_msg.chat_id, []).append(
+                    (msg_id, cached_msg, cache.chat_name(cached_msg))
+                )
+                
+                # Удаляем сообщение из кэша после обработки
+                cache.pop(key)
+                if disk_cache:
+                    disk_cache.discard(session_name, key)
+            
+            # Одиночное удаление уходит сразу, массовые - сводкой по чату
+            for chat_id, items in found.items():
+                deletion_coalescer.add(
+                    (session_name, chat_id), (client, group_id, thread_id), items
+                )
+            
+        except Exception as e:
+            print(f"Ошибка обработки удалённого сообщения: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    client_handlers[session_name] = (client, message_cache_handler, deleted_handler)
+
+async def start_user_client(session_name, api_id, api_hash, phone, timeline=None):
+    # timeline: {этап: секунды} - длительность этапов запуска для лога
+    if timeline is None:
+        timeline = {}
+    started = time.monotonic()
+    
+    def mark(phase):
+        nonlocal started
+        now = time.monotonic()
+        timeline[phase] = now - started
+        started = now
+    
+    try:
+        client = TelegramClient(f'sessions/{session_name}', api_id, api_hash)
+        await client.connect()
+        mark('connect')
+        
+        authorized = await client.is_user_authorized()
+        mark('authorize')
+        if not authorized:
+            result = await client.send_code_request(phone)
+            # Сохраняем phone_code_hash для последующей верификации
+            bot_data['pending_verifications'][session_name] = {
+                'phone_code_hash': result.phone_code_hash,
+                'client': client
+            }
+            return None, "CODE_REQUIRED"
+        
+        # Существующие диалоги при первом запуске загружаются в фоне, уже после
+        # регистрации обработчиков; прерванная загрузка продолжается с сохранённой позиции
+        acc = bot_data['accounts'].get(session_name, {})
+        needs_ingest = 'dialogs' not in acc or not acc.get('initialized')
+        if needs_ingest:
+            if not acc.get('ingest_checkpoint'):
+                acc['dialogs'] = CompactIdSet()
+            bot_data['accounts'][session_name] = acc
+        
+        # Регистрация обработчиков
+        register_client_handlers(session_name, client)
+        
+        if needs_ingest:
+            start_dialog_ingest(session_name, client, acc, bot_data['entity_cache'][session_name])
         
         # Запускаем клиент
         await client.catch_up()
+        mark('catch_up')
         user_clients[session_name] = client
         return client, "OK"
         
@@ -405,11 +1016,12 @@ async def start_user_client(session_name, api_id, api_hash, phone):
 
 def setup_bot_handlers(bot_client):
     @bot_client.on(events.NewMessage(pattern='/start'))
+    @measured('/start')
     async def start_handler(event):
         user_id = event.sender_id
         
         if not is_admin(user_id):
-            await event.respond("❌ У вас нет доступа к этому боту.")
+            await respond(event, "❌ У вас нет доступа к этому боту.")
             return
         
         help_text = """
@@ -441,15 +1053,28 @@ def setup_bot_handlers(bot_client):
 /unassign_chat <название>
 - Отвязать чат от аккаунта
 
+/schedule [название] [ЧЧ:ММ,... [пояс] | default | off]
+- Расписание отчётов аккаунта (без параметров - все расписания)
+  Пример: /schedule Ваня 09:00,21:00 Europe/Moscow
+
+/rules <название> [параметр значение]
+- Какие чаты аккаунта кэшировать и учитывать
+  Примеры:
+  /rules Ваня private_only - только личные чаты
+  /rules Ваня deny add -1001234567890 - не принимать чат
+  /rules Ваня muted add 123456789 - учитывать диалог без кэша
+
 **Информация:**
 /list_accounts
 - Список всех аккаунтов
 
-/stats [название]
+/stats [название] [период]
 - Статистика по аккаунту (или общая, если без параметра)
   Примеры:
   /stats - общая статистика по всем
   /stats Ваня - статистика по аккаунту Ваня
+  /stats Ваня 30d - за последние 30 дней
+  /stats Ваня 2024-05-01..2024-05-31 - за период
 
 **Администраторы:**
 /add_admin <user_id>
@@ -457,20 +1082,28 @@ def setup_bot_handlers(bot_client):
 
 /list_admins
 - Список администраторов
+
+**Диагностика:**
+/queue
+- Очередь уведомлений об удалениях и исходящих сообщений
+
+/profile start [секунды] | stop | dump [N] | slow
+- Профилирование и медленные обработчики
 """
         
-        await event.respond(help_text)
+        await respond(event, help_text)
 
     @bot_client.on(events.NewMessage(pattern='/add_account'))
+    @measured('/add_account')
     async def add_account_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
             parts = event.text.split(maxsplit=4)
             if len(parts) < 5:
-                await event.respond("❌ Формат: /add_account <название> <api_id> <api_hash> <телефон>")
+                await respond(event, "❌ Формат: /add_account <название> <api_id> <api_hash> <телефон>")
                 return
             
             name = parts[1]
@@ -479,7 +1112,7 @@ def setup_bot_handlers(bot_client):
             phone = parts[4]
             
             if name in bot_data['accounts']:
-                await event.respond("❌ Аккаунт с таким названием уже существует.")
+                await respond(event, "❌ Аккаунт с таким названием уже существует.")
                 return
             
             # Проверяем, авторизован ли уже клиент
@@ -490,7 +1123,7 @@ def setup_bot_handlers(bot_client):
                 await test_client.disconnect()
                 
                 # Клиент уже авторизован, просто добавляем
-                await event.respond(
+                await respond(event,
                     f"✅ Аккаунт {name} уже авторизован!\n\n"
                     f"Теперь создайте топик в вашей супергруппе и используйте:\n"
                     f"/assign_chat {name} <chat_id>\n\n"
@@ -505,17 +1138,18 @@ def setup_bot_handlers(bot_client):
                     'api_hash': api_hash,
                     'phone': phone,
                     'group_id': None,
-                    'dialogs': set(),
+                    'dialogs': CompactIdSet(),
                     'authorized': True
                 }
-                save_data()
+                save_data(name)
+                schedule_reports()
                 
-                client, status = await start_user_client(name, api_id, api_hash, phone)
+                client, status = await launch_account(name, bot_data['accounts'][name])
             else:
                 # Нужна авторизация
                 await test_client.disconnect()
                 
-                await event.respond(
+                await respond(event,
                     f"🔐 Для аккаунта {name} требуется авторизация.\n\n"
                     f"Используйте команду:\n"
                     f"/login {name}\n\n"
@@ -528,30 +1162,32 @@ def setup_bot_handlers(bot_client):
                     'api_hash': api_hash,
                     'phone': phone,
                     'group_id': None,
-                    'dialogs': set(),
+                    'dialogs': CompactIdSet(),
                     'authorized': False
                 }
-                save_data()
+                save_data(name)
+                schedule_reports()
                 
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/login'))
+    @measured('/login')
     async def login_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
             parts = event.text.split()
             if len(parts) < 2:
-                await event.respond("❌ Формат: /login <название>")
+                await respond(event, "❌ Формат: /login <название>")
                 return
             
             name = parts[1]
             
             if name not in bot_data['accounts']:
-                await event.respond("❌ Аккаунт не найден. Сначала добавьте его через /add_account")
+                await respond(event, "❌ Аккаунт не найден. Сначала добавьте его через /add_account")
                 return
             
             acc = bot_data['accounts'][name]
@@ -562,11 +1198,11 @@ def setup_bot_handlers(bot_client):
             
             if await client.is_user_authorized():
                 await client.disconnect()
-                await event.respond(f"✅ Аккаунт {name} уже авторизован!")
+                await respond(event, f"✅ Аккаунт {name} уже авторизован!")
                 
                 # Запускаем если ещё не запущен
-                if name not in user_clients:
-                    await start_user_client(name, acc['api_id'], acc['api_hash'], acc['phone'])
+                if client_state(name) is None:
+                    await launch_account(name, acc)
                 return
             
             # Отправляем код
@@ -578,7 +1214,7 @@ def setup_bot_handlers(bot_client):
                 'client': client
             }
             
-            await event.respond(
+            await respond(event,
                 f"📱 Код отправлен на номер {acc['phone']}\n\n"
                 f"⚡ ВАЖНО: Введите код БЫСТРО (в течение 1-2 минут)!\n\n"
                 f"Отправьте команду:\n"
@@ -588,25 +1224,26 @@ def setup_bot_handlers(bot_client):
             )
             
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/code'))
+    @measured('/code')
     async def code_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
             parts = event.text.split()
             if len(parts) < 3:
-                await event.respond("❌ Формат: /code <название> <код>")
+                await respond(event, "❌ Формат: /code <название> <код>")
                 return
             
             name = parts[1]
             code = parts[2]
             
             if name not in bot_data['pending_verifications']:
-                await event.respond("❌ Нет активной сессии авторизации. Используйте /login сначала.")
+                await respond(event, "❌ Нет активной сессии авторизации. Используйте /login сначала.")
                 return
             
             acc = bot_data['accounts'][name]
@@ -623,33 +1260,33 @@ def setup_bot_handlers(bot_client):
                 del bot_data['pending_verifications'][name]
                 
                 acc['authorized'] = True
-                save_data()
+                save_data(name)
                 
                 # Запускаем клиент
-                new_client, status = await start_user_client(name, acc['api_id'], acc['api_hash'], acc['phone'])
+                new_client, status = await launch_account(name, acc)
                 
                 if status == "OK":
-                    await event.respond(
+                    await respond(event,
                         f"✅ Аккаунт {name} успешно авторизован и запущен!\n\n"
                         f"Теперь создайте топик в супергруппе и используйте:\n"
                         f"/assign_chat {name} <chat_id>"
                     )
                 else:
-                    await event.respond(f"⚠️ Авторизация прошла, но ошибка запуска: {status}")
+                    await respond(event, f"⚠️ Авторизация прошла, но ошибка запуска: {status}")
                     
             except Exception as e:
                 error_msg = str(e)
                 
                 # Проверяем, нужен ли 2FA пароль
                 if "password" in error_msg.lower() or "2fa" in error_msg.lower():
-                    await event.respond(
+                    await respond(event,
                         f"🔐 Требуется облачный пароль (2FA).\n\n"
                         f"Отправьте команду:\n"
                         f"/password {name} <ваш_пароль>\n\n"
                         f"Пример: /password {name} mySecretPass123"
                     )
                 else:
-                    await event.respond(f"❌ Ошибка входа: {e}\n\nПопробуйте /login {name} заново.")
+                    await respond(event, f"❌ Ошибка входа: {e}\n\nПопробуйте /login {name} заново.")
                     if name in bot_data['pending_verifications']:
                         try:
                             await bot_data['pending_verifications'][name]['client'].disconnect()
@@ -658,25 +1295,26 @@ def setup_bot_handlers(bot_client):
                         del bot_data['pending_verifications'][name]
                     
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/password'))
+    @measured('/password')
     async def password_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
             parts = event.text.split(maxsplit=2)
             if len(parts) < 3:
-                await event.respond("❌ Формат: /password <название> <пароль>")
+                await respond(event, "❌ Формат: /password <название> <пароль>")
                 return
             
             name = parts[1]
             password = parts[2]
             
             if name not in bot_data['pending_verifications']:
-                await event.respond("❌ Нет активной сессии авторизации. Сначала введите код через /code")
+                await respond(event, "❌ Нет активной сессии авторизации. Сначала введите код через /code")
                 return
             
             acc = bot_data['accounts'][name]
@@ -692,22 +1330,22 @@ def setup_bot_handlers(bot_client):
                 del bot_data['pending_verifications'][name]
                 
                 acc['authorized'] = True
-                save_data()
+                save_data(name)
                 
                 # Запускаем клиент
-                new_client, status = await start_user_client(name, acc['api_id'], acc['api_hash'], acc['phone'])
+                new_client, status = await launch_account(name, acc)
                 
                 if status == "OK":
-                    await event.respond(
+                    await respond(event,
                         f"✅ Аккаунт {name} успешно авторизован и запущен!\n\n"
                         f"Теперь создайте топик в супергруппе и используйте:\n"
                         f"/assign_chat {name} <chat_id>"
                     )
                 else:
-                    await event.respond(f"⚠️ Авторизация прошла, но ошибка запуска: {status}")
+                    await respond(event, f"⚠️ Авторизация прошла, но ошибка запуска: {status}")
                     
             except Exception as e:
-                await event.respond(f"❌ Ошибка: {e}\n\nПопробуйте /login {name} заново.")
+                await respond(event, f"❌ Ошибка: {e}\n\nПопробуйте /login {name} заново.")
                 if name in bot_data['pending_verifications']:
                     try:
                         await bot_data['pending_verifications'][name]['client'].disconnect()
@@ -716,59 +1354,61 @@ def setup_bot_handlers(bot_client):
                     del bot_data['pending_verifications'][name]
                     
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
         finally:
             # Удаляем сообщение с паролем для безопасности
             try:
-                await event.delete()
+                await outbound.delete_messages(event.chat_id, [event.id])
             except:
                 pass
 
     @bot_client.on(events.NewMessage(pattern='/remove_account'))
+    @measured('/remove_account')
     async def remove_account_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
             parts = event.text.split()
             if len(parts) < 2:
-                await event.respond("❌ Формат: /remove_account <название>")
+                await respond(event, "❌ Формат: /remove_account <название>")
                 return
             
             name = parts[1]
             
             if name not in bot_data['accounts']:
-                await event.respond("❌ Аккаунт не найден.")
+                await respond(event, "❌ Аккаунт не найден.")
                 return
             
-            if name in user_clients:
-                await user_clients[name].disconnect()
-                del user_clients[name]
+            if shard_supervisor:
+                shard_supervisor.stop_account(name)
+            await stop_account(name)
             
             del bot_data['accounts'][name]
-            if name in bot_data['daily_stats']:
-                del bot_data['daily_stats'][name]
+            stats_store.drop(name)
             save_data()
+            schedule_reports()
             
-            await event.respond(f"✅ Аккаунт {name} удалён.")
+            await respond(event, f"✅ Аккаунт {name} удалён.")
             
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/list_accounts'))
+    @measured('/list_accounts')
     async def list_accounts_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         if not bot_data['accounts']:
-            await event.respond("📋 Нет добавленных аккаунтов.")
+            await respond(event, "📋 Нет добавленных аккаунтов.")
             return
         
         text = "📋 **Список аккаунтов:**\n\n"
         for name, acc in bot_data['accounts'].items():
-            status = "🟢 Активен" if name in user_clients else "🔴 Неактивен"
+            status = "🟢 Активен" if client_state(name) is not None else "🔴 Неактивен"
             chat_status = "✅ Привязан" if acc.get('group_id') else "⚠️ Не привязан"
             
             text += f"• **{name}** - {status}\n"
@@ -781,12 +1421,13 @@ def setup_bot_handlers(bot_client):
                 text += f"  🧵 Thread ID: `{acc['thread_id']}`\n"
             text += "\n"
         
-        await event.respond(text)
+        await respond(event, text)
 
     @bot_client.on(events.NewMessage(pattern='/stats'))
+    @measured('/stats')
     async def stats_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
@@ -797,41 +1438,69 @@ def setup_bot_handlers(bot_client):
                 name = parts[1]
                 
                 if name not in bot_data['accounts']:
-                    await event.respond("❌ Аккаунт не найден.")
+                    await respond(event, "❌ Аккаунт не найден.")
                     return
                 
-                today = datetime.now().strftime('%Y-%m-%d')
-                count = bot_data['daily_stats'].get(name, {}).get(today, 0)
+                today = stats_today()
                 total_dialogs = len(bot_data['accounts'][name].get('dialogs', []))
                 
-                text = f"📊 **Статистика {name}**\n\n"
-                text += f"📅 Сегодня ({today}):\n"
-                text += f"💬 Новых диалогов: {count}\n"
+                text = f"📊 **Статистика {name}**\n"
+                text += f"🕐 День - с {STATS_DAY_START_HOUR:02d}:00 МСК\n\n"
+                if len(parts) >= 3:
+                    try:
+                        first_day, last_day = parse_stats_range(parts[2], today)
+                    except ValueError:
+                        await respond(event, "❌ Период: 7d, 30d, ГГГГ-ММ-ДД или ГГГГ-ММ-ДД..ГГГГ-ММ-ДД")
+                        return
+                    count = stats_store.days_total(name, first_day, last_day)
+                    text += f"📅 {day_label(first_day)} - {day_label(last_day)}:\n"
+                    text += f"💬 Новых диалогов: {count}\n"
+                else:
+                    text += f"📅 Сегодня ({day_label(today)}):\n"
+                    text += f"💬 Новых диалогов: {stats_store.day_total(name, today)}\n"
+                    text += f"   за 7 дней: {stats_store.days_total(name, today - 6, today)}, "
+                    text += f"за 30 дней: {stats_store.days_total(name, today - 29, today)}\n"
                 text += f"📝 Всего диалогов: {total_dialogs}\n"
                 
-                await event.respond(text)
+                cache = bot_data['message_cache'].get(name)
+                if cache is not None:
+                    cache_stats = cache.stats()
+                    text += f"\n🗂 Кэш сообщений: {cache_stats['entries']} "
+                    text += f"({cache_stats['bytes'] / 1024 / 1024:.1f} МБ)\n"
+                    text += f"   Найдено при удалении: {cache_stats['hits']}, "
+                    text += f"не найдено: {cache_stats['misses']}\n"
+                    text += f"   Вытеснено: {cache_stats['evictions']}, "
+                    text += f"истекло: {cache_stats['expirations']}\n"
+                
+                entities = bot_data['entity_cache'].get(name)
+                if entities is not None:
+                    entity_stats = entities.stats()
+                    text += f"\n👥 Кэш чатов: {entity_stats['entries']}, "
+                    text += f"попаданий: {entity_stats['hits']}, промахов: {entity_stats['misses']}\n"
+                
+                await respond(event, text)
             else:
                 # Общая статистика по всем аккаунтам
                 if not bot_data['accounts']:
-                    await event.respond("📊 Нет аккаунтов для статистики.")
+                    await respond(event, "📊 Нет аккаунтов для статистики.")
                     return
                 
-                today = datetime.now().strftime('%Y-%m-%d')
+                today = stats_today()
                 
                 text = f"📊 **Общая статистика по всем аккаунтам**\n"
-                text += f"📅 Дата: {today}\n\n"
+                text += f"📅 Дата: {day_label(today)} (с {STATS_DAY_START_HOUR:02d}:00 МСК)\n\n"
                 
                 total_new_today = 0
                 total_all_dialogs = 0
                 
                 for name, acc in bot_data['accounts'].items():
-                    new_today = bot_data['daily_stats'].get(name, {}).get(today, 0)
+                    new_today = stats_store.day_total(name, today)
                     all_dialogs = len(acc.get('dialogs', []))
                     
                     total_new_today += new_today
                     total_all_dialogs += all_dialogs
                     
-                    status = "🟢" if name in user_clients else "🔴"
+                    status = "🟢" if client_state(name) is not None else "🔴"
                     text += f"{status} **{name}**\n"
                     text += f"   💬 Новых сегодня: {new_today}\n"
                     text += f"   📝 Всего диалогов: {all_dialogs}\n\n"
@@ -842,42 +1511,44 @@ def setup_bot_handlers(bot_client):
                 text += f"📝 Всего диалогов: **{total_all_dialogs}**\n"
                 text += f"👥 Аккаунтов: **{len(bot_data['accounts'])}**\n"
                 
-                await event.respond(text)
+                await respond(event, text)
             
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/add_admin'))
+    @measured('/add_admin')
     async def add_admin_handler(event):
         if event.sender_id != MAIN_ADMIN_ID:
-            await event.respond("❌ Только главный администратор может добавлять других админов.")
+            await respond(event, "❌ Только главный администратор может добавлять других админов.")
             return
         
         try:
             parts = event.text.split()
             if len(parts) < 2:
-                await event.respond("❌ Формат: /add_admin <user_id>")
+                await respond(event, "❌ Формат: /add_admin <user_id>")
                 return
             
             new_admin_id = int(parts[1])
             bot_data['admins'].add(new_admin_id)
             save_data()
             
-            await event.respond(f"✅ Пользователь {new_admin_id} добавлен в администраторы.")
+            await respond(event, f"✅ Пользователь {new_admin_id} добавлен в администраторы.")
             
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/assign_chat'))
+    @measured('/assign_chat')
     async def assign_chat_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         try:
             parts = event.text.split()
             if len(parts) < 3:
-                await event.respond(
+                await respond(event,
                     "❌ **Формат:** `/assign_chat <название> <chat_id> [thread_id]`\n\n"
                     "**Как получить IDs:**\n\n"
                     "**1. Chat ID (ID супергруппы):**\n"
@@ -901,11 +1572,11 @@ def setup_bot_handlers(bot_client):
                 chat_id_int = int(chat_id)
                 thread_id_int = int(thread_id) if thread_id else None
             except:
-                await event.respond("❌ Неверный формат ID. Должны быть числа.")
+                await respond(event, "❌ Неверный формат ID. Должны быть числа.")
                 return
             
             if name not in bot_data['accounts']:
-                await event.respond("❌ Аккаунт не найден.")
+                await respond(event, "❌ Аккаунт не найден.")
                 return
             
             # Проверяем доступ к чату
@@ -919,22 +1590,24 @@ def setup_bot_handlers(bot_client):
                 if thread_id_int:
                     send_kwargs['reply_to'] = thread_id_int
                 
-                await bot.send_message(chat_id_int, **send_kwargs)
+                await outbound.send_message(chat_id_int, priority=PRIORITY_ADMIN, **send_kwargs)
                 
                 # Сохраняем настройки
                 bot_data['accounts'][name]['group_id'] = chat_id_int
                 bot_data['accounts'][name]['thread_id'] = thread_id_int
-                save_data()
+                save_data(name)
+                if shard_supervisor:
+                    shard_supervisor.update_account(name, {'group_id': chat_id_int, 'thread_id': thread_id_int})
                 
                 response = f"✅ Чат `{chat_id}` успешно привязан к аккаунту **{name}**!\n\n"
                 if thread_id_int:
                     response += f"🧵 Топик ID: `{thread_id_int}`\n"
                 response += f"\nТеперь все удалённые сообщения и отчёты будут отправляться туда."
                 
-                await event.respond(response)
+                await respond(event, response)
                 
             except Exception as e:
-                await event.respond(
+                await respond(event,
                     f"❌ Не удалось отправить сообщение в чат `{chat_id}`\n"
                     f"**Ошибка:** `{e}`\n\n"
                     f"**Убедитесь что:**\n"
@@ -945,12 +1618,143 @@ def setup_bot_handlers(bot_client):
                 )
                 
         except Exception as e:
-            await event.respond(f"❌ Ошибка: {e}")
+            await respond(event, f"❌ Ошибка: {e}")
+
+    @bot_client.on(events.NewMessage(pattern='/schedule'))
+    @measured('/schedule')
+    async def schedule_handler(event):
+        if not is_admin(event.sender_id):
+            await respond(event, "❌ Нет доступа.")
+            return
+        
+        try:
+            parts = event.text.split()
+            if len(parts) < 2:
+                text = "⏰ **Расписания отчётов:**\n\n"
+                text += f"По умолчанию: `{REPORT_TIMES}` ({REPORT_TIMEZONE})\n\n"
+                for times, tz in sorted({report_schedule(acc) for acc in bot_data['accounts'].values()}):
+                    names = report_group(times, tz)
+                    if not times:
+                        text += f"🔕 Выключены: {', '.join(names)}\n\n"
+                        continue
+                    job = scheduler.get(report_job_name(times, tz))
+                    text += f"• `{format_times(times)}` {tz}: {', '.join(names)}\n"
+                    if job and job.next_run:
+                        next_run = datetime.fromtimestamp(job.next_run, ZoneInfo(tz))
+                        text += f"  Следующий: {next_run.strftime('%d.%m %H:%M')}\n"
+                    text += "\n"
+                text += "Формат: `/schedule <название> ЧЧ:ММ,ЧЧ:ММ [пояс]`, `default` или `off`"
+                await respond(event, text)
+                return
+            
+            name = parts[1]
+            if name not in bot_data['accounts']:
+                await respond(event, "❌ Аккаунт не найден.")
+                return
+            acc = bot_data['accounts'][name]
+            
+            if len(parts) < 3:
+                times, tz = report_schedule(acc)
+                if times:
+                    await respond(event, f"⏰ Отчёты **{name}**: `{format_times(times)}` ({tz})")
+                else:
+                    await respond(event, f"🔕 Отчёты **{name}** выключены")
+                return
+            
+            if parts[2] == 'default':
+                acc.pop('report_schedule', None)
+            elif parts[2] == 'off':
+                acc['report_schedule'] = {'times': '', 'tz': None}
+            else:
+                try:
+                    times = parse_times(parts[2])
+                    tz = parts[3] if len(parts) > 3 else REPORT_TIMEZONE
+                    ZoneInfo(tz)
+                except Exception as e:
+                    await respond(event, f"❌ Неверное расписание: {e}\nПример: `/schedule {name} 09:00,21:00 Europe/Moscow`")
+                    return
+                if not times:
+                    await respond(event, "❌ Укажите хотя бы одно время. Выключить отчёты: `/schedule <название> off`")
+                    return
+                acc['report_schedule'] = {'times': format_times(times), 'tz': tz}
+            
+            # Новое расписание отсчитывается от текущего момента, без догоняющего отчёта
+            acc['last_report'] = time.time()
+            save_data(name)
+            schedule_reports()
+            
+            times, tz = report_schedule(acc)
+            if times:
+                await respond(event, f"✅ Отчёты **{name}**: `{format_times(times)}` ({tz})")
+            else:
+                await respond(event, f"🔕 Отчёты **{name}** выключены")
+            
+        except Exception as e:
+            await respond(event, f"❌ Ошибка: {e}")
+
+    @bot_client.on(events.NewMessage(pattern='/rules'))
+    @measured('/rules')
+    async def rules_handler(event):
+        if not is_admin(event.sender_id):
+            await respond(event, "❌ Нет доступа.")
+            return
+        
+        try:
+            parts = event.text.split()
+            if len(parts) < 2:
+                await respond(event,
+                    "❌ **Формат:** `/rules <название> [параметр значение]`\n\n"
+                    "`private|groups|channels|outgoing on|off` - типы чатов и свои сообщения\n"
+                    "`allow|deny|muted add|del <chat_id> ...` или `clear` - списки чатов\n"
+                    "`private_only` - только личные чаты\n"
+                    "`reset` - принимать всё (по умолчанию)"
+                )
+                return
+            
+            name = parts[1]
+            if name not in bot_data['accounts']:
+                await respond(event, "❌ Аккаунт не найден.")
+                return
+            acc = bot_data['accounts'][name]
+            
+            if len(parts) > 2:
+                try:
+                    rules = update_rules(acc.get('rules'), parts[2:])
+                except ValueError as e:
+                    await respond(event, f"❌ {e}")
+                    return
+                if rules == ChatRules().to_json():
+                    acc.pop('rules', None)
+                else:
+                    acc['rules'] = rules
+                save_data(name)
+                # Новые фильтры действуют сразу, без перезапуска клиента
+                apply_chat_rules(name)
+                if shard_supervisor:
+                    shard_supervisor.update_account(name, {'rules': acc.get('rules')})
+            
+            rules = ChatRules(acc.get('rules'))
+            def state(flag):
+                return "✅" if flag else "❌"
+            text = f"🧹 **Правила приёма сообщений {name}:**\n\n"
+            text += f"{state(rules.private)} Личные чаты\n"
+            text += f"{state(rules.groups)} Группы и супергруппы\n"
+            text += f"{state(rules.channels)} Каналы\n"
+            text += f"{state(rules.outgoing)} Свои исходящие сообщения\n"
+            for title, chat_ids in (('Всегда принимать', rules.allow), ('Не принимать', rules.deny),
+                                    ('Без кэша (только учёт диалогов)', rules.muted)):
+                if chat_ids:
+                    text += f"\n**{title}:** " + ", ".join(f"`{chat_id}`" for chat_id in sorted(chat_ids))
+            await respond(event, text)
+            
+        except Exception as e:
+            await respond(event, f"❌ Ошибка: {e}")
 
     @bot_client.on(events.NewMessage(pattern='/list_admins'))
+    @measured('/list_admins')
     async def list_admins_handler(event):
         if not is_admin(event.sender_id):
-            await event.respond("❌ Нет доступа.")
+            await respond(event, "❌ Нет доступа.")
             return
         
         text = "👥 **Список администраторов:**\n\n"
@@ -958,40 +1762,358 @@ def setup_bot_handlers(bot_client):
             marker = "⭐" if admin_id == MAIN_ADMIN_ID else "•"
             text += f"{marker} {admin_id}\n"
         
-        await event.respond(text)
+        await respond(event, text)
+
+    @bot_client.on(events.NewMessage(pattern='/queue'))
+    @measured('/queue')
+    async def queue_handler(event):
+        if not is_admin(event.sender_id):
+            await respond(event, "❌ Нет доступа.")
+            return
+        
+        stats = deletion_dispatcher.stats()
+        text = "📨 **Очередь уведомлений об удалениях:**\n\n"
+        for lane, title in (('text', '📝 Текст'), ('media', '🖼 Медиа')):
+            lane_stats = stats[lane]
+            text += f"**{title}**\n"
+            text += f"   В очереди: {lane_stats['pending']}\n"
+            text += f"   Отправлено: {lane_stats['completed']}, ошибок: {lane_stats['failed']}\n"
+            text += f"   Задержка p50/p99/max: {lane_stats['p50']:.1f} / "
+            text += f"{lane_stats['p99']:.1f} / {lane_stats['max']:.1f} с\n\n"
+        text += f"🎯 Активных получателей: {stats['destinations']}\n"
+        
+        coalescer_stats = deletion_coalescer.stats()
+        text += f"📦 Сводок: {coalescer_stats['batches']} "
+        text += f"(удалений в них: {coalescer_stats['coalesced']}), "
+        text += f"одиночных: {coalescer_stats['immediate']}\n\n"
+
+        outbound_stats = outbound.stats()
+        pending = outbound_stats['pending']
+        text += "📤 **Исходящие сообщения бота:**\n"
+        text += f"   В очереди: {outbound_stats['queue']} "
+        text += f"(админ: {pending['admin']}, удаления: {pending['alert']}, отчёты: {pending['report']})\n"
+        text += f"   Отложено до лимита чата: {outbound_stats['parked']} (чатов: {outbound_stats['parked_chats']})\n"
+        text += f"   Отправлено: {outbound_stats['sent']}, ошибок: {outbound_stats['failed']}, "
+        text += f"потеряно: {outbound_stats['dropped']}\n"
+        text += f"   Ожидание avg/max: {outbound_stats['wait_avg']:.1f} / {outbound_stats['wait_max']:.1f} с\n"
+        text += f"   FloodWait: {outbound_stats['flood_waits']} ({outbound_stats['flood_wait_seconds']} с)"
+        
+        if shard_supervisor:
+            text += "\n\n🧩 **Воркеры:**\n"
+            for shard, shard_stats in shard_supervisor.stats().items():
+                state = "✅" if shard_stats['alive'] else "❌"
+                text += f"{state} #{shard} (pid {shard_stats['pid']}): аккаунтов {shard_stats['accounts']}, "
+                text += f"перезапусков {shard_stats['restarts']}\n"
+        
+        if trace_recorder and not shard_supervisor:
+            trace_stats = trace_recorder.stats()
+            state = "идёт" if trace_stats['enabled'] else "остановлена по лимиту"
+            text += f"\n\n🎞️ Запись трассы ({state}): событий {trace_stats['records']}, "
+            text += f"{trace_stats['bytes'] / 1024 / 1024:.1f} МБ"
+
+        await respond(event, text)
+
+    @bot_client.on(events.NewMessage(pattern='/profile'))
+    @measured('/profile')
+    async def profile_handler(event):
+        if not is_admin(event.sender_id):
+            await respond(event, "❌ Нет доступа.")
+            return
+
+        try:
+            parts = event.text.split()
+            action = parts[1] if len(parts) >= 2 else ''
+
+            if action == 'start':
+                seconds = float(parts[2]) if len(parts) >= 3 else None
+                if not profiler.start(seconds):
+                    await respond(event, "⚠️ Профилирование уже идёт. /profile stop - остановить.")
+                    return
+                window = min(seconds or profiler.default_seconds, profiler.max_seconds)
+                await respond(event, f"⏱ Профилирование запущено на {window:.0f} с.\n/profile dump - получить отчёт")
+            elif action in ('stop', 'dump'):
+                top = int(parts[2]) if action == 'dump' and len(parts) >= 3 else 40
+                report = profiler.dump(top)
+                if report is None:
+                    await respond(event, "❌ Нет данных. Сначала /profile start")
+                    return
+                buf = io.BytesIO(report.encode('utf-8'))
+                buf.name = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+                await outbound.send_file(
+                    event.chat_id, buf,
+                    caption=f"📄 Профиль за {profiler.duration:.1f} с (топ {top})",
+                    force_document=True, priority=PRIORITY_ADMIN
+                )
+            elif action == 'slow':
+                if not slow_calls.calls:
+                    await respond(event, f"✅ Медленных обработчиков (дольше {slow_calls.threshold:.1f} с) не было.")
+                    return
+                text = f"🐢 **Медленные обработчики** (всего {slow_calls.total}, порог {slow_calls.threshold:.1f} с):\n\n"
+                for ts, handler_name, session_name, elapsed in list(slow_calls.calls)[-20:]:
+                    where = f" ({session_name})" if session_name else ""
+                    text += f"{datetime.fromtimestamp(ts).strftime('%d.%m %H:%M:%S')} "
+                    text += f"`{handler_name}`{where}: {elapsed:.2f} с\n"
+                await respond(event, text)
+            else:
+                state = "идёт" if profiler.running else "выключено"
+                await respond(event,
+                    f"⏱ Профилирование: {state}\n\n"
+                    f"/profile start [секунды] - включить на время\n"
+                    f"/profile stop - остановить и получить отчёт\n"
+                    f"/profile dump [N] - отчёт (топ N функций)\n"
+                    f"/profile slow - последние медленные обработчики"
+                )
+        except Exception as e:
+            await respond(event, f"❌ Ошибка: {e}")
+
+def format_timeline(timeline):
+    return ", ".join(f"{phase} {seconds:.1f} с" for phase, seconds in timeline.items())
+
+async def launch_account(name, acc):
+    # Запуск нового или только что авторизованного аккаунта из команд бота.
+    # С воркерами клиент работает в процессе своего шарда, а не в супервизоре
+    if shard_supervisor:
+        shard_supervisor.add_account(name)
+        return None, "OK"
+    client, status = await start_user_client(name, acc['api_id'], acc['api_hash'], acc['phone'])
+    if status == "OK":
+        start_entity_prefill(name)
+    return client, status
+
+async def start_all_clients():
+    # Параллельный запуск аккаунтов: не больше STARTUP_CONCURRENCY одновременно,
+    # каждый готов к работе сразу, не дожидаясь остальных
+    semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+    started_at = time.monotonic()
+    
+    async def start_one(name, acc):
+        async with semaphore:
+            await asyncio.sleep(random.uniform(0, STARTUP_JITTER))
+            timeline = {}
+            client_started = time.monotonic()
+            try:
+                client, status = await start_user_client(
+                    name, acc['api_id'], acc['api_hash'], acc['phone'], timeline
+                )
+            except Exception as e:
+                print(f"❌ Ошибка запуска клиента {name}: {e}")
+                return False
+            elapsed = time.monotonic() - client_started
+            if status == "OK":
+                print(f"✅ Клиент {name} запущен за {elapsed:.1f} с ({format_timeline(timeline)})")
+                start_entity_prefill(name, semaphore)
+                return True
+            print(f"⚠️ Клиент {name}: {status} ({format_timeline(timeline)})")
+            return False
+    
+    accounts = list(bot_data['accounts'].items())
+    results = await asyncio.gather(*(start_one(name, acc) for name, acc in accounts))
+    print(f"🚀 Запущено клиентов: {sum(results)}/{len(accounts)} за {time.monotonic() - started_at:.1f} с")
+
+# Режим супервизора (SHARD_WORKERS > 0): аккаунты работают в процессах-воркерах
+def shard_accounts(names):
+    # Копии аккаунтов для воркера: SQLite-прокси диалогов в другой процесс не передать
+    accounts = {}
+    for name in names:
+        acc = bot_data['accounts'].get(name)
+        if acc is None:
+            continue
+        acc_copy = acc.copy()
+        if 'dialogs' in acc_copy:
+            acc_copy['dialogs'] = CompactIdSet(acc_copy['dialogs'])
+        accounts[name] = acc_copy
+    return accounts
+
+def client_states():
+    # Запущенные клиенты процесса: {имя: подключён}
+    return {name: client.is_connected() for name, client in user_clients.items()}
+
+def client_state(name):
+    # None - клиент не запущен, иначе подключён ли он. В режиме супервизора
+    # клиенты живут в воркерах - состояние берём из их сообщений
+    if shard_supervisor:
+        return shard_supervisor.client_state(name)
+    client = user_clients.get(name)
+    return None if client is None else client.is_connected()
+
+def handle_shard_message(message):
+    kind, shard = message[0], message[1]
+    if kind == 'call':
+        asyncio.create_task(forward_shard_call(shard, *message[2:]))
+    elif kind == 'account':
+        _, _, name, fields, new_ids, replace = message
+        acc = bot_data['accounts'].get(name)
+        if acc is None:
+            return
+        if replace or 'dialogs' not in acc:
+            acc['dialogs'] = CompactIdSet(new_ids)
+        else:
+            acc['dialogs'].update(new_ids)
+        for key in ('initialized', 'ingest_checkpoint'):
+            if key in fields:
+                acc[key] = fields[key]
+            else:
+                acc.pop(key, None)
+        save_data(name)
+    elif kind == 'clients':
+        shard_supervisor.clients[shard] = message[2]
+    elif kind == 'metrics':
+        metrics.merge(shard, message[2])
+    elif kind == 'new_dialogs':
+        for (session_name, hour), count in message[2].items():
+            if session_name not in bot_data['accounts']:
+                continue
+            stats_store.add(session_name, hour, count)
+            save_data(session_name)
+
+async def forward_shard_call(shard, request_id, method, entity, args, kwargs, priority):
+    # Вызов бота из воркера: отправляем через общую очередь исходящих
+    error = None
+    try:
+        if method == 'send_file':
+            args = (decode_file(args[0]),) + tuple(args[1:])
+        await getattr(outbound, method)(entity, *args, priority=priority, **kwargs)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    shard_supervisor.send(shard, ('reply', request_id, error))
+
+def shard_path(path, shard):
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{shard}{ext}"
+
+def shard_worker_main(shard, accounts, commands, events):
+    # Точка входа процесса-воркера; Ctrl+C обрабатывает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_shard_worker(shard, accounts, commands, events))
+
+async def run_shard_worker(shard, accounts, commands, events):
+    global bot, outbound, shard_link, disk_cache, media_store, trace_recorder
+    
+    bot_data['accounts'] = accounts
+    
+    async def start_shard_account(name):
+        # Аккаунт добавлен или авторизован через бота супервизора
+        if name in user_clients:
+            return
+        pending = bot_data['pending_verifications'].pop(name, None)
+        if pending:
+            await pending['client'].disconnect()
+        acc = bot_data['accounts'][name]
+        client, status = await start_user_client(name, acc['api_id'], acc['api_hash'], acc['phone'])
+        if status == "OK":
+            print(f"✅ Клиент {name} запущен в воркере {shard}")
+            start_entity_prefill(name)
+        else:
+            print(f"⚠️ Клиент {name}: {status}")
+    
+    async def stop_shard_account(name):
+        await stop_account(name)
+        bot_data['accounts'].pop(name, None)
+    
+    # bot и outbound в воркере - прокси: отправка идёт через процесс супервизора
+    def update_shard_account(name, fields):
+        if 'rules' in fields:
+            apply_chat_rules(name)
+    
+    shard_link = WorkerLink(
+        shard, commands, events, bot_data, SAVE_INTERVAL,
+        on_stop=stop_shard_account, on_update=update_shard_account, client_states=client_states,
+        on_start=start_shard_account,
+        export_metrics=functools.partial(metrics.export, SHARD_METRICS) if METRICS_PORT else None
+    )
+    bot = outbound = shard_link
+    # У каждого воркера свой дисковый кэш и каталог медиа
+    disk_cache = create_disk_cache(shard_path(MESSAGE_DISK_CACHE_FILE, shard))
+    media_store = create_media_store(os.path.join(MEDIA_DIR, f'shard{shard}'))
+    # и своя трасса (со своей солью, если TRACE_SALT не задана)
+    trace_recorder = create_trace_recorder(shard_path(TRACE_FILE, shard) if TRACE_FILE else '')
+    
+    shard_link.start()
+    if disk_cache:
+        disk_cache.start()
+    if media_store:
+        media_store.start()
+    if trace_recorder:
+        trace_recorder.start()
+    deletion_dispatcher.start()
+    try:
+        await start_all_clients()
+        await shard_link.wait_closed()
+    finally:
+        deletion_coalescer.flush_all()
+        await deletion_dispatcher.close()
+        await shard_link.close()
+        for client in list(user_clients.values()):
+            await client.disconnect()
+        if trace_recorder:
+            await trace_recorder.close()
+        if disk_cache:
+            await disk_cache.close()
+        if media_store:
+            await media_store.close()
 
 async def main():
-    global bot
+    global bot, shard_supervisor
     
     os.makedirs('sessions', exist_ok=True)
     load_data()
+    persistence.start()
+    if disk_cache:
+        disk_cache.start()
+    if media_store:
+        media_store.start()
+    deletion_dispatcher.start()
+    if trace_recorder and SHARD_WORKERS == 0:
+        # С воркерами трассы пишут они сами
+        trace_recorder.start()
+    if METRICS_PORT:
+        await metrics.start(METRICS_HOST, METRICS_PORT)
     
-    # Инициализация бота управления
-    bot = TelegramClient('sessions/manager_bot', API_ID, API_HASH)
-    await bot.start(bot_token=BOT_TOKEN)
+    try:
+        # Инициализация бота управления
+        bot = TelegramClient('sessions/manager_bot', API_ID, API_HASH)
+        await bot.start(bot_token=BOT_TOKEN)
     
-    # Регистрация обработчиков
-    setup_bot_handlers(bot)
+        # Регистрация обработчиков
+        setup_bot_handlers(bot)
+        outbound.start(bot)
     
-    print("🤖 Бот управления запущен...")
+        print("🤖 Бот управления запущен...")
     
-    # Запуск существующих клиентов
-    for name, acc in list(bot_data['accounts'].items()):
-        try:
-            client, status = await start_user_client(name, acc['api_id'], acc['api_hash'], acc['phone'])
-            if status == "OK":
-                print(f"✅ Клиент {name} запущен")
-            else:
-                print(f"⚠️ Клиент {name}: {status}")
-        except Exception as e:
-            print(f"❌ Ошибка запуска клиента {name}: {e}")
+        # Запуск существующих клиентов
+        if SHARD_WORKERS > 0:
+            shard_supervisor = ShardSupervisor(
+                SHARD_WORKERS, shard_worker_main, shard_accounts, handle_shard_message,
+                on_exit=metrics.drop
+            )
+            shard_supervisor.start(list(bot_data['accounts']))
+        else:
+            await start_all_clients()
     
-    # Запуск планировщика отчётов
-    asyncio.create_task(report_scheduler())
+        # Запуск планировщика отчётов и обслуживания
+        start_scheduler()
     
-    # Основной цикл
-    print("✅ Система запущена. Ожидание команд...")
-    await bot.run_until_disconnected()
+        # Основной цикл
+        print("✅ Система запущена. Ожидание команд...")
+        await bot.run_until_disconnected()
+    finally:
+        await scheduler.close()
+        # Досылаем накопленные сводки и поставленные в очередь уведомления
+        deletion_coalescer.flush_all()
+        await deletion_dispatcher.close()
+        if shard_supervisor:
+            await shard_supervisor.close()
+        await outbound.close()
+        # Принудительно сбрасываем накопленные изменения на диск
+        await persistence.close()
+        if disk_cache:
+            await disk_cache.close()
+        if media_store:
+            await media_store.close()
+        if trace_recorder:
+            await trace_recorder.close()
+        await metrics.close()
+        print("💾 Данные сохранены")
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,107 @@
+# Пересылка медиа удалённых сообщений без лишних проходов по диску.
+#
+# Небольшие файлы (до MEDIA_INLINE_MAX_MB) скачиваются в BytesIO из пула и
+# отправляются прямо из памяти. У буфера выставлен name с правильным
+# расширением, чтобы Telethon определил тип файла так же, как для файла на диске.
+# Число буферов в работе ограничено размером пула: если все заняты, файл идёт
+# через диск, так что пиковая память не превышает pool_size * inline_limit.
+# Большие файлы проходят через временный файл, который удаляется всегда,
+# в том числе если отправка упала с ошибкой. Файл, уже скачанный MediaStore,
+# на время отправки закреплён в нём, чтобы квота не удалила его посреди загрузки.
+
+import io
+import os
+import tempfile
+import contextlib
+
+
+class MediaRelay:
+    def __init__(self, inline_limit=20 * 1024 * 1024, pool_size=4, temp_dir=None):
+        self.inline_limit = inline_limit
+        self.pool_size = pool_size
+        self.temp_dir = temp_dir
+        self._free = []
+        self._in_use = 0
+        self.inline_count = 0
+        self.inline_bytes = 0
+        self.disk_count = 0
+        self.disk_bytes = 0
+        self.sent_bytes = 0  # успешно отправленные ботом
+
+    def _acquire(self):
+        if self._in_use >= self.pool_size:
+            return None
+        self._in_use += 1
+        return self._free.pop() if self._free else io.BytesIO()
+
+    def _release(self, buf):
+        self._in_use -= 1
+        buf.seek(0)
+        buf.truncate()
+        self._free.append(buf)
+
+    @contextlib.asynccontextmanager
+    async def open(self, client, media, store=None):
+        # Отдаёт объект для bot.send_file: путь к файлу или буфер в памяти
+        local_path = store.pin(media) if store is not None else None
+        if local_path:
+            try:
+                size = os.path.getsize(local_path)
+                yield local_path
+                self.sent_bytes += size
+            finally:
+                store.unpin(media)
+            return
+
+        buf = None
+        if media.size is not None and media.size <= self.inline_limit:
+            buf = self._acquire()
+
+        if buf is not None:
+            try:
+                buf.name = f"media{media.file_ext}"
+                await client.download_file(
+                    media.input_location(),
+                    file=buf,
+                    file_size=media.size,
+                    dc_id=media.dc_id
+                )
+                size = buf.tell()
+                self.inline_count += 1
+                self.inline_bytes += size
+                buf.seek(0)
+                yield buf
+                self.sent_bytes += size
+            finally:
+                self._release(buf)
+            return
+
+        fd, temp_path = tempfile.mkstemp(suffix=media.file_ext, dir=self.temp_dir)
+        os.close(fd)
+        try:
+            await client.download_file(
+                media.input_location(),
+                file=temp_path,
+                file_size=media.size,
+                dc_id=media.dc_id
+            )
+            size = os.path.getsize(temp_path)
+            self.disk_count += 1
+            self.disk_bytes += size
+            yield temp_path
+            self.sent_bytes += size
+        finally:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            'inline': self.inline_count,
+            'inline_bytes': self.inline_bytes,
+            'disk': self.disk_count,
+            'disk_bytes': self.disk_bytes,
+            'sent_bytes': self.sent_bytes,
+            'buffers_in_use': self._in_use,
+        }
@@ -0,0 +1,277 @@
+# Предзагрузка медиа из входящих сообщений (MEDIA_PREFETCH=1).
+#
+# После удаления сообщения file_reference может уже не работать, а полная
+# загрузка задерживает уведомление. Поэтому медиа скачивается сразу при
+# получении: очередь ограничена, качает фиксированный пул воркеров.
+# Файлы лежат в одном каталоге и адресуются по содержимому: имя файла -
+# тип и id фото/документа, так что одно и то же медиа хранится один раз.
+# При превышении квот (на аккаунт и общей) удаляются самые старые файлы.
+# Файл, который сейчас пересылается (pin/unpin), квоты не удаляют: он
+# удаляется после отправки, если за это время его вытеснили.
+
+import os
+import asyncio
+from collections import OrderedDict, defaultdict
+
+MEDIA_CLASSES = ('photo', 'video', 'voice', 'round', 'audio', 'sticker', 'document')
+
+
+def media_class(media):
+    # Тип медиа для правил предзагрузки
+    if media.kind == 'photo':
+        return 'photo'
+    if media.is_voice:
+        return 'voice'
+    if media.is_video_note:
+        return 'round'
+    mime = media.mime_type or ''
+    if mime in ('image/webp', 'application/x-tgsticker', 'video/webm'):
+        return 'sticker'
+    if mime.startswith('video/'):
+        return 'video'
+    if mime.startswith('audio/'):
+        return 'audio'
+    return 'document'
+
+
+def media_file_name(media):
+    return f"{media.kind}_{media.id}{media.file_ext}"
+
+
+class MediaStore:
+    def __init__(self, root, classes=('photo', 'video', 'voice', 'round'),
+                 max_file_size=20 * 1024 * 1024, quota=2 * 1024 ** 3,
+                 account_quota=512 * 1024 ** 2, workers=3, queue_size=1000):
+        self.root = root
+        self.classes = frozenset(classes)
+        self.max_file_size = max_file_size
+        self.quota = quota
+        self.account_quota = account_quota
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue = None
+        self._tasks = []
+        # name -> [size, owners]; порядок - время появления файла
+        self._files = OrderedDict()
+        self._by_session = defaultdict(OrderedDict)  # session -> name -> None
+        self._usage = defaultdict(int)
+        self._inflight = {}  # name -> set(owners) для файлов в очереди/загрузке
+        self._pinned = {}  # name -> сколько отправок используют файл
+        self._doomed = set()  # вытеснены во время отправки - удалить после неё
+        self.total_bytes = 0
+        self.downloaded = 0
+        self.downloaded_bytes = 0
+        self.skipped = 0
+        self.deduplicated = 0  # уже скачано или качается для другого аккаунта
+        self.dropped = 0
+        self.failed = 0
+        self.evicted = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def _scan(self):
+        # Файлы с прошлого запуска: владельцы неизвестны, учитываются только в общей квоте
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.name.endswith('.part'):
+                os.unlink(entry.path)
+        for _, name, size in sorted(entries):
+            self._files[name] = [size, set()]
+            self.total_bytes += size
+        self._enforce_global_quota()
+
+    def wants(self, media):
+        if not media.downloadable or media_class(media) not in self.classes:
+            return False
+        return media.size is None or media.size <= self.max_file_size
+
+    def enqueue(self, session_name, client, media):
+        # Вызывается из обработчика сообщений: без ожидания и сетевых запросов
+        if not self.wants(media):
+            self.skipped += 1
+            return
+        name = media_file_name(media)
+        if name in self._files:
+            self.deduplicated += 1
+            self._add_owner(name, session_name)
+            return
+        if name in self._inflight:
+            self.deduplicated += 1
+            self._inflight[name].add(session_name)
+            return
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((name, client, media))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        self._inflight[name] = {session_name}
+
+    def local_path(self, media):
+        if media is None or not media.downloadable:
+            return None
+        name = media_file_name(media)
+        if name not in self._files:
+            return None
+        return os.path.join(self.root, name)
+
+    def pin(self, media):
+        # Путь к скачанному файлу, который не удалится до unpin; None - файла нет
+        path = self.local_path(media)
+        if path is not None:
+            name = media_file_name(media)
+            self._pinned[name] = self._pinned.get(name, 0) + 1
+        return path
+
+    def unpin(self, media):
+        name = media_file_name(media)
+        count = self._pinned.get(name, 0) - 1
+        if count > 0:
+            self._pinned[name] = count
+            return
+        self._pinned.pop(name, None)
+        if name in self._doomed:
+            self._doomed.discard(name)
+            entry = self._files.get(name)
+            if entry is not None and not entry[1]:
+                self._delete(name)
+        self._enforce_global_quota()
+
+    async def _worker(self):
+        while True:
+            name, client, media = await self._queue.get()
+            try:
+                await self._download(name, client, media)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Ошибка предзагрузки медиа {name}: {e}")
+            finally:
+                self._inflight.pop(name, None)
+                self._queue.task_done()
+
+    async def _download(self, name, client, media):
+        path = os.path.join(self.root, name)
+        part_path = path + '.part'
+        for attempt in range(2):
+            try:
+                await client.download_file(
+                    media.input_location(),
+                    file=part_path,
+                    file_size=media.size,
+                    dc_id=media.dc_id
+                )
+                break
+            except Exception as e:
+                if os.path.exists(part_path):
+                    os.unlink(part_path)
+                # FloodWait: ждём и пробуем ещё раз
+                if type(e).__name__ == 'FloodWaitError' and attempt == 0:
+                    await asyncio.sleep(e.seconds)
+                    continue
+                raise
+        os.replace(part_path, path)
+
+        size = os.path.getsize(path)
+        self.downloaded += 1
+        self.downloaded_bytes += size
+        self._files[name] = [size, set()]
+        self.total_bytes += size
+        for session_name in self._inflight.get(name, ()):
+            self._add_owner(name, session_name)
+        self._enforce_global_quota()
+
+    def _add_owner(self, name, session_name):
+        entry = self._files[name]
+        if session_name in entry[1]:
+            return
+        entry[1].add(session_name)
+        self._by_session[session_name][name] = None
+        self._usage[session_name] += entry[0]
+        self._enforce_account_quota(session_name)
+
+    def _release(self, name, session_name):
+        entry = self._files.get(name)
+        if entry is None:
+            return
+        entry[1].discard(session_name)
+        self._by_session[session_name].pop(name, None)
+        self._usage[session_name] -= entry[0]
+        if not entry[1]:
+            self._delete(name)
+
+    def _delete(self, name):
+        if name in self._pinned:
+            self._doomed.add(name)
+            return
+        size, owners = self._files.pop(name)
+        for session_name in owners:
+            self._by_session[session_name].pop(name, None)
+            self._usage[session_name] -= size
+        self.total_bytes -= size
+        self.evicted += 1
+        try:
+            os.unlink(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
+
+    def _enforce_account_quota(self, session_name):
+        files = self._by_session[session_name]
+        while self._usage[session_name] > self.account_quota and files:
+            oldest = next(iter(files))
+            self._release(oldest, session_name)
+
+    def _enforce_global_quota(self):
+        # Самые старые файлы - в голове OrderedDict. Закреплённый файл (идёт
+        # отправка) переносится в конец как только что использованный
+        files = self._files
+        skips = len(self._pinned)
+        while self.total_bytes > self.quota and files:
+            name = next(iter(files))
+            if name in self._pinned:
+                if not skips:
+                    break
+                skips -= 1
+                files.move_to_end(name)
+                continue
+            self._delete(name)
+
+    def drop_session(self, session_name):
+        for name in list(self._by_session.get(session_name, ())):
+            self._release(name, session_name)
+        self._by_session.pop(session_name, None)
+        self._usage.pop(session_name, None)
+
+    def stats(self):
+        return {
+            'files': len(self._files),
+            'bytes': self.total_bytes,
+            'queue': self._queue.qsize() if self._queue is not None else 0,
+            'downloaded': self.downloaded,
+            'downloaded_bytes': self.downloaded_bytes,
+            'skipped': self.skipped,
+            'deduplicated': self.deduplicated,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'evicted': self.evicted,
+        }
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
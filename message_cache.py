@@ -0,0 +1,264 @@
+# Ограниченный кэш сообщений одной сессии (для отслеживания удалений).
+#
+# Записи (CachedMessage) лежат в OrderedDict в порядке вставки, то есть по времени получения.
+# Вытеснение идёт с головы при каждой вставке: сначала просроченные по TTL,
+# затем самые старые, пока не уложимся в лимиты по количеству и объёму.
+# Каждая операция - амортизированно O(1), полного обхода кэша нет.
+# Читаются записи только при удалении сообщения (и сразу удаляются),
+# поэтому порядок вставки совпадает с порядком LRU.
+# Ключи строит cache_key(): msg_id или (channel_id, msg_id).
+# С общим хранилищем (content_store.py) записи и медиа могут быть общими
+# с другими сессиями: кэш сообщает хранилищу о каждой добавленной и убранной
+# записи, а названия чатов интернируются в его общей таблице.
+
+import sys
+import time
+from collections import OrderedDict
+
+# Узел OrderedDict, слот хеш-таблицы и ключ на одну запись, байт
+ENTRY_OVERHEAD = 200
+
+
+class MediaRef:
+    # Минимальное описание медиа, достаточное для скачивания без объекта Message
+    __slots__ = (
+        'kind', 'id', 'access_hash', 'file_reference', 'dc_id', 'thumb_size',
+        'mime_type', 'size', 'file_ext', 'is_voice', 'is_video_note'
+    )
+
+    def __init__(self, kind, id=None, access_hash=None, file_reference=b'', dc_id=None,
+                 thumb_size='', mime_type=None, size=None, file_ext='', is_voice=False,
+                 is_video_note=False):
+        self.kind = kind  # 'photo', 'document' или имя типа неподдерживаемого медиа
+        self.id = id
+        self.access_hash = access_hash
+        self.file_reference = file_reference
+        self.dc_id = dc_id
+        self.thumb_size = thumb_size
+        self.mime_type = mime_type
+        self.size = size
+        self.file_ext = file_ext
+        self.is_voice = is_voice
+        self.is_video_note = is_video_note
+
+    @property
+    def downloadable(self):
+        return self.kind in ('photo', 'document') and self.id is not None
+
+    def input_location(self):
+        from telethon.tl.types import InputPhotoFileLocation, InputDocumentFileLocation
+        if self.kind == 'photo':
+            return InputPhotoFileLocation(
+                id=self.id, access_hash=self.access_hash,
+                file_reference=self.file_reference, thumb_size=self.thumb_size
+            )
+        return InputDocumentFileLocation(
+            id=self.id, access_hash=self.access_hash,
+            file_reference=self.file_reference, thumb_size=''
+        )
+
+    def nbytes(self):
+        # mime_type и file_ext интернированы и общие для всех записей
+        return (sys.getsizeof(self) + sys.getsizeof(self.file_reference)
+                + sys.getsizeof(self.id) + sys.getsizeof(self.access_hash)
+                + sys.getsizeof(self.size))
+
+
+class CachedMessage:
+    # Компактная запись кэша: только то, что нужно deleted_handler
+    __slots__ = ('text', 'chat_id', 'chat_name_idx', 'date', 'media', 'size')
+
+    def __init__(self, text, chat_id, chat_name_idx, date, media=None):
+        self.text = text
+        self.chat_id = chat_id
+        self.chat_name_idx = chat_name_idx
+        self.date = date  # unix time, int
+        self.media = media
+        self.size = (ENTRY_OVERHEAD + sys.getsizeof(self) + sys.getsizeof(text)
+                     + sys.getsizeof(date) + (media.nbytes() if media is not None else 0))
+
+
+def _largest_photo_size(sizes):
+    # Аналог выбора самого большого размера при download_media
+    best_type, best_area, best_bytes = '', -1, None
+    for size in sizes or ():
+        type_name = type(size).__name__
+        if type_name in ('PhotoStrippedSize', 'PhotoPathSize', 'PhotoSizeEmpty'):
+            continue
+        area = getattr(size, 'w', 0) * getattr(size, 'h', 0)
+        if area > best_area:
+            best_type, best_area = size.type, area
+            if type_name == 'PhotoSizeProgressive':
+                best_bytes = max(size.sizes) if size.sizes else None
+            elif type_name == 'PhotoCachedSize':
+                best_bytes = len(size.bytes)
+            else:
+                best_bytes = getattr(size, 'size', None)
+    return best_type, best_bytes
+
+
+def media_ref_from_media(media):
+    type_name = type(media).__name__
+    photo = getattr(media, 'photo', None) if type_name == 'MessageMediaPhoto' else None
+    if photo is not None and type(photo).__name__ == 'Photo':
+        thumb_size, size = _largest_photo_size(photo.sizes)
+        return MediaRef(
+            'photo', photo.id, photo.access_hash, photo.file_reference, photo.dc_id,
+            thumb_size=sys.intern(thumb_size), mime_type='image/jpeg', size=size,
+            file_ext='.jpg'
+        )
+
+    doc = getattr(media, 'document', None) if type_name == 'MessageMediaDocument' else None
+    if doc is not None and type(doc).__name__ == 'Document':
+        mime = doc.mime_type or ''
+        file_ext = '.jpg'
+        is_voice = False
+        is_video_note = False
+
+        # Получаем расширение из mime_type
+        if '/' in mime:
+            file_ext = '.' + mime.split('/')[-1]
+            if file_ext == '.jpeg':
+                file_ext = '.jpg'
+
+        # Проверяем атрибуты
+        for attr in doc.attributes:
+            attr_type = type(attr).__name__
+            if attr_type == 'DocumentAttributeFilename':
+                # Используем оригинальное расширение файла
+                original_name = attr.file_name
+                if '.' in original_name:
+                    file_ext = '.' + original_name.split('.')[-1]
+            elif attr_type == 'DocumentAttributeAudio' and getattr(attr, 'voice', False):
+                is_voice = True
+                file_ext = '.ogg'
+            elif attr_type == 'DocumentAttributeVideo' and getattr(attr, 'round_message', False):
+                is_video_note = True
+                file_ext = '.mp4'
+
+        return MediaRef(
+            'document', doc.id, doc.access_hash, doc.file_reference, doc.dc_id,
+            mime_type=sys.intern(mime), size=doc.size, file_ext=sys.intern(file_ext),
+            is_voice=is_voice, is_video_note=is_video_note
+        )
+
+    # Гео, контакты, опросы, веб-страницы и т.п. - скачивать нечего
+    return MediaRef(sys.intern(type_name))
+
+
+def cache_key(channel_id, msg_id):
+    # ID сообщений в каналах и супергруппах уникальны только внутри канала,
+    # в личных чатах и обычных группах - в пределах аккаунта.
+    # Поэтому у каждого канала своё пространство ключей (channel_id, msg_id),
+    # а личные чаты и группы делят общее пространство по msg_id.
+    return msg_id if channel_id is None else (channel_id, msg_id)
+
+
+class MessageCache:
+    def __init__(self, max_entries=50000, max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store  # ContentStore или None
+        self._entries = OrderedDict()  # key -> CachedMessage
+        # Интернированные названия чатов: записи хранят только индекс
+        self._chat_names = []
+        self._chat_name_index = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def chat_name_idx(self, name):
+        if self.store is not None:
+            return self.store.chat_name_idx(name)
+        idx = self._chat_name_index.get(name)
+        if idx is None:
+            idx = len(self._chat_names)
+            self._chat_names.append(name)
+            self._chat_name_index[name] = idx
+        return idx
+
+    def chat_name(self, record):
+        if self.store is not None:
+            return self.store.chat_name(record)
+        return self._chat_names[record.chat_name_idx]
+
+    def put(self, key, record):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old.size
+        self._entries[key] = record
+        self.bytes += record.size
+        if self.store is not None:
+            # Сначала новая запись: старая может держать последнюю ссылку на то же название
+            self.store.retain(key, record)
+            if old is not None:
+                self.store.release(key, old)
+        self._evict(int(time.time()))
+
+    def _evict(self, now):
+        entries = self._entries
+        deadline = now - self.ttl
+        while entries:
+            record = next(iter(entries.values()))
+            if record.date < deadline:
+                self.expirations += 1
+            elif len(entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.evictions += 1
+            else:
+                break
+            key, _ = entries.popitem(last=False)
+            self.bytes -= record.size
+            if self.store is not None:
+                self.store.release(key, record)
+
+    def get(self, key):
+        record = self._entries.get(key)
+        if record is None:
+            self.misses += 1
+            return None
+        if record.date < time.time() - self.ttl:
+            self.pop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record
+
+    def pop(self, key):
+        record = self._entries.pop(key, None)
+        if record is not None:
+            self.bytes -= record.size
+            if self.store is not None:
+                self.store.release(key, record)
+        return record
+
+    def clear(self):
+        # Сессия остановлена: отпускаем общие записи
+        if self.store is not None:
+            for key, record in self._entries.items():
+                self.store.release(key, record)
+        self._entries.clear()
+        self.bytes = 0
+
+    def expire(self):
+        # Для периодической очистки неактивных сессий
+        self._evict(int(time.time()))
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,298 @@
+# Метрики в формате Prometheus на локальном HTTP-порту (METRICS_PORT).
+#
+# Счётчики на горячем пути - это одно сложение в словаре по кортежу меток,
+# остальное (размеры кэшей, очереди, состояние клиентов) собирается из
+# stats() компонентов только в момент запроса /metrics.
+# Метки - только имя сессии и небольшие фиксированные наборы значений,
+# чтобы число рядов не росло с числом чатов.
+#
+# Процессы-воркеры отдают свои метрики через export(): приращения счётчиков
+# и гистограмм с прошлого вызова и текущие значения датчиков. Супервизор
+# добавляет их к своим через merge(), так что /metrics главного процесса
+# показывает сумму по всем процессам; перезапуск воркера не сбрасывает счётчики.
+
+import time
+import asyncio
+import contextlib
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._exported = {}  # значения на момент прошлого export()
+        self._forwarded = {}  # значения из других процессов
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        self._values.clear()
+
+    def export(self):
+        # Приращения с прошлого вызова; значение меньше прошлого - сброс
+        delta = {}
+        for key, value in self._values.items():
+            change = value - self._exported.get(key, 0)
+            if change < 0:
+                change = value
+            if change:
+                delta[key] = change
+        self._exported = dict(self._values)
+        return delta
+
+    def merge(self, source, values):
+        for key, value in values.items():
+            self._forwarded[key] = self._forwarded.get(key, 0) + value
+
+    def drop(self, source):
+        pass
+
+    def _merged(self):
+        if not self._forwarded:
+            return self._values
+        values = dict(self._values)
+        for key, value in self._forwarded.items():
+            values[key] = values.get(key, 0) + value
+        return values
+
+    def samples(self):
+        for key, value in self._merged().items():
+            yield self.name, _format_labels(self.labels, key), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def export(self):
+        return dict(self._values)
+
+    def merge(self, source, values):
+        # Последние значения каждого процесса заменяют предыдущие
+        self._forwarded[source] = values
+
+    def drop(self, source):
+        self._forwarded.pop(source, None)
+
+    def _merged(self):
+        if not self._forwarded:
+            return self._values
+        values = dict(self._values)
+        for source_values in self._forwarded.values():
+            for key, value in source_values.items():
+                values[key] = values.get(key, 0) + value
+        return values
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [счётчики по корзинам..., count, sum]
+            state = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += 1
+        state[-1] += value
+
+    def export(self):
+        delta = {}
+        for key, state in self._values.items():
+            previous = self._exported.get(key)
+            if previous is None or previous[-2] > state[-2]:
+                change = list(state)
+            else:
+                change = [value - old for value, old in zip(state, previous)]
+            if change[-2]:
+                delta[key] = change
+        self._exported = {key: list(state) for key, state in self._values.items()}
+        return delta
+
+    def merge(self, source, values):
+        for key, change in values.items():
+            state = self._forwarded.get(key)
+            if state is None:
+                self._forwarded[key] = list(change)
+            else:
+                for i, value in enumerate(change):
+                    state[i] += value
+
+    def _merged(self):
+        if not self._forwarded:
+            return self._values
+        values = {key: list(state) for key, state in self._values.items()}
+        for key, change in self._forwarded.items():
+            state = values.get(key)
+            if state is None:
+                values[key] = list(change)
+            else:
+                for i, value in enumerate(change):
+                    state[i] += value
+        return values
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, state in self._merged().items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket', _format_labels(self.labels, key, le), cumulative
+            yield f'{self.name}_bucket', _format_labels(self.labels, key, 'le="+Inf"'), state[-2]
+            yield f'{self.name}_count', _format_labels(self.labels, key), state[-2]
+            yield f'{self.name}_sum', _format_labels(self.labels, key), state[-1]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._server = None
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        # collect() вызывается перед каждой выдачей метрик и обновляет значения
+        self._collectors.append(collect)
+
+    def collect(self):
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Ошибка сбора метрик: {e}")
+
+    def render(self):
+        self.collect()
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+    def export(self, metrics):
+        # Воркер: значения своих метрик для супервизора, {имя: значения}
+        self.collect()
+        result = {}
+        for metric in metrics:
+            values = metric.export()
+            if values or metric.kind == 'gauge':
+                result[metric.name] = values
+        return result
+
+    def merge(self, source, exported):
+        # Супервизор: метрики процесса source (номер воркера)
+        for metric in self._metrics:
+            values = exported.get(metric.name)
+            if values is not None:
+                metric.merge(source, values)
+
+    def drop(self, source):
+        # Процесс завершился - его датчики больше не актуальны
+        for metric in self._metrics:
+            metric.drop(source)
+
+    async def start(self, host='127.0.0.1', port=9100):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        print(f"📈 Метрики: http://{host}:{port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body = self.render().encode('utf-8')
+                status = '200 OK'
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                body = b'not found\n'
+                status = '404 Not Found'
+                content_type = 'text/plain; charset=utf-8'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
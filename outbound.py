@@ -0,0 +1,299 @@
+# Единая очередь исходящих запросов бота.
+#
+# Все send_message/send_file бота идут через OutboundSender: общая очередь
+# с приоритетами (ответы админам > уведомления об удалениях > отчёты),
+# token bucket на весь бот и на каждый чат под лимиты Telegram
+# (~30 сообщений/с всего, ~1/с в личный чат, ~20/мин в группу)
+# и автоматическое ожидание с повтором при FloodWaitError.
+#
+# Лимит чата воркер не ждёт: задача для чата, у которого нет токена, действует
+# FloodWait или уже отправляется другая задача, откладывается в очередь этого
+# чата (по приоритету и порядку), а воркер берёт следующую - ответы админам в
+# другие чаты не стоят за ней. В каждый чат в работе не больше одной задачи;
+# следующая отложенная возвращается в общую очередь после завершения
+# предыдущей, так что порядок сообщений в чате сохраняется и при повторах
+# после FloodWait.
+
+import time
+import heapq
+import asyncio
+import itertools
+
+PRIORITY_ADMIN = 0
+PRIORITY_ALERT = 1
+PRIORITY_REPORT = 2
+PRIORITY_NAMES = {PRIORITY_ADMIN: 'admin', PRIORITY_ALERT: 'alert', PRIORITY_REPORT: 'report'}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # токенов в секунду
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # после FloodWait
+
+    def wait_time(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+def _rewind(value):
+    # Файлы (BytesIO и т.п.) после неудачной попытки уже прочитаны до конца
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            _rewind(item)
+    elif hasattr(value, 'seek'):
+        value.seek(0)
+
+
+class _Job:
+    __slots__ = ('method', 'entity', 'args', 'kwargs', 'future', 'attempts', 'enqueued_at', 'priority',
+                 'released')
+
+    def __init__(self, method, entity, args, kwargs, future, priority):
+        self.method = method
+        self.entity = entity
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.priority = priority
+        self.released = False  # возвращена из отложенных своего чата
+
+
+class OutboundSender:
+    def __init__(self, global_rate=30, private_rate=1, group_rate=20 / 60, group_burst=5,
+                 workers=4, max_retries=3, max_flood_wait=300, queue_size=10000):
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.queue_size = queue_size
+        self.client = None
+        self._queue = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._parked = {}  # чат -> куча (priority, seq, job) отложенных задач
+        self._wakeups = {}  # чат -> таймер возврата задачи; None - задача уже в очереди
+        self._busy = set()  # чаты, в которые сейчас идёт отправка
+        self.pending = {priority: 0 for priority in PRIORITY_NAMES}
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def start(self, client):
+        self.client = client
+        self._queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def _chat_key(self, entity):
+        return entity if isinstance(entity, int) else id(entity)
+
+    def _chat_bucket(self, entity, key):
+        bucket = self._chats.get(key)
+        if bucket is None:
+            # Отрицательные ID - группы и каналы, положительные - личные чаты
+            if isinstance(entity, int) and entity < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, 1)
+            self._chats[key] = bucket
+        return bucket
+
+    async def send_message(self, entity, *args, priority=PRIORITY_ALERT, **kwargs):
+        return await self._submit('send_message', entity, args, kwargs, priority)
+
+    async def send_file(self, entity, *args, priority=PRIORITY_ALERT, **kwargs):
+        return await self._submit('send_file', entity, args, kwargs, priority)
+
+    async def delete_messages(self, entity, *args, priority=PRIORITY_ADMIN, **kwargs):
+        return await self._submit('delete_messages', entity, args, kwargs, priority)
+
+    async def _submit(self, method, entity, args, kwargs, priority):
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(method, entity, args, kwargs, future, priority)
+        try:
+            self._queue.put_nowait((priority, next(self._seq), job))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            raise RuntimeError("очередь исходящих сообщений переполнена")
+        self.pending[priority] += 1
+        return await future
+
+    async def _acquire(self, bucket):
+        # Общий лимит короткий (1/30 с) и общий для всех задач - его ждём здесь.
+        # Лимит чата не ждём: False - задачу нужно отложить
+        while True:
+            wait = self._global.wait_time(time.monotonic())
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        if bucket.wait_time(time.monotonic()) > 0:
+            return False
+        self._global.consume()
+        bucket.consume()
+        return True
+
+    def _park(self, key, bucket, item):
+        heapq.heappush(self._parked.setdefault(key, []), item)
+        self._schedule(key, bucket)
+
+    def _schedule(self, key, bucket):
+        # Следующая отложенная задача чата вернётся, когда у него появится токен;
+        # пока идёт отправка в чат, это сделает её завершение
+        if key in self._parked and key not in self._wakeups and key not in self._busy:
+            self._wakeups[key] = asyncio.get_running_loop().call_later(
+                bucket.wait_time(time.monotonic()), self._unpark, key)
+
+    def _unpark(self, key):
+        # Таймер чата: его следующая отложенная задача возвращается в общую очередь
+        parked = self._parked.get(key)
+        while parked:
+            priority, seq, job = item = heapq.heappop(parked)
+            if not parked:
+                del self._parked[key]
+            job.released = True
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                job.released = False
+                self._fail(priority, job, RuntimeError("очередь исходящих сообщений переполнена"))
+                self.dropped += 1
+                continue
+            self._wakeups[key] = None
+            return
+        self._wakeups.pop(key, None)
+
+    def _fail(self, priority, job, error):
+        self.pending[priority] -= 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    async def _worker(self):
+        while True:
+            priority, seq, job = await self._queue.get()
+            try:
+                await self._run(priority, seq, job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, priority, seq, job):
+        key = self._chat_key(job.entity)
+        bucket = self._chat_bucket(job.entity, key)
+        released, job.released = job.released, False
+        if released:
+            # Возвращённая задача взята воркером
+            self._wakeups.pop(key, None)
+        if job.future.cancelled():
+            self.pending[priority] -= 1
+            self._schedule(key, bucket)
+            return
+        if key in self._busy or (key in self._wakeups and not released):
+            # В чат уже идёт отправка или перед этой задачей есть отложенные
+            self._park(key, bucket, (priority, seq, job))
+            return
+        self._busy.add(key)
+        try:
+            await self._send(priority, seq, job, key, bucket)
+        finally:
+            self._busy.discard(key)
+            self._schedule(key, bucket)
+
+    async def _send(self, priority, seq, job, key, bucket):
+        if not await self._acquire(bucket):
+            # У чата нет токена - отложенная задача вернётся, когда он появится
+            self._park(key, bucket, (priority, seq, job))
+            return
+        try:
+            result = await getattr(self.client, job.method)(job.entity, *job.args, **job.kwargs)
+        except Exception as e:
+            if type(e).__name__ == 'FloodWaitError':
+                self.flood_waits += 1
+                self.flood_wait_seconds += e.seconds
+                job.attempts += 1
+                if job.attempts <= self.max_retries and e.seconds <= self.max_flood_wait:
+                    # Блокируем чат на время FloodWait и откладываем задачу на своё место
+                    bucket.blocked_until = time.monotonic() + e.seconds
+                    print(f"⏳ FloodWait {e.seconds} с для {job.entity}, повтор {job.attempts}")
+                    _rewind(job.args)
+                    _rewind(list(job.kwargs.values()))
+                    self._park(key, bucket, (priority, seq, job))
+                    return
+                self.dropped += 1
+            else:
+                self.failed += 1
+            self._fail(priority, job, e)
+            return
+
+        self.pending[priority] -= 1
+        self.sent += 1
+        waited = time.monotonic() - job.enqueued_at
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def stats(self):
+        return {
+            'queue': self._queue.qsize() if self._queue is not None else 0,
+            'parked': sum(len(parked) for parked in self._parked.values()),
+            'parked_chats': len(self._parked),
+            'pending': {PRIORITY_NAMES[p]: count for p, count in self.pending.items()},
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': self.flood_wait_seconds,
+            'wait_avg': self.wait_time_total / self.sent if self.sent else 0.0,
+            'wait_max': self.wait_time_max,
+        }
+
+    async def _drain(self):
+        while True:
+            await self._queue.join()
+            if not self._wakeups:
+                return
+            await asyncio.sleep(0.1)
+
+    async def close(self, timeout=30):
+        if self._queue is not None and (self._wakeups or not self._queue.empty()):
+            try:
+                await asyncio.wait_for(self._drain(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        for handle in self._wakeups.values():
+            if handle is not None:
+                handle.cancel()
+        self._wakeups.clear()
+        for parked in self._parked.values():
+            for priority, _, job in parked:
+                self._fail(priority, job, RuntimeError("отправка остановлена"))
+        self._parked.clear()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
@@ -0,0 +1,234 @@
+# Фоновое (write-behind) сохранение bot_data на диск.
+#
+# На горячем пути остаётся только пометка "грязных" аккаунтов. Фоновая задача
+# раз в SAVE_INTERVAL секунд объединяет все накопленные изменения в одну запись,
+# сериализует данные в пуле потоков и атомарно заменяет файл (temp + fsync + rename).
+
+import os
+import copy
+import json
+import time
+import asyncio
+
+from idset import CompactIdSet, load_id_set
+from stats_store import encode_series
+
+
+class JsonBackend:
+    def __init__(self, path):
+        self.path = path
+        # Кэш сериализованных фрагментов по аккаунтам: пересобираем только изменённые
+        self._fragments = {}
+        self._stats_fragments = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        for acc in data.get('accounts', {}).values():
+            if 'dialogs' in acc:
+                acc['dialogs'] = load_id_set(acc['dialogs'])
+        return data
+
+    def snapshot_account(self, name, acc):
+        # На event loop только копии: вложенные словари (правила, расписание,
+        # позиция загрузки) маленькие, массив диалогов копируется целиком,
+        # а сериализация идёт в write()
+        dialogs = acc.get('dialogs')
+        if dialogs is not None and not isinstance(dialogs, CompactIdSet):
+            acc['dialogs'] = dialogs = CompactIdSet(dialogs)
+        acc_copy = acc.copy()
+        for key, value in acc_copy.items():
+            if isinstance(value, (dict, list)):
+                acc_copy[key] = copy.deepcopy(value)
+        if dialogs is not None:
+            acc_copy['dialogs'] = dialogs.copy()
+        return acc_copy
+
+    def write(self, snapshot):
+        # Вызывается из пула потоков, snapshot уже не разделяется с event loop
+        for name, acc in snapshot['accounts'].items():
+            dialogs = acc.get('dialogs')
+            if isinstance(dialogs, CompactIdSet):
+                acc['dialogs'] = dialogs.to_json()
+            self._fragments[name] = json.dumps(acc, ensure_ascii=False)
+        for name in list(self._fragments):
+            if name not in snapshot['names']:
+                del self._fragments[name]
+
+        if snapshot['global']:
+            self._stats_fragments = {}
+        for name, series in snapshot['stats'].items():
+            self._stats_fragments[name] = json.dumps(encode_series(series))
+        for name in list(self._stats_fragments):
+            if name not in snapshot['names']:
+                del self._stats_fragments[name]
+
+        accounts_json = ', '.join(
+            f"{json.dumps(name, ensure_ascii=False)}: {self._fragments[name]}"
+            for name in snapshot['names']
+        )
+        stats_json = ', '.join(
+            f"{json.dumps(name, ensure_ascii=False)}: {fragment}"
+            for name, fragment in self._stats_fragments.items()
+        )
+        payload = (
+            '{"accounts": {' + accounts_json + '}, '
+            '"admins": ' + json.dumps(snapshot['admins']) + ', '
+            '"stats": {' + stats_json + '}}'
+        )
+        atomic_write(self.path, payload.encode('utf-8'))
+
+    def after_write(self, snapshot):
+        pass
+
+    def close(self):
+        pass
+
+
+def atomic_write(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # fsync каталога, чтобы переименование пережило падение питания
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class WriteBehindPersistence:
+    def __init__(self, bot_data, backend, interval=2.0):
+        self.bot_data = bot_data
+        self.backend = backend
+        self.interval = interval
+        self._dirty_accounts = set()
+        self._dirty_global = False
+        self._full_pending = True  # первая запись включает все аккаунты
+        self._wakeup = None
+        self._task = None
+        self._lock = None
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+        self.on_flush = None  # on_flush(секунды) - для метрик
+
+    def mark_dirty(self, session_name=None):
+        # Единственное, что делается на горячем пути
+        if session_name is None:
+            self._dirty_global = True
+        else:
+            self._dirty_accounts.add(session_name)
+
+    def mark_all_dirty(self):
+        self._full_pending = True
+
+    @property
+    def has_pending(self):
+        return self._full_pending or self._dirty_global or bool(self._dirty_accounts)
+
+    def start(self):
+        if self._task is None:
+            self._lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if self.has_pending:
+                    await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка фонового сохранения данных: {e}")
+                await asyncio.sleep(self.interval)
+
+    def request_flush(self):
+        # Запросить внеочередную запись (например, после команд администратора)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _snapshot(self):
+        # Копирование на event loop: только грязные аккаунты, без сериализации
+        accounts = self.bot_data['accounts']
+        full = self._full_pending
+        if full:
+            dirty = set(accounts)
+        else:
+            dirty = self._dirty_accounts & set(accounts)
+        is_global = full or self._dirty_global
+        self._full_pending = False
+        self._dirty_global = False
+        self._dirty_accounts = set()
+
+        snapshot_accounts = {}
+        for name in dirty:
+            snapshot_accounts[name] = self.backend.snapshot_account(name, accounts[name])
+
+        return {
+            'full': full,
+            'global': is_global,
+            'names': list(accounts),
+            'accounts': snapshot_accounts,
+            'admins': list(self.bot_data['admins']),
+            # Статистика - только изменённых аккаунтов, при общих изменениях - вся
+            'stats': self.bot_data['stats'].snapshot(None if is_global else dirty),
+        }
+
+    async def flush(self):
+        async with self._lock:
+            if not self.has_pending:
+                return
+            snapshot = self._snapshot()
+            started = time.perf_counter()
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.backend.write, snapshot)
+            except BaseException:
+                # Не теряем изменения: следующая запись повторит их
+                self._full_pending = True
+                raise
+            self.backend.after_write(snapshot)
+            self.last_flush_duration = time.perf_counter() - started
+            self.flush_count += 1
+            if self.on_flush:
+                self.on_flush(self.last_flush_duration)
+
+    def flush_sync(self):
+        # Для записи вне event loop (первый запуск, аварийное завершение)
+        if not self.has_pending:
+            return
+        snapshot = self._snapshot()
+        self.backend.write(snapshot)
+        self.backend.after_write(snapshot)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock is not None:
+            await self.flush()
+        else:
+            self.flush_sync()
+        self.backend.close()
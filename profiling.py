@@ -0,0 +1,83 @@
+# Профилирование на работающем боте.
+#
+# /profile start [сек] включает cProfile на заданное окно (по умолчанию
+# PROFILE_DEFAULT_SECONDS), /profile stop и /profile dump возвращают топ
+# функций файлом. Профилируется весь event loop: обработчики, запись данных,
+# Telethon. Без активного окна накладных расходов нет.
+# SlowCallLog - всегда включённый учёт медленных вызовов обработчиков:
+# вызовы дольше порога пишутся в лог с именем сессии и хранятся последние N.
+
+import io
+import time
+import pstats
+import asyncio
+import cProfile
+from collections import deque
+
+
+class Profiler:
+    def __init__(self, default_seconds=60, max_seconds=600):
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+        self._profile = None
+        self._result = None  # последний завершённый cProfile.Profile
+        self._timer = None
+        self.started_at = None
+        self.duration = 0.0
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def start(self, seconds=None):
+        if self.running:
+            return False
+        seconds = min(seconds or self.default_seconds, self.max_seconds)
+        self._profile = cProfile.Profile()
+        self.started_at = time.monotonic()
+        self._profile.enable()
+        self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._profile.disable()
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.duration = time.monotonic() - self.started_at
+        self._result = self._profile
+        self._profile = None
+        return True
+
+    def dump(self, top=40):
+        # Текст отчёта: топ по собственному и по накопленному времени
+        if self.running:
+            self.stop()
+        if self._result is None:
+            return None
+        out = io.StringIO()
+        out.write(f"Окно профилирования: {self.duration:.1f} с\n\n")
+        stats = pstats.Stats(self._result, stream=out)
+        stats.strip_dirs()
+        out.write("=== По собственному времени (tottime) ===\n")
+        stats.sort_stats('tottime').print_stats(top)
+        out.write("\n=== По накопленному времени (cumtime) ===\n")
+        stats.sort_stats('cumulative').print_stats(top)
+        return out.getvalue()
+
+
+class SlowCallLog:
+    def __init__(self, threshold=1.0, keep=50):
+        self.threshold = threshold
+        self.calls = deque(maxlen=keep)  # (время, обработчик, сессия, секунды)
+        self.total = 0
+
+    def record(self, handler_name, session_name, elapsed):
+        if elapsed < self.threshold:
+            return
+        self.total += 1
+        self.calls.append((time.time(), handler_name, session_name, elapsed))
+        where = f" ({session_name})" if session_name else ""
+        print(f"🐢 Медленный обработчик {handler_name}{where}: {elapsed:.2f} с")
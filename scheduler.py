@@ -0,0 +1,248 @@
+# Планировщик периодических задач: отчёты по расписаниям аккаунтов,
+# фоновая запись данных, очистка кэшей.
+#
+# Задачи лежат в куче по сроку на монотонных часах (добавление и перенос -
+# O(log n), отменённые записи просто пропускаются). Время слотов по расписанию
+# считается в часовом поясе расписания через zoneinfo и переводится в срок на
+# монотонных часах; перед запуском срок сверяется с настенными часами, сон не
+# дольше max_sleep, так что перевод часов и сон машины не сдвигают запуски.
+# Следующий слот считается от запланированного, а не от конца выполнения:
+# долгий запуск не сдвигает расписание. Если задача ещё выполняется, когда
+# подошёл следующий слот, он выполнится сразу после неё, а не потеряется.
+# Пропущенные за время простоя слоты (по last_run) догоняются одним запуском.
+
+import time
+import heapq
+import asyncio
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+
+def parse_times(text):
+    # '16:00,20:00,0:00' -> ((0, 0), (16, 0), (20, 0))
+    times = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        hour, _, minute = part.partition(':')
+        hour, minute = int(hour), int(minute or 0)
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"неверное время: {part}")
+        times.add((hour, minute))
+    return tuple(sorted(times))
+
+
+def format_times(times):
+    return ','.join(f'{hour:02d}:{minute:02d}' for hour, minute in times)
+
+
+class DailyAt:
+    # Каждый день в заданные часы и минуты по местному времени пояса
+    def __init__(self, times, tz):
+        self.times = tuple(sorted(times))
+        self.tz = ZoneInfo(tz) if isinstance(tz, str) else tz
+
+    def next_after(self, timestamp):
+        if not self.times:
+            return None
+        local = datetime.fromtimestamp(timestamp, self.tz)
+        # Три дня: при переходе на летнее время нужного часа в сутках может не быть
+        for days in range(3):
+            day = local.date() + timedelta(days=days)
+            for hour, minute in self.times:
+                slot = datetime(day.year, day.month, day.day, hour, minute, tzinfo=self.tz).timestamp()
+                if slot > timestamp:
+                    return slot
+        return None
+
+    def __repr__(self):
+        return f'{format_times(self.times)} {self.tz.key}'
+
+
+class Every:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def next_after(self, timestamp):
+        return timestamp + self.seconds
+
+    def __repr__(self):
+        return f'каждые {self.seconds:g} с'
+
+
+class Job:
+    __slots__ = ('name', 'trigger', 'callback', 'on_run', 'next_run', 'last_run',
+                 'token', 'running', 'pending', 'runs', 'failures', 'last_duration')
+
+    def __init__(self, name, trigger, callback, on_run=None, last_run=None):
+        self.name = name
+        self.trigger = trigger
+        self.callback = callback  # async callback(слот) - время слота, секунды от эпохи
+        self.on_run = on_run  # on_run(слот) после успешного запуска - сохранить last_run
+        self.next_run = None  # ближайший слот, секунды от эпохи
+        self.last_run = last_run
+        self.token = 0  # запись в куче действительна, пока совпадает token
+        self.running = False
+        self.pending = None  # слот, подошедший во время выполнения
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+
+
+class Scheduler:
+    def __init__(self, max_sleep=60.0):
+        self.max_sleep = max_sleep
+        self._jobs = {}
+        self._heap = []  # (срок на монотонных часах, порядковый номер, token, job)
+        self._seq = 0
+        self._wakeup = None
+        self._task = None
+        self._running_tasks = set()
+
+    def add(self, name, trigger, callback, on_run=None, last_run=None):
+        # Задача с тем же именем заменяется
+        self.remove(name)
+        job = Job(name, trigger, callback, on_run, last_run)
+        self._jobs[name] = job
+        now = time.time()
+        if last_run is not None:
+            missed = trigger.next_after(last_run)
+            if missed is not None and missed <= now:
+                # Слоты пропущены, пока бот не работал - один догоняющий запуск
+                # за последний из них: колбэк получает время этого слота
+                while True:
+                    later = trigger.next_after(missed)
+                    if later is None or later > now:
+                        break
+                    missed = later
+                print(f"⏰ {name}: пропущен запуск {datetime.fromtimestamp(missed):%d.%m %H:%M}, выполняем сейчас")
+                self._push(job, missed)
+                return job
+        self._push(job, trigger.next_after(now))
+        return job
+
+    def remove(self, name):
+        job = self._jobs.pop(name, None)
+        if job is not None:
+            job.token += 1  # запись в куче станет недействительной
+            job.next_run = None
+        return job is not None
+
+    def names(self, prefix=''):
+        return [name for name in self._jobs if name.startswith(prefix)]
+
+    def get(self, name):
+        return self._jobs.get(name)
+
+    def run_now(self, name):
+        job = self._jobs.get(name)
+        if job is not None:
+            self._push(job, time.time())
+
+    def _push(self, job, run_at):
+        job.token += 1
+        job.next_run = run_at
+        if run_at is None:
+            return
+        self._seq += 1
+        due = time.monotonic() + max(0.0, run_at - time.time())
+        heapq.heappush(self._heap, (due, self._seq, job.token, job))
+        if self._wakeup is not None and self._heap[0][3] is job:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        heap = self._heap
+        while True:
+            # Отменённые и перенесённые записи - убираем с вершины
+            while heap and heap[0][2] != heap[0][3].token:
+                heapq.heappop(heap)
+            delay = self.max_sleep
+            if heap:
+                delay = min(delay, heap[0][0] - time.monotonic())
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, _, job = heapq.heappop(heap)
+            slot = job.next_run
+            now = time.time()
+            if slot - now > 1:
+                # Настенные часы отстают от монотонных (перевели часы) - пересчитываем срок
+                self._push(job, slot)
+                continue
+            self._fire(job, slot)
+            next_run = job.trigger.next_after(slot)
+            if next_run is not None and next_run <= now:
+                # Цикл стоял дольше периода - пропущенные слоты не повторяем
+                next_run = job.trigger.next_after(now)
+            self._push(job, next_run)
+
+    def _fire(self, job, slot):
+        if job.running:
+            job.pending = slot
+            return
+        task = asyncio.create_task(self._execute(job, slot))
+        self._running_tasks.add(task)
+        task.add_done_callback(self._running_tasks.discard)
+
+    async def _execute(self, job, slot):
+        job.running = True
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    await job.callback(slot)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    job.failures += 1
+                    print(f"Ошибка задачи {job.name}: {e}")
+                else:
+                    job.runs += 1
+                    job.last_run = slot
+                    if job.on_run:
+                        job.on_run(slot)
+                job.last_duration = time.monotonic() - started
+                if job.pending is None:
+                    break
+                # Слот подошёл во время выполнения - запускаем сразу
+                slot, job.pending = job.pending, None
+        finally:
+            job.running = False
+
+    def stats(self):
+        return [
+            {
+                'name': job.name,
+                'trigger': repr(job.trigger),
+                'next_run': job.next_run,
+                'last_run': job.last_run,
+                'running': job.running,
+                'runs': job.runs,
+                'failures': job.failures,
+                'last_duration': job.last_duration,
+            }
+            for job in self._jobs.values()
+        ]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Выполняющиеся задачи (отчёты, запись) дорабатывают
+        if self._running_tasks:
+            await asyncio.gather(*self._running_tasks, return_exceptions=True)
@@ -0,0 +1,384 @@
+# Распределение аккаунтов по процессам-воркерам (SHARD_WORKERS > 0).
+#
+# Все клиенты в одном процессе делят одно ядро: расшифровка MTProto и
+# обработчики всех аккаунтов конкурируют за один event loop. В режиме
+# супервизора аккаунты раскладываются по N процессам (по хешу имени, так что
+# аккаунт при перезапуске попадает в тот же воркер). Бот управления,
+# хранение данных и отчёты остаются в главном процессе.
+#
+# Воркер общается с супервизором через очереди multiprocessing:
+#   воркер -> супервизор: вызовы бота (send_message/send_file), изменения
+#       аккаунтов (новые ID диалогов, позиция загрузки), счётчики новых диалогов
+#       состояние подключения клиентов и метрики (при METRICS_PORT);
+#   супервизор -> воркер: ответы на вызовы бота, изменения настроек аккаунта,
+#       запуск добавленного или авторизованного аккаунта, его остановка
+#       и завершение работы.
+# Упавший воркер перезапускается, остальные продолжают работать.
+
+import io
+import os
+import zlib
+import asyncio
+import threading
+import multiprocessing
+
+from idset import CompactIdSet
+from outbound import PRIORITY_ALERT
+
+# Поля аккаунта, которыми владеет воркер; остальные меняет только супервизор
+WORKER_FIELDS = ('initialized', 'ingest_checkpoint')
+
+
+def shard_for(session_name, workers):
+    return zlib.crc32(session_name.encode('utf-8')) % workers
+
+
+def encode_file(file):
+    # Буфер в памяти уходит в другой процесс как байты с именем файла
+    if isinstance(file, (list, tuple)):
+        return [encode_file(item) for item in file]
+    if isinstance(file, io.BytesIO):
+        return ('bytes', getattr(file, 'name', 'file'), file.getvalue())
+    return file
+
+
+def decode_file(value):
+    if isinstance(value, list):
+        return [decode_file(item) for item in value]
+    if isinstance(value, tuple) and len(value) == 3 and value[0] == 'bytes':
+        buf = io.BytesIO(value[2])
+        buf.name = value[1]
+        return buf
+    return value
+
+
+class ForwardedDialogSet(CompactIdSet):
+    # acc['dialogs'] в воркере: запоминает ID, ещё не отправленные супервизору
+    __slots__ = ('_unflushed', '_replace')
+
+    def __init__(self, ids=(), replace=False):
+        super().__init__(ids)
+        self._unflushed = set()
+        self._replace = replace
+
+    def add(self, value):
+        if value not in self:
+            self._unflushed.add(value)
+            super().add(value)
+
+
+class WorkerLink:
+    # Сторона воркера: прокси для bot/outbound и отправка изменений супервизору
+    def __init__(self, shard, commands, events, bot_data, sync_interval=2.0, on_stop=None, on_update=None,
+                 client_states=None, export_metrics=None, on_start=None):
+        self.shard = shard
+        self.commands = commands
+        self.events = events
+        self.bot_data = bot_data
+        self.sync_interval = sync_interval
+        self.on_stop = on_stop
+        self.on_start = on_start  # async on_start(имя) - запустить клиент аккаунта
+        self.on_update = on_update  # on_update(имя, поля) - после изменения аккаунта супервизором
+        self.client_states = client_states  # client_states() -> {имя: подключён} запущенных клиентов
+        self._sent_states = None
+        self.export_metrics = export_metrics  # export_metrics() -> метрики для супервизора
+        self._loop = None
+        self._task = None
+        self._closed = None
+        self._requests = {}
+        self._next_request = 0
+        self._dirty = set()
+        self._new_dialogs = {}  # (session, час от эпохи) -> количество
+        self._parent = os.getppid()
+        self._orphaned = False
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._closed = asyncio.Event()
+        for acc in self.bot_data['accounts'].values():
+            if 'dialogs' in acc:
+                acc['dialogs'] = ForwardedDialogSet(acc['dialogs'])
+        threading.Thread(target=self._read_commands, daemon=True).start()
+        self._task = asyncio.create_task(self._run())
+
+    def _read_commands(self):
+        # После ('shutdown',) чтение продолжается: воркер ещё досылает уведомления
+        # и ждёт ответов на них. Поток останавливает None из close()
+        while True:
+            message = self.commands.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._handle, message)
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind == 'reply':
+            _, request_id, error = message
+            future = self._requests.pop(request_id, None)
+            if future is None or future.done():
+                return
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError(error))
+        elif kind == 'account':
+            _, name, fields = message
+            acc = self.bot_data['accounts'].get(name)
+            if acc is not None:
+                acc.update(fields)
+                if self.on_update:
+                    self.on_update(name, fields)
+        elif kind == 'start':
+            _, name, acc = message
+            if 'dialogs' in acc:
+                acc['dialogs'] = ForwardedDialogSet(acc['dialogs'])
+            self.bot_data['accounts'][name] = acc
+            if self.on_start:
+                asyncio.create_task(self.on_start(name))
+        elif kind == 'stop':
+            name = message[1]
+            if self.on_stop:
+                asyncio.create_task(self.on_stop(name))
+        elif kind == 'shutdown':
+            self._closed.set()
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    async def send_message(self, entity, *args, priority=PRIORITY_ALERT, **kwargs):
+        return await self._request('send_message', entity, args, kwargs, priority)
+
+    async def send_file(self, entity, file, *args, priority=PRIORITY_ALERT, **kwargs):
+        return await self._request('send_file', entity, (encode_file(file),) + args, kwargs, priority)
+
+    async def _request(self, method, entity, args, kwargs, priority):
+        if self._orphaned:
+            raise RuntimeError("супервизор недоступен")
+        self._next_request += 1
+        request_id = self._next_request
+        future = self._loop.create_future()
+        self._requests[request_id] = future
+        self.events.put(('call', self.shard, request_id, method, entity, args, kwargs, priority))
+        return await future
+
+    def mark_dirty(self, session_name):
+        if session_name is not None:
+            self._dirty.add(session_name)
+
+    def count_new_dialog(self, session_name, hour):
+        key = (session_name, hour)
+        self._new_dialogs[key] = self._new_dialogs.get(key, 0) + 1
+
+    async def _run(self):
+        while not self._closed.is_set():
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout=self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            if os.getppid() != self._parent:
+                # Супервизор завершился - воркер не должен остаться сиротой
+                print(f"⚠️ Воркер {self.shard}: супервизор пропал, завершаем работу")
+                # Ответов больше не будет - досылка при завершении не должна их ждать
+                self._orphaned = True
+                for future in self._requests.values():
+                    if not future.done():
+                        future.set_exception(RuntimeError("супервизор недоступен"))
+                self._requests = {}
+                self._closed.set()
+            self.sync()
+
+    def sync(self):
+        for name in self._dirty:
+            acc = self.bot_data['accounts'].get(name)
+            if acc is None:
+                continue
+            dialogs = acc.get('dialogs')
+            if dialogs is not None and not isinstance(dialogs, ForwardedDialogSet):
+                # Набор диалогов создан заново (первая загрузка) - заменяем целиком
+                acc['dialogs'] = dialogs = ForwardedDialogSet(dialogs, replace=True)
+                dialogs._unflushed.update(dialogs)
+            new_ids = []
+            replace = False
+            if dialogs is not None:
+                new_ids = list(dialogs._unflushed)
+                replace = dialogs._replace
+                dialogs._unflushed = set()
+                dialogs._replace = False
+            fields = {key: acc[key] for key in WORKER_FIELDS if key in acc}
+            self.events.put(('account', self.shard, name, fields, new_ids, replace))
+        self._dirty = set()
+        if self._new_dialogs:
+            self.events.put(('new_dialogs', self.shard, self._new_dialogs))
+            self._new_dialogs = {}
+        if self.client_states:
+            states = self.client_states()
+            if states != self._sent_states:
+                self.events.put(('clients', self.shard, states))
+                self._sent_states = states
+        if self.export_metrics:
+            self.events.put(('metrics', self.shard, self.export_metrics()))
+
+    async def close(self):
+        if self._task:
+            self._closed.set()
+            await self._task
+            self._task = None
+        self.sync()
+        self.commands.put(None)
+
+
+class ShardSupervisor:
+    # Сторона главного процесса: запуск, наблюдение и перезапуск воркеров
+    def __init__(self, workers, target, make_accounts, on_message, restart_delay=5.0, on_exit=None):
+        # target(shard, accounts, commands, events) - точка входа воркера (в отдельном процессе),
+        # make_accounts(names) - копии аккаунтов для воркера,
+        # on_message(message) - обработчик сообщений воркеров на event loop,
+        # on_exit(shard) - воркер завершился
+        self.workers = workers
+        self.target = target
+        self.make_accounts = make_accounts
+        self.on_message = on_message
+        self.restart_delay = restart_delay
+        self.on_exit = on_exit
+        self._context = multiprocessing.get_context('spawn')
+        self._events = None
+        self._loop = None
+        self._reader = None
+        self._monitor = None
+        self._closing = False
+        self._processes = {}  # shard -> Process
+        self._commands = {}  # shard -> Queue
+        self._names = {shard: set() for shard in range(workers)}
+        self.clients = {}  # shard -> {имя: подключён} по последнему сообщению воркера
+        self.restarts = {shard: 0 for shard in range(workers)}
+
+    def owner(self, session_name):
+        for shard, names in self._names.items():
+            if session_name in names:
+                return shard
+        return None
+
+    def client_state(self, session_name):
+        # None - клиент не запущен (или воркер не работает), иначе подключён ли он
+        shard = self.owner(session_name)
+        if shard is None or shard not in self._processes:
+            return None
+        return self.clients.get(shard, {}).get(session_name)
+
+    def start(self, session_names):
+        self._loop = asyncio.get_running_loop()
+        self._events = self._context.Queue()
+        for name in session_names:
+            self._names[shard_for(name, self.workers)].add(name)
+        self._reader = threading.Thread(target=self._read_events, daemon=True)
+        self._reader.start()
+        for shard in range(self.workers):
+            if self._names[shard]:
+                self._spawn(shard)
+        self._monitor = asyncio.create_task(self._watch())
+
+    def _spawn(self, shard):
+        commands = self._context.Queue()
+        accounts = self.make_accounts(sorted(self._names[shard]))
+        process = self._context.Process(
+            target=self.target,
+            args=(shard, accounts, commands, self._events),
+            name=f'shard-{shard}',
+            daemon=True
+        )
+        process.start()
+        self._processes[shard] = process
+        self._commands[shard] = commands
+        print(f"🧩 Воркер {shard} (pid {process.pid}): аккаунтов {len(accounts)}")
+
+    def _read_events(self):
+        while True:
+            message = self._events.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self.on_message, message)
+
+    async def _watch(self):
+        while not self._closing:
+            await asyncio.sleep(1)
+            for shard, process in list(self._processes.items()):
+                if process.is_alive() or self._closing:
+                    continue
+                print(f"💥 Воркер {shard} завершился (код {process.exitcode}), "
+                      f"перезапуск через {self.restart_delay:.0f} с")
+                del self._processes[shard]
+                self.clients.pop(shard, None)
+                if self.on_exit:
+                    self.on_exit(shard)
+                self.restarts[shard] += 1
+                self._loop.call_later(self.restart_delay, self._restart, shard)
+
+    def _restart(self, shard):
+        if self._closing or shard in self._processes or not self._names[shard]:
+            return
+        self._spawn(shard)
+
+    def send(self, shard, message):
+        commands = self._commands.get(shard)
+        if commands is not None and shard in self._processes:
+            commands.put(message)
+
+    def add_account(self, session_name):
+        # Новый или только что авторизованный аккаунт: в воркер его шарда.
+        # Работающий воркер получает копию аккаунта, остановленный запускается с ним
+        shard = self.owner(session_name)
+        if shard is None:
+            shard = shard_for(session_name, self.workers)
+            self._names[shard].add(session_name)
+        if self._closing or self._events is None:
+            return shard
+        if shard in self._processes:
+            accounts = self.make_accounts([session_name])
+            if session_name in accounts:
+                self.send(shard, ('start', session_name, accounts[session_name]))
+        else:
+            self._spawn(shard)
+        return shard
+
+    def update_account(self, session_name, fields):
+        shard = self.owner(session_name)
+        if shard is not None:
+            self.send(shard, ('account', session_name, fields))
+
+    def stop_account(self, session_name):
+        shard = self.owner(session_name)
+        if shard is None:
+            return False
+        self._names[shard].discard(session_name)
+        self.send(shard, ('stop', session_name))
+        return True
+
+    def stats(self):
+        result = {}
+        for shard in range(self.workers):
+            process = self._processes.get(shard)
+            result[shard] = {
+                'pid': process.pid if process else None,
+                'alive': bool(process and process.is_alive()),
+                'accounts': len(self._names[shard]),
+                'restarts': self.restarts[shard],
+            }
+        return result
+
+    async def close(self, timeout=30):
+        self._closing = True
+        if self._monitor:
+            self._monitor.cancel()
+        for shard in list(self._processes):
+            self.send(shard, ('shutdown',))
+        loop = asyncio.get_running_loop()
+        for process in self._processes.values():
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = {}
+        if self._reader is not None:
+            # Сообщения воркеров уже в канале - сигнал остановки придёт после них
+            self._events.put(None)
+            await loop.run_in_executor(None, self._reader.join)
+            await asyncio.sleep(0)
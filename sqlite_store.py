@@ -0,0 +1,278 @@
+# Хранилище состояния в SQLite (STORAGE_BACKEND=sqlite).
+#
+# Аккаунты, ID диалогов, статистика и админы лежат в отдельных таблицах.
+# Диалоги не загружаются в память при старте: acc['dialogs'] - это прокси
+# SQLiteDialogSet, который проверяет членство точечным запросом по первичному
+# ключу (session, chat_id), а новые ID пишет пачкой в одной транзакции
+# при фоновом сохранении (см. persistence.py).
+
+import os
+import json
+import sqlite3
+
+from idset import load_id_set
+from stats_store import encode_series
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    session TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dialogs (
+    session TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (session, chat_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_stats (
+    session TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (session, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    session TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admins (
+    user_id INTEGER PRIMARY KEY
+);
+"""
+
+
+class SQLiteDialogSet:
+    # Поддерживает то же, что используется у set в main.py: in, add, len
+    def __init__(self, store, session_name, replace=False):
+        self._store = store
+        self._session = session_name
+        self._unflushed = set()  # добавлены, но ещё не записаны в БД
+        self._replace = replace  # строки сессии в БД устарели и будут перезаписаны
+        self._count = 0 if replace else None
+
+    def __contains__(self, chat_id):
+        if chat_id in self._unflushed:
+            return True
+        if self._replace:
+            return False
+        return self._store.has_dialog(self._session, chat_id)
+
+    def add(self, chat_id):
+        if chat_id in self:
+            return
+        self._unflushed.add(chat_id)
+        if self._count is not None:
+            self._count += 1
+
+    def update(self, chat_ids):
+        for chat_id in chat_ids:
+            self.add(chat_id)
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._store.count_dialogs(self._session) + len(self._unflushed)
+        return self._count
+
+    def __iter__(self):
+        if not self._replace:
+            yield from self._store.iter_dialogs(self._session)
+        yield from list(self._unflushed)
+
+
+class SQLiteBackend:
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.json_path = json_path
+        # Соединение для чтения используется на event loop,
+        # соединение для записи - только из пула потоков под блокировкой persistence
+        self._read_conn = None
+        self._write_conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _open(self):
+        if self._write_conn is not None:
+            return
+        self._write_conn = self._connect()
+        self._write_conn.executescript(SCHEMA)
+        version = self._write_conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            if version < 1:
+                self._migrate_from_json()
+            self._migrate_daily_stats()
+            self._write_conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+            self._write_conn.commit()
+        self._read_conn = self._connect()
+
+    def _migrate_from_json(self):
+        # Однократный перенос данных из bot_data.json
+        if not self.json_path or not os.path.exists(self.json_path):
+            return
+        with open(self.json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        conn = self._write_conn
+        with conn:
+            dialogs_total = 0
+            for name, acc in data.get('accounts', {}).items():
+                acc = dict(acc)
+                dialogs = load_id_set(acc.pop('dialogs', []))
+                conn.execute(
+                    'INSERT OR REPLACE INTO accounts (session, data) VALUES (?, ?)',
+                    (name, json.dumps(acc, ensure_ascii=False))
+                )
+                conn.executemany(
+                    'INSERT OR IGNORE INTO dialogs (session, chat_id) VALUES (?, ?)',
+                    ((name, chat_id) for chat_id in dialogs)
+                )
+                dialogs_total += len(dialogs)
+            for name, days in data.get('daily_stats', {}).items():
+                conn.executemany(
+                    'INSERT OR REPLACE INTO daily_stats (session, day, count) VALUES (?, ?, ?)',
+                    ((name, day, count) for day, count in days.items())
+                )
+            conn.executemany(
+                'INSERT OR REPLACE INTO stats (session, data) VALUES (?, ?)',
+                ((name, json.dumps(value)) for name, value in data.get('stats', {}).items())
+            )
+            conn.executemany(
+                'INSERT OR IGNORE INTO admins (user_id) VALUES (?)',
+                ((admin_id,) for admin_id in data.get('admins', []))
+            )
+        print(f"📦 Данные перенесены из {self.json_path} в {self.path} "
+              f"({len(data.get('accounts', {}))} аккаунтов, {dialogs_total} диалогов)")
+
+    def _migrate_daily_stats(self):
+        # Версия 2: счётчики по дням из daily_stats становятся дневными итогами
+        # почасовой статистики (stats_store.py), таблица daily_stats больше не пишется
+        conn = self._write_conn
+        days_by_session = {}
+        for name, day, count in conn.execute('SELECT session, day, count FROM daily_stats'):
+            days_by_session.setdefault(name, {})[day] = count
+        with conn:
+            for name, days in days_by_session.items():
+                conn.execute(
+                    'INSERT OR IGNORE INTO stats (session, data) VALUES (?, ?)',
+                    (name, json.dumps({'days': days}))
+                )
+            conn.execute('DELETE FROM daily_stats')
+
+    def load(self):
+        self._open()
+        conn = self._read_conn
+        accounts = {}
+        for name, raw in conn.execute('SELECT session, data FROM accounts'):
+            acc = json.loads(raw)
+            acc['dialogs'] = SQLiteDialogSet(self, name)
+            accounts[name] = acc
+
+        stats = {name: json.loads(raw) for name, raw in conn.execute('SELECT session, data FROM stats')}
+
+        admins = [row[0] for row in conn.execute('SELECT user_id FROM admins')]
+        data = {'accounts': accounts, 'stats': stats}
+        if admins:
+            data['admins'] = admins
+        return data
+
+    def has_dialog(self, session_name, chat_id):
+        row = self._read_conn.execute(
+            'SELECT 1 FROM dialogs WHERE session = ? AND chat_id = ?',
+            (session_name, chat_id)
+        ).fetchone()
+        return row is not None
+
+    def count_dialogs(self, session_name):
+        return self._read_conn.execute(
+            'SELECT COUNT(*) FROM dialogs WHERE session = ?', (session_name,)
+        ).fetchone()[0]
+
+    def iter_dialogs(self, session_name):
+        rows = self._read_conn.execute(
+            'SELECT chat_id FROM dialogs WHERE session = ?', (session_name,)
+        )
+        for (chat_id,) in rows:
+            yield chat_id
+
+    def snapshot_account(self, name, acc):
+        # Выполняется на event loop: забираем только новые ID диалогов
+        dialogs = acc.get('dialogs')
+        if dialogs is not None and not isinstance(dialogs, SQLiteDialogSet):
+            # Аккаунт заполнил диалоги обычным set (первая загрузка, новый аккаунт)
+            proxy = SQLiteDialogSet(self, name, replace=True)
+            proxy.update(dialogs)
+            acc['dialogs'] = dialogs = proxy
+
+        acc_copy = acc.copy()
+        acc_copy.pop('dialogs', None)
+        new_dialogs = None
+        replace = False
+        if dialogs is not None:
+            new_dialogs = list(dialogs._unflushed)
+            replace = dialogs._replace
+        return {
+            'data': json.dumps(acc_copy, ensure_ascii=False),
+            'new_dialogs': new_dialogs,
+            'replace_dialogs': replace,
+            # Прокси не используется в write(), нужен только в after_write()
+            'dialogs_ref': dialogs,
+        }
+
+    def write(self, snapshot):
+        self._open()
+        conn = self._write_conn
+        with conn:
+            for name, acc in snapshot['accounts'].items():
+                conn.execute(
+                    'INSERT OR REPLACE INTO accounts (session, data) VALUES (?, ?)',
+                    (name, acc['data'])
+                )
+                if acc['replace_dialogs']:
+                    conn.execute('DELETE FROM dialogs WHERE session = ?', (name,))
+                if acc['new_dialogs']:
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO dialogs (session, chat_id) VALUES (?, ?)',
+                        ((name, chat_id) for chat_id in acc['new_dialogs'])
+                    )
+
+            # Статистика: в snapshot только изменённые аккаунты, при общих изменениях - все
+            if snapshot['global']:
+                conn.execute('DELETE FROM stats')
+            conn.executemany(
+                'INSERT OR REPLACE INTO stats (session, data) VALUES (?, ?)',
+                ((name, json.dumps(encode_series(series))) for name, series in snapshot['stats'].items())
+            )
+
+            if snapshot['global']:
+                names = set(snapshot['names'])
+                stored = [row[0] for row in conn.execute('SELECT session FROM accounts')]
+                for name in stored:
+                    if name not in names:
+                        conn.execute('DELETE FROM accounts WHERE session = ?', (name,))
+                        conn.execute('DELETE FROM dialogs WHERE session = ?', (name,))
+                        conn.execute('DELETE FROM stats WHERE session = ?', (name,))
+                conn.execute('DELETE FROM admins')
+                conn.executemany(
+                    'INSERT INTO admins (user_id) VALUES (?)',
+                    ((admin_id,) for admin_id in snapshot['admins'])
+                )
+
+    def after_write(self, snapshot):
+        # На event loop после успешной записи: убираем записанные ID из буфера
+        for acc in snapshot['accounts'].values():
+            dialogs = acc['dialogs_ref']
+            if dialogs is None:
+                continue
+            dialogs._unflushed.difference_update(acc['new_dialogs'])
+            if acc['replace_dialogs']:
+                dialogs._replace = False
+
+    def close(self):
+        for conn in (self._read_conn, self._write_conn):
+            if conn is not None:
+                conn.close()
+        self._read_conn = None
+        self._write_conn = None
@@ -0,0 +1,223 @@
+# Почасовая статистика новых диалогов по сессиям.
+#
+# На каждую сессию - кольцо из retention_days * 24 часовых корзин в массиве.
+# В кольце хранятся не сами счётчики, а накопленные суммы (префиксные суммы
+# по часам), поэтому сумма за любой диапазон часов внутри кольца - разность
+# двух элементов, без обхода. Увеличивается только текущий час: префиксы
+# более поздних часов ещё не существуют, так что прибавление стоит O(1)
+# (запоздавшие прибавления из воркеров - за несколько часов назад).
+# Часы, выпадающие из кольца, сворачиваются в дневные итоги.
+#
+# Часы считаются от эпохи UTC. День статистики начинается в час отсечки
+# (например 04:00 МСК): day_offset = смещение пояса - час отсечки, и день
+# часа h - это (h + day_offset) // 24. Дни хранятся как номер дня от
+# 1970-01-01, в JSON - датой 'YYYY-MM-DD' (дата начала дня по поясу отчётов).
+
+import zlib
+import base64
+from array import array
+from datetime import date, timedelta
+
+EPOCH = date(1970, 1, 1)
+
+
+def day_label(day):
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+
+def parse_day(label):
+    return (date.fromisoformat(label) - EPOCH).days
+
+
+def parse_stats_range(arg, today):
+    # 7d / 30d - последние N дней включая сегодня, YYYY-MM-DD или YYYY-MM-DD..YYYY-MM-DD.
+    # Дни ограничены [1970-01-01, today]: раньше статистики нет, а огромное N
+    # не должно выходить за пределы date
+    if arg.endswith('d') and arg[:-1].isdigit() and int(arg[:-1]) > 0:
+        return max(today - int(arg[:-1]) + 1, 0), today
+    first, _, last = arg.partition('..')
+    first_day = parse_day(first)
+    last_day = parse_day(last) if last else first_day
+    if first_day > last_day:
+        first_day, last_day = last_day, first_day
+    return min(max(first_day, 0), today), min(max(last_day, 0), today)
+
+
+def encode_series(snapshot):
+    # HourlySeries.snapshot() -> JSON
+    return {
+        'hour': snapshot['hour'],
+        'base': snapshot['base'],
+        'cum': base64.b64encode(zlib.compress(snapshot['cum'].tobytes())).decode('ascii'),
+        'days': {day_label(day): count for day, count in sorted(snapshot['days'].items())},
+    }
+
+
+class HourlySeries:
+    __slots__ = ('size', 'day_offset', 'hour', 'base', 'cum', 'days')
+
+    def __init__(self, size, day_offset, hour):
+        self.size = size
+        self.day_offset = day_offset
+        self.hour = hour  # последний час в кольце
+        self.base = 0  # накопленная сумма до первого часа кольца
+        self.cum = array('q', bytes(8 * size))  # cum[h % size] - сумма по час h включительно
+        self.days = {}  # номер дня -> сумма за часы, вышедшие из кольца
+
+    @property
+    def first_hour(self):
+        return self.hour - self.size + 1
+
+    def _day(self, hour):
+        return (hour + self.day_offset) // 24
+
+    def _advance(self, hour):
+        size = self.size
+        cum = self.cum
+        total = cum[self.hour % size]
+        # Сначала сворачиваем уходящие часы в дни, потом переписываем их ячейки
+        for old in range(self.first_hour, min(hour - size, self.hour) + 1):
+            value = cum[old % size]
+            if value != self.base:
+                day = self._day(old)
+                self.days[day] = self.days.get(day, 0) + value - self.base
+                self.base = value
+        for new in range(max(self.hour + 1, hour - size + 1), hour + 1):
+            cum[new % size] = total
+        self.hour = hour
+
+    def add(self, hour, count=1):
+        if hour > self.hour:
+            self._advance(hour)
+        if hour < self.first_hour:
+            day = self._day(hour)
+            self.days[day] = self.days.get(day, 0) + count
+            return
+        cum = self.cum
+        for h in range(hour, self.hour + 1):
+            cum[h % self.size] += count
+
+    def sum_hours(self, start, end):
+        # Сумма за часы [start, end] в пределах кольца - O(1)
+        start = max(start, self.first_hour)
+        end = min(end, self.hour)
+        if start > end:
+            return 0
+        before = self.cum[(start - 1) % self.size] if start > self.first_hour else self.base
+        return self.cum[end % self.size] - before
+
+    def sum_days(self, first_day, last_day):
+        # Дни целиком: часы из кольца плюс дневные итоги уже свёрнутых часов.
+        # Дневные итоги - по дням диапазона или по хранимым дням, смотря что
+        # короче, так что длинный диапазон не обходится по календарю
+        start = first_day * 24 - self.day_offset
+        end = (last_day + 1) * 24 - self.day_offset - 1
+        total = self.sum_hours(start, end)
+        if self.days:
+            last_old = min(last_day, self._day(self.first_hour))
+            if last_old - first_day < len(self.days):
+                for day in range(first_day, last_old + 1):
+                    total += self.days.get(day, 0)
+            else:
+                total += sum(count for day, count in self.days.items() if first_day <= day <= last_old)
+        return total
+
+    def snapshot(self):
+        # Копия на event loop: накопленные суммы по порядку часов - срезы массива
+        # без цикла в Python; сжатие - в encode_series() из пула потоков
+        start = self.first_hour % self.size
+        return {
+            'hour': self.hour,
+            'base': self.base,
+            'cum': self.cum[start:] + self.cum[:start],
+            'days': dict(self.days),
+        }
+
+    @classmethod
+    def from_json(cls, value, size, day_offset, now_hour):
+        series = cls(size, day_offset, value.get('hour') or now_hour)
+        first = series.first_hour
+        counts = [0] * size
+        if value.get('cum'):
+            stored = array('q', zlib.decompress(base64.b64decode(value['cum'])))
+            previous = value.get('base', 0)
+            for i, total in enumerate(stored):
+                stored[i], previous = total - previous, total
+            for offset, count in enumerate(stored[-size:], size - min(len(stored), size)):
+                counts[offset] = count
+            # Кольцо стало короче (уменьшили срок хранения) - лишние часы уходят в дни
+            for offset, count in enumerate(stored[:-size] if len(stored) > size else ()):
+                day = series._day(first - len(stored) + size + offset)
+                series.days[day] = series.days.get(day, 0) + count
+        for label, count in value.get('days', {}).items():
+            day = parse_day(label)
+            hour = day * 24 - day_offset
+            if hour >= first:
+                # День попадает в кольцо (старый формат или увеличенный срок хранения)
+                counts[min(hour, series.hour) - first] += count
+            else:
+                series.days[day] = series.days.get(day, 0) + count
+        running = 0
+        for offset, count in enumerate(counts):
+            running += count
+            series.cum[(first + offset) % size] = running
+        if now_hour > series.hour:
+            series._advance(now_hour)
+        return series
+
+
+class StatsStore:
+    def __init__(self, retention_days=90, day_offset=-1):
+        self.size = retention_days * 24
+        self.day_offset = day_offset
+        self.series = {}
+
+    def hour_of(self, timestamp):
+        return int(timestamp) // 3600
+
+    def day_of(self, timestamp):
+        return (self.hour_of(timestamp) + self.day_offset) // 24
+
+    def day_start(self, day):
+        # Начало дня статистики, секунды от эпохи
+        return (day * 24 - self.day_offset) * 3600
+
+    def add(self, session_name, hour, count=1):
+        series = self.series.get(session_name)
+        if series is None:
+            series = self.series[session_name] = HourlySeries(self.size, self.day_offset, hour)
+        series.add(hour, count)
+
+    def day_total(self, session_name, day):
+        return self.days_total(session_name, day, day)
+
+    def days_total(self, session_name, first_day, last_day):
+        series = self.series.get(session_name)
+        if series is None:
+            return 0
+        return series.sum_days(first_day, last_day)
+
+    def hours_total(self, session_name, start_hour, end_hour):
+        series = self.series.get(session_name)
+        if series is None:
+            return 0
+        return series.sum_hours(start_hour, end_hour)
+
+    def drop(self, session_name):
+        self.series.pop(session_name, None)
+
+    def load(self, stats, legacy_daily, now):
+        # stats - {сессия: encode_series()}; legacy_daily - старый формат {сессия: {'YYYY-MM-DD': count}}
+        now_hour = self.hour_of(now)
+        self.series = {}
+        for name, value in stats.items():
+            self.series[name] = HourlySeries.from_json(value, self.size, self.day_offset, now_hour)
+        for name, days in legacy_daily.items():
+            if name not in self.series:
+                self.series[name] = HourlySeries.from_json({'days': days}, self.size, self.day_offset, now_hour)
+
+    def snapshot(self, names=None):
+        # Для фоновой записи: только изменённые сессии (names) или все
+        if names is None:
+            names = self.series.keys()
+        return {name: self.series[name].snapshot() for name in names if name in self.series}
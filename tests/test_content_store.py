@@ -0,0 +1,58 @@
+import unittest
+
+from content_store import ContentStore
+from message_cache import MessageCache, CachedMessage
+
+
+def put_message(cache, key, chat_name, date=2_000_000_000):
+    record = CachedMessage('text', 1, cache.chat_name_idx(chat_name), date)
+    cache.put(key, record)
+    return record
+
+
+class ChatNameTest(unittest.TestCase):
+    def test_names_are_pruned_with_their_records(self):
+        store = ContentStore()
+        cache = MessageCache(max_entries=10, store=store)
+        for i in range(1000):
+            put_message(cache, i, f'chat {i}')
+        self.assertEqual(store.stats()['chat_names'], 10)
+        # Освободившиеся индексы переиспользуются - таблица не растёт
+        self.assertLessEqual(len(store._chat_names), 11)
+        cache.clear()
+        self.assertEqual(store.stats()['chat_names'], 0)
+
+    def test_shared_name_survives_until_last_record(self):
+        store = ContentStore()
+        first = MessageCache(store=store)
+        second = MessageCache(store=store)
+        record = put_message(first, (-100, 1), 'group')
+        second.put((-100, 1), record)
+        put_message(second, 5, 'group')
+        first.clear()
+        self.assertEqual(second.chat_name(record), 'group')
+        second.pop((-100, 1))
+        self.assertEqual(store.stats()['chat_names'], 1)
+        second.clear()
+        self.assertEqual(store.stats()['chat_names'], 0)
+
+    def test_replacing_record_keeps_its_name(self):
+        store = ContentStore()
+        cache = MessageCache(store=store)
+        put_message(cache, 7, 'private')
+        record = put_message(cache, 7, 'private')
+        self.assertEqual(cache.chat_name(record), 'private')
+        self.assertEqual(store.stats()['chat_names'], 1)
+
+    def test_name_never_cached_is_released(self):
+        store = ContentStore()
+        cache = MessageCache(store=store)
+        # Запись с диска только для уведомления - в кэш не попадает
+        record = CachedMessage('text', 1, cache.chat_name_idx('from disk'), 0)
+        self.assertEqual(cache.chat_name(record), 'from disk')
+        put_message(cache, 1, 'live')
+        self.assertEqual(store.stats()['chat_names'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
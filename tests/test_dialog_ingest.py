@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+from dialog_ingest import recent_dialogs
+
+
+class FloodWaitError(Exception):
+    def __init__(self, seconds):
+        super().__init__(f'flood wait {seconds}')
+        self.seconds = seconds
+
+
+class Message:
+    def __init__(self, msg_id):
+        self.id = msg_id
+
+
+class Dialog:
+    def __init__(self, index, start):
+        self.id = index
+        self.input_entity = ('peer', index)
+        self.entity = None
+        self.message = Message(index)
+        self.date = start - timedelta(minutes=index)
+        self.pinned = False
+
+
+class FakeClient:
+    # Диалоги от новых к старым; один FloodWait на второй странице
+    def __init__(self, count, flood_at=None):
+        start = datetime(2026, 10, 18)
+        self.dialogs = [Dialog(i, start) for i in range(count)]
+        self.flood_at = flood_at
+        self.requests = []
+
+    async def iter_dialogs(self, limit, offset_date=None, offset_id=0, offset_peer=None):
+        self.requests.append(limit)
+        position = 0
+        if offset_peer is not None:
+            position = offset_peer[1] + 1
+        for dialog in self.dialogs[position:position + limit]:
+            if dialog.id == self.flood_at:
+                self.flood_at = None
+                raise FloodWaitError(0)
+            yield dialog
+
+
+class RecentDialogsTest(unittest.TestCase):
+    def collect(self, client, limit, page_size):
+        seen = []
+        count = asyncio.run(recent_dialogs(client, lambda dialog: seen.append(dialog.id), limit, page_size))
+        return count, seen
+
+    def test_pages_up_to_limit(self):
+        client = FakeClient(50)
+        count, seen = self.collect(client, 25, 10)
+        self.assertEqual(count, 25)
+        self.assertEqual(seen, list(range(25)))
+        self.assertEqual(client.requests, [10, 10, 5])
+
+    def test_stops_when_dialogs_end(self):
+        client = FakeClient(12)
+        count, seen = self.collect(client, 100, 10)
+        self.assertEqual(seen, list(range(12)))
+        self.assertEqual(client.requests, [10, 10])
+
+    def test_resumes_after_flood_wait(self):
+        client = FakeClient(30, flood_at=14)
+        count, seen = self.collect(client, 30, 10)
+        self.assertEqual(seen, list(range(30)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from media_store import MediaStore, media_file_name
+
+
+class Media:
+    kind = 'photo'
+    file_ext = '.jpg'
+    downloadable = True
+
+    def __init__(self, media_id, size):
+        self.id = media_id
+        self.size = size
+
+
+def add_file(store, media, session_name='a'):
+    # Как после _download, без сети и диска
+    name = media_file_name(media)
+    store._files[name] = [media.size, set()]
+    store.total_bytes += media.size
+    store._add_owner(name, session_name)
+    store._enforce_global_quota()
+
+
+class GlobalQuotaTest(unittest.TestCase):
+    def test_oldest_files_are_evicted(self):
+        store = MediaStore('/nonexistent', quota=30)
+        for media_id in range(5):
+            add_file(store, Media(media_id, 10))
+        self.assertEqual(list(store._files), ['photo_2.jpg', 'photo_3.jpg', 'photo_4.jpg'])
+        self.assertEqual(store.total_bytes, 30)
+        self.assertEqual(store.evicted, 2)
+
+    def test_pinned_file_is_skipped(self):
+        store = MediaStore('/nonexistent', quota=30)
+        oldest = Media(0, 10)
+        for media_id in range(3):
+            add_file(store, Media(media_id, 10))
+        store._pinned[media_file_name(oldest)] = 1
+        add_file(store, Media(3, 10))
+        self.assertIn('photo_0.jpg', store._files)
+        self.assertNotIn('photo_1.jpg', store._files)
+        self.assertEqual(store.total_bytes, 30)
+
+    def test_only_pinned_files_left(self):
+        store = MediaStore('/nonexistent', quota=15)
+        first, second = Media(0, 10), Media(1, 10)
+        store._pinned[media_file_name(first)] = 1
+        store._pinned[media_file_name(second)] = 1
+        add_file(store, first)
+        add_file(store, second)
+        # Удалять нечего - превышение квоты остаётся до unpin, цикл не зависает
+        self.assertEqual(sorted(store._files), ['photo_0.jpg', 'photo_1.jpg'])
+        self.assertEqual(store.total_bytes, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
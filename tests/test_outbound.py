@@ -0,0 +1,83 @@
+import io
+import asyncio
+import unittest
+
+from outbound import OutboundSender, PRIORITY_ADMIN
+
+
+class FloodWaitError(Exception):
+    def __init__(self, seconds):
+        super().__init__(f'flood wait {seconds}')
+        self.seconds = seconds
+
+
+class FakeBot:
+    def __init__(self, flood_on=(), delay=0.01):
+        self.flood_on = set(flood_on)
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, entity, text):
+        await asyncio.sleep(self.delay)
+        if text in self.flood_on:
+            self.flood_on.discard(text)
+            raise FloodWaitError(0)
+        self.sent.append((entity, text))
+
+    async def send_file(self, entity, file):
+        data = [item.read() for item in file]
+        if 'flood' in self.flood_on:
+            self.flood_on.discard('flood')
+            raise FloodWaitError(0)
+        self.sent.append((entity, data))
+
+
+def run_sender(bot, scenario, **options):
+    async def run():
+        sender = OutboundSender(global_rate=1000, group_rate=1000, group_burst=5, **options)
+        sender.start(bot)
+        try:
+            return await scenario(sender)
+        finally:
+            await sender.close(timeout=5)
+    return asyncio.run(run())
+
+
+class OutboundOrderTest(unittest.TestCase):
+    def test_chat_order_survives_flood_wait(self):
+        bot = FakeBot(flood_on={'m1', 'm4'})
+
+        async def scenario(sender):
+            await asyncio.gather(*(sender.send_message(-100, f'm{i}') for i in range(10)))
+
+        run_sender(bot, scenario)
+        self.assertEqual([text for _, text in bot.sent], [f'm{i}' for i in range(10)])
+
+    def test_blocked_chat_does_not_hold_workers(self):
+        bot = FakeBot(delay=0)
+
+        async def scenario(sender):
+            # Личный чат: 1 сообщение/с, остальные ждут токена в отложенных
+            slow = [asyncio.create_task(sender.send_message(5, f'p{i}')) for i in range(3)]
+            await asyncio.sleep(0.05)
+            await asyncio.wait_for(sender.send_message(7, 'admin', priority=PRIORITY_ADMIN), 0.5)
+            self.assertEqual(sender.stats()['parked'], 2)
+            for task in slow:
+                task.cancel()
+
+        run_sender(bot, scenario, workers=1)
+        self.assertIn((7, 'admin'), bot.sent)
+
+    def test_retry_rewinds_album_files(self):
+        bot = FakeBot(flood_on={'flood'})
+
+        async def scenario(sender):
+            files = [io.BytesIO(b'one'), io.BytesIO(b'two')]
+            await sender.send_file(-100, files)
+
+        run_sender(bot, scenario)
+        self.assertEqual(bot.sent, [(-100, [b'one', b'two'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import queue
+import asyncio
+import unittest
+
+from shards import ShardSupervisor, WorkerLink, ForwardedDialogSet, shard_for
+from idset import CompactIdSet
+
+
+def echo_worker(shard, accounts, commands, events):
+    # Воркер для тестов: сообщает о запуске и о полученных командах
+    events.put(('started', shard, sorted(accounts)))
+    while True:
+        message = commands.get()
+        if message is None or message[0] == 'shutdown':
+            return
+        events.put(('command', shard, message))
+
+
+def make_accounts(names):
+    return {name: {'phone': name, 'dialogs': CompactIdSet([1, 2])} for name in names}
+
+
+class AddAccountTest(unittest.TestCase):
+    def run_supervisor(self, scenario):
+        async def run():
+            messages = asyncio.Queue()
+            supervisor = ShardSupervisor(2, echo_worker, make_accounts, messages.put_nowait)
+            supervisor.start([])
+            try:
+                await scenario(supervisor, messages)
+            finally:
+                await supervisor.close(timeout=10)
+        asyncio.run(run())
+
+    def test_add_account_spawns_its_shard(self):
+        async def scenario(supervisor, messages):
+            shard = supervisor.add_account('d')
+            self.assertEqual(shard, shard_for('d', 2))
+            self.assertEqual(supervisor.owner('d'), shard)
+            message = await asyncio.wait_for(messages.get(), 30)
+            self.assertEqual(message, ('started', shard, ['d']))
+            supervisor.clients[shard] = {'d': True}
+            self.assertTrue(supervisor.client_state('d'))
+
+        self.run_supervisor(scenario)
+
+    def test_add_account_to_running_worker(self):
+        async def scenario(supervisor, messages):
+            shard = supervisor.add_account('d')
+            await asyncio.wait_for(messages.get(), 30)
+            self.assertEqual(supervisor.add_account('e'), shard)
+            _, _, command = await asyncio.wait_for(messages.get(), 30)
+            self.assertEqual(command[:2], ('start', 'e'))
+            self.assertEqual(list(command[2]['dialogs']), [1, 2])
+            # Повторный запуск (после /login) - та же запись, без второго воркера
+            self.assertEqual(supervisor.add_account('e'), shard)
+            self.assertEqual(supervisor.stats()[1 - shard]['pid'], None)
+
+        self.run_supervisor(scenario)
+
+
+class WorkerStartTest(unittest.TestCase):
+    def test_start_command_adds_account(self):
+        started = []
+
+        async def on_start(name):
+            started.append(name)
+
+        async def run():
+            bot_data = {'accounts': {}}
+            link = WorkerLink(0, queue.Queue(), queue.Queue(), bot_data, on_start=on_start)
+            link.start()
+            link._handle(('start', 'e', {'dialogs': CompactIdSet([5])}))
+            await asyncio.sleep(0)
+            await link.close()
+            return bot_data
+
+        bot_data = asyncio.run(run())
+        self.assertEqual(started, ['e'])
+        self.assertIsInstance(bot_data['accounts']['e']['dialogs'], ForwardedDialogSet)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import unittest
+
+from stats_store import StatsStore, day_label, parse_day, parse_stats_range
+
+
+class SumDaysTest(unittest.TestCase):
+    def make_store(self):
+        # Кольцо на 2 дня: часы старше двух суток сворачиваются в дневные итоги
+        store = StatsStore(retention_days=2, day_offset=-1)
+        now_hour = 20000 * 24 + 1
+        store.add('a', now_hour - 24 * 10, 3)
+        store.add('a', now_hour - 24 * 5, 4)
+        store.add('a', now_hour, 5)
+        return store, store.day_of(now_hour * 3600)
+
+    def test_sums_rolled_up_and_ring_days(self):
+        store, today = self.make_store()
+        self.assertEqual(len(store.series['a'].days), 2)
+        self.assertEqual(store.days_total('a', today - 10, today), 12)
+        self.assertEqual(store.days_total('a', today - 7, today), 9)
+        self.assertEqual(store.day_total('a', today - 10), 3)
+        self.assertEqual(store.day_total('a', today - 9), 0)
+
+    def test_huge_range_is_fast(self):
+        store, today = self.make_store()
+        started = time.perf_counter()
+        self.assertEqual(store.days_total('a', today - 10 ** 9, today), 12)
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+
+class ParseStatsRangeTest(unittest.TestCase):
+    today = parse_day('2026-10-18')
+
+    def test_last_days(self):
+        self.assertEqual(parse_stats_range('7d', self.today), (self.today - 6, self.today))
+
+    def test_huge_count_is_clamped(self):
+        first_day, last_day = parse_stats_range('999999999d', self.today)
+        self.assertEqual((first_day, last_day), (0, self.today))
+        self.assertEqual(day_label(first_day), '1970-01-01')
+
+    def test_date_range(self):
+        self.assertEqual(
+            parse_stats_range('2026-10-20..2026-10-01', self.today),
+            (parse_day('2026-10-01'), self.today)
+        )
+
+    def test_bad_range(self):
+        with self.assertRaises(ValueError):
+            parse_stats_range('week', self.today)
+
+
+if __name__ == '__main__':
+    unittest.main()
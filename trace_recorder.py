@@ -0,0 +1,148 @@
+# Запись трассы обновлений аккаунтов (TRACE_FILE) для воспроизведения в бенчмарках.
+#
+# Пишутся только метаданные: время от начала записи, сессия, чат, ID сообщений,
+# тип и размер медиа, списки удалённых ID. Имена сессий и ID чатов заменяются
+# солёным хешем (соль случайная для каждой записи, если не задана TRACE_SALT),
+# текст и названия не пишутся вовсе. Формат - NDJSON, как у синтетических трасс
+# benchmarks/traces.py; для пути с .gz - сжатый gzip.
+# Записи копятся в памяти и дописываются в файл из пула потоков раз в
+# flush_interval секунд. При достижении max_bytes запись останавливается.
+
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+
+# Помеченные ID: -100xxxxxxxxxx - каналы и супергруппы, -xxx - обычные группы
+CHANNEL_MARK = -1_000_000_000_000
+# 48 бит хеша: коллизии пренебрежимо редки даже на миллионе чатов
+PEER_HASH_BITS = 48
+
+
+def unmark_peer(peer_id):
+    if peer_id < CHANNEL_MARK:
+        return CHANNEL_MARK - peer_id
+    return abs(peer_id)
+
+
+def read_trace(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TraceRecorder:
+    def __init__(self, path, salt=None, flush_interval=2.0, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.salt = salt.encode('utf-8') if salt else os.urandom(16)
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.records = 0
+        self.written_bytes = 0
+        self._pending = []
+        self._started = time.monotonic()
+        self._peers = {}  # peer id -> хеш, чтобы не считать заново
+        self._sessions = {}
+        self._task = None
+        self._lock = None
+
+    def start(self):
+        if self._task is None:
+            self._lock = asyncio.Lock()
+            self._started = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+            print(f"🎞️ Запись трассы обновлений: {self.path}")
+
+    def _hash(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8, key=self.salt).digest()
+        return int.from_bytes(digest, 'little') >> (64 - PEER_HASH_BITS)
+
+    def _peer(self, peer_id):
+        value = self._peers.get(peer_id)
+        if value is None:
+            value = self._peers[peer_id] = self._hash(unmark_peer(peer_id))
+        return value
+
+    def _session(self, session_name):
+        value = self._sessions.get(session_name)
+        if value is None:
+            value = self._sessions[session_name] = f's{self._hash(session_name):012x}'
+        return value
+
+    def _now(self):
+        return round(time.monotonic() - self._started, 4)
+
+    def message(self, session_name, chat_id, is_channel, msg_id, out, media_kind=None, media_size=0):
+        # chat_id - как event.chat_id (помеченный)
+        if not self.enabled:
+            return
+        self._pending.append({
+            't': self._now(), 'session': self._session(session_name), 'type': 'message',
+            'peer': self._peer(chat_id), 'channel': bool(is_channel), 'msg_id': msg_id,
+            'out': bool(out), 'media': media_kind, 'size': media_size or 0,
+        })
+
+    def deleted(self, session_name, chat_id, deleted_ids):
+        # chat_id известен только для каналов и супергрупп
+        if not self.enabled:
+            return
+        self._pending.append({
+            't': self._now(), 'session': self._session(session_name), 'type': 'deleted',
+            'peer': self._peer(chat_id) if chat_id is not None else None,
+            'ids': list(deleted_ids),
+        })
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка записи трассы: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, batch)
+            self.records += len(batch)
+            if self.enabled and self.written_bytes >= self.max_bytes:
+                self.enabled = False
+                print(f"⚠️ Трасса достигла {self.written_bytes // (1024 * 1024)} МБ, запись остановлена")
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+                       for record in batch).encode('utf-8')
+        if self.path.endswith('.gz'):
+            # Каждая пачка - отдельный член gzip, read_trace читает их подряд
+            data = gzip.compress(data)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self.written_bytes += len(data)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'records': self.records,
+            'pending': len(self._pending),
+            'bytes': self.written_bytes,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()